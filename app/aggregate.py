@@ -0,0 +1,63 @@
+'''
+    Columnar aggregation over story lists, backed by numpy.
+    numpy is imported inside the functions so the service starts without it.
+'''
+
+def top_k(values, k: int):
+    '''
+      Indices of the k largest values, largest first, equal values keep their original order.
+      argpartition finds the k-th largest value in linear time, only the candidates above it are sorted.
+    '''
+    import numpy as np
+    values = np.asarray(values)
+    if k<=0 or len(values)==0:
+        return np.empty(0, dtype=np.intp)
+    if len(values)>k:
+        kth = values[np.argpartition(values, len(values)-k)[len(values)-k]]
+        candidates = np.flatnonzero(values>=kth)
+    else:
+        candidates = np.arange(len(values))
+    order = np.lexsort((candidates, -values[candidates]))
+    return candidates[order][:k]
+
+def rank_publishers_by_category(category_stories: dict, publisher_num: int, story_num: int):
+    '''
+      category_stories maps category id to the stories returned by the proxy, each story has source.id and picksCount.
+      Return {category_id: [(publisher_id, [story, ...]), ...]} with the publisher_num publishers having the most picks
+      in every category and their story_num most picked stories, same order as sorting the lists in python.
+      Categories without stories are left out.
+    '''
+    import numpy as np
+    category_ids = [category_id for category_id, stories in category_stories.items() if stories]
+    if len(category_ids)==0:
+        return {}
+    stories = [story for category_id in category_ids for story in category_stories[category_id]]
+    category_index = np.repeat(np.arange(len(category_ids)), [len(category_stories[category_id]) for category_id in category_ids])
+    publisher_ids, publisher_index = np.unique(np.array([str(story['source']['id']) for story in stories]), return_inverse=True)
+    picks = np.fromiter((story['picksCount'] for story in stories), dtype=np.int64, count=len(stories))
+
+    # one group per (category, publisher), reduced with bincount
+    publisher_count = len(publisher_ids)
+    group = category_index*publisher_count + publisher_index
+    group_size = len(category_ids)*publisher_count
+    sums = np.bincount(group, weights=picks, minlength=group_size).astype(np.int64)
+    counts = np.bincount(group, minlength=group_size)
+    first_seen = np.full(group_size, len(stories), dtype=np.int64)
+    np.minimum.at(first_seen, group, np.arange(len(stories)))
+
+    # stories of a group are contiguous after a stable sort, in their original order
+    story_order = np.argsort(group, kind='stable')
+    group_start = np.searchsorted(group[story_order], np.arange(group_size), side='left')
+
+    result = {}
+    for row, category_id in enumerate(category_ids):
+        offset = row*publisher_count
+        present = np.flatnonzero(counts[offset:offset+publisher_count])
+        present = present[np.argsort(first_seen[offset+present], kind='stable')]
+        ranked = []
+        for publisher in present[top_k(sums[offset+present], publisher_num)]:
+            start = group_start[offset+publisher]
+            members = story_order[start:start+counts[offset+publisher]]
+            ranked.append((publisher_ids[publisher].item(), [stories[idx] for idx in members[top_k(picks[members], story_num)]]))
+        result[category_id] = ranked
+    return result
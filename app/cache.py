@@ -0,0 +1,14 @@
+'''
+    Local sqlite caches, each cache is a database file under CACHE_DIR.
+    The caches only save work between runs on the same instance, losing them is always safe.
+'''
+import os
+import sqlite3
+import app.config as config
+
+def connect_cache(name: str):
+    cache_dir = os.environ.get('CACHE_DIR', config.DEFAULT_CACHE_DIR)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(cache_dir, f'{name}.sqlite'), timeout=config.CACHE_LOCK_TIMEOUT)
+    return conn
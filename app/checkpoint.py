@@ -0,0 +1,150 @@
+'''
+    Checkpoints of the jobs which publish one entity (publisher, category) at a time.
+    A job records every entity it has published under its name and run window, a retry within the same window
+    skips them and only processes the remainder. The window is the period of the job when it has one (the month of
+    media_statements), otherwise the start time of the first attempt, which retries within CHECKPOINT_WINDOW resume.
+    The checkpoint is cleared once a run has published everything, so the next scheduled run starts from scratch.
+    CHECKPOINT_BACKEND=local keeps them in a sqlite cache of the instance, mongo shares them between instances
+    and is the default when MONGO_URL is set, so a retry on another instance resumes too.
+'''
+import os
+import time
+import threading
+import app.config as config
+import app.context as context
+from app.cache import connect_cache
+
+_mongo_indexed = False
+_mongo_lock = threading.Lock()
+
+def backend():
+    return os.environ.get('CHECKPOINT_BACKEND') or config.CHECKPOINT_BACKEND or ('mongo' if os.environ.get('MONGO_URL') else 'local')
+
+def resume_window(store, job: str, seconds: int=None):
+    '''
+      Window of the run, the start time of the latest attempt of the job in the last CHECKPOINT_WINDOW seconds
+      which left a checkpoint, or now when there is none.
+    '''
+    seconds = seconds or int(os.environ.get('CHECKPOINT_WINDOW', config.CHECKPOINT_WINDOW))
+    now = time.time()
+    started = []
+    for window in store.windows(job):
+        try:
+            start_time = float(window)
+        except ValueError:
+            continue # the window of a period
+        if now-start_time<seconds:
+            started.append(start_time)
+    return str(int(max(started))) if started else str(int(now))
+
+class LocalStore:
+    def _connect(self):
+        conn = connect_cache('checkpoint')
+        conn.execute('CREATE TABLE IF NOT EXISTS checkpoint(job TEXT, window TEXT, entity TEXT, done_at REAL, PRIMARY KEY (job, window, entity))')
+        return conn
+
+    def load(self, job: str, window: str):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM checkpoint WHERE done_at<?', (time.time()-config.CHECKPOINT_TTL,))
+            rows = conn.execute('SELECT entity FROM checkpoint WHERE job=? AND window=?', (job, window)).fetchall()
+        finally:
+            conn.close()
+        return {row[0] for row in rows}
+
+    def windows(self, job: str):
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT DISTINCT window FROM checkpoint WHERE job=?', (job,)).fetchall()
+        finally:
+            conn.close()
+        return [row[0] for row in rows]
+
+    def mark(self, job: str, window: str, entity: str):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO checkpoint VALUES (?, ?, ?, ?)', (job, window, entity, time.time()))
+        finally:
+            conn.close()
+
+    def clear(self, job: str, window: str):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM checkpoint WHERE job=? AND window=?', (job, window))
+        finally:
+            conn.close()
+
+class MongoStore:
+    '''
+      One document per job and window in the checkpoints collection, expired by a TTL index on updatedAt.
+    '''
+    def _collection(self):
+        global _mongo_indexed
+        from app.mongo import connect_db
+        collection = connect_db(os.environ['MONGO_URL'], os.environ.get('ENV', 'dev')).checkpoints
+        with _mongo_lock:
+            if not _mongo_indexed:
+                collection.create_index('updatedAt', expireAfterSeconds=config.CHECKPOINT_TTL)
+                _mongo_indexed = True
+        return collection
+
+    def load(self, job: str, window: str):
+        record = self._collection().find_one({"_id": f'{job}:{window}'})
+        return set(record['entities']) if record else set()
+
+    def windows(self, job: str):
+        return self._collection().distinct('window', {"job": job})
+
+    def mark(self, job: str, window: str, entity: str):
+        from datetime import datetime, timezone
+        self._collection().update_one(
+            {"_id": f'{job}:{window}'},
+            {"$addToSet": {"entities": entity}, "$set": {"job": job, "window": window, "updatedAt": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+
+    def clear(self, job: str, window: str):
+        self._collection().delete_one({"_id": f'{job}:{window}'})
+
+STORES = {
+    'local': LocalStore,
+    'mongo': MongoStore,
+}
+
+class Checkpoint:
+    def __init__(self, job: str, window: str=None, store=None):
+        self.job = job
+        self.store = store or STORES[backend()]()
+        self.window = window or resume_window(self.store, job)
+        self.completed = self.store.load(self.job, self.window)
+        self._lock = threading.Lock()
+        if self.completed:
+            print(f"{job}: resume from the checkpoint of window {self.window}, {len(self.completed)} entities already done")
+
+    def done(self, entity):
+        return str(entity) in self.completed
+
+    def remaining(self, entities: list, key=None):
+        '''
+          Entities which are not done yet, key gives the id of an entity.
+        '''
+        key = key or (lambda entity: entity)
+        remaining = [entity for entity in entities if not self.done(key(entity))]
+        if len(remaining)<len(entities):
+            context.count('checkpoint_skipped', len(entities)-len(remaining))
+        return remaining
+
+    def mark(self, entity):
+        with self._lock:
+            self.store.mark(self.job, self.window, str(entity))
+            self.completed.add(str(entity))
+
+    def complete(self):
+        '''
+          Every entity is published, clear the checkpoint.
+        '''
+        self.store.clear(self.job, self.window)
+        self.completed = set()
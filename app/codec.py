@@ -0,0 +1,70 @@
+'''
+    JSON codec of the artifacts. JSON_CODEC picks orjson, msgspec or the stdlib json, by default the first one installed.
+    Every codec writes compact UTF-8 bytes, datetimes in ISO 8601, decimals as numbers and records through to_dict().
+'''
+import os
+import json
+import datetime
+import decimal
+import threading
+
+_codec = None
+_codec_lock = threading.Lock()
+
+def _default(value):
+    if hasattr(value, 'to_dict'):
+        return value.to_dict()
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+def _orjson():
+    import orjson
+    option = orjson.OPT_NON_STR_KEYS
+    return lambda data: orjson.dumps(data, default=_default, option=option), orjson.loads
+
+def _msgspec():
+    import msgspec
+    try:
+        encoder = msgspec.json.Encoder(enc_hook=_default, decimal_format='number')
+    except TypeError:
+        encoder = msgspec.json.Encoder(enc_hook=_default)
+    return encoder.encode, msgspec.json.decode
+
+def _stdlib():
+    dumps = lambda data: json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=_default).encode('utf-8')
+    return dumps, json.loads
+
+# name => factory returning (dumps, loads), in order of preference
+CODECS = {
+    'orjson': _orjson,
+    'msgspec': _msgspec,
+    'json': _stdlib,
+}
+
+def load_codec(name: str='auto'):
+    '''
+      Return (name, dumps, loads) of the codec, auto picks the first one which is installed.
+    '''
+    if name!='auto':
+        return (name, *CODECS[name]())
+    for candidate, factory in CODECS.items():
+        try:
+            return (candidate, *factory())
+        except ImportError:
+            continue
+
+def codec():
+    global _codec
+    with _codec_lock:
+        if _codec==None:
+            _codec = load_codec(os.environ.get('JSON_CODEC', 'auto'))
+    return _codec
+
+def dumps(data):
+    return codec()[1](data)
+
+def loads(content):
+    return codec()[2](content)
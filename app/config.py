@@ -15,10 +15,62 @@ upload_configs = {
     "content_type_json": 'application/json',
     }
 
+DEFAULT_LOCAL_STORAGE_DIR = 'storage' # used when STORAGE_BACKEND=local
+
 DEFAULT_GQL_TTL = 3600
+REFERENCE_DATA_TTL = 300 # publishers and categories fetched by one job are reused by the others for a while
 DEFAULT_CATEGORY_LATEST_GQL_DAYS = 2
 DEFAULT_CATEGORY_LATEST_TTL = 3600
 DEFAULT_REQUEST_TIMEOUT = 30
+HTTP_POOL_CONNECTIONS = 4 # hosts kept in the shared requests session
+HTTP_POOL_MAXSIZE = 16 # connections kept for each host
+
+### for deadlines
+DEFAULT_JOB_TIMEOUT = 300 # seconds, the request timeout of the Cloud Run service, the deploy sets it in JOB_TIMEOUT
+JOB_TIMEOUTS = { # cronjob => seconds it may run when JOB_TIMEOUT is not set, the statements run to completion as long as the service lets them
+    'month_statements': 3600,
+    'media_statements': 3600,
+}
+JOB_DEADLINE_MARGIN = 10 # seconds of the request timeout kept to respond after the job stopped
+JOB_PUBLISH_RESERVE = 15 # seconds a job keeps to publish what it has done before starting another unit of work
+UPLOAD_TIMEOUT = 60 # seconds, same as the default of google-cloud-storage
+
+### for priorities
+PRIORITY_CLASSES = ('realtime', 'default', 'batch') # most urgent first
+JOB_PRIORITIES = { # cronjob => priority class, the others are default
+    'hotpage_most_popular_story': 'realtime',
+    'hotpage_most_like_comments': 'realtime',
+    'hotpage_sponsored_publishers': 'realtime',
+    'month_statements': 'batch',
+    'media_statements': 'batch',
+    'publisher_stories': 'batch',
+}
+
+### for scheduler
+SCHEDULER_WORKERS = 4 # threads running the jobs of every priority class
+SCHEDULER_REALTIME_WORKERS = 1 # more threads which only run realtime jobs
+SCHEDULER_CLASS_LIMITS = {'batch': 2} # most jobs of a priority class running at once
+SCHEDULER_PROCESSES = 2 # processes for the CPU-heavy work of the jobs, 0 runs it in the job thread
+
+### for concurrency limiting
+GQL_LIMIT_INITIAL = 8 # concurrent requests to each host at start
+GQL_LIMIT_MIN = 1
+GQL_LIMIT_MAX = 32
+GQL_LIMIT_BACKOFF = 0.7 # factor of the limit on overload
+GQL_LIMIT_TOLERANCE = 2 # recent latency over this many times the baseline counts as overload
+GQL_LIMIT_SHARES = {'realtime': 1.0, 'default': 0.75, 'batch': 0.5} # part of the limit each priority class may fill
+
+### for resilience
+GQL_RETRY_ATTEMPTS = 3 # attempts of an idempotent query, mutations are sent once
+GQL_RETRY_BASE_DELAY = 0.5 # seconds, the backoff before retry n is drawn from [0, base*2**n]
+GQL_RETRY_MAX_DELAY = 8 # seconds, cap of the backoff
+GQL_HEDGE_PERCENTILE = 0 # latency percentile after which a duplicate query is sent, 0 disables hedging
+GQL_HEDGE_SAMPLES = 200 # recent latencies kept per operation
+GQL_HEDGE_MIN_SAMPLES = 20 # no hedging before an operation has this many latencies
+GQL_HEDGE_MIN_DELAY = 0.2 # seconds, never hedge sooner
+GQL_HEDGE_WORKERS = 8
+GQL_BREAKER_FAILURES = 5 # consecutive transient failures which open the circuit of an endpoint
+GQL_BREAKER_RESET = 30 # seconds before an open circuit lets a trial query through
 
 ### for cronjob
 DEFAULT_MOST_FOLLOWER_NUM = 5
@@ -35,9 +87,11 @@ HOTPAGE_POPULAR_STORY_DAYS = 7
 HOTPAGE_MOST_LIKE_DAYS = 7
 HOTPAGE_MOST_LIKE_COMMENTS_NUM = 4 # How many comments to reveal on hotpage
 HOTPAGE_RECENT_COMMENTS_NUM = 2000 # How many comments to fetch likeCount recently
+HOTPAGE_COMMENTS_PAGE_SIZE = 500 # Comments ranked per request while streaming the recent comments
 PUBLISHER_STORIES_NUM = 240
 RECOMMEND_SPONSOR_PUBLISHER_NUM = 5
 RECOMMEND_SPONSOR_STORY_NUM = 3
+RECOMMEND_SPONSOR_CONCURRENCY = 4 # proxy calls in flight for category_recommend_sponsors
 TRANSACTION_NOTIFY_DAYS = 3
 
 ### take number for each feeeder
@@ -45,8 +99,58 @@ DEFAULT_READR_TAKE = 3
 DEFAULT_MM_EXTERNAL_TAKE = 20
 DEFAULT_MM_TAKE = 10
 
+### for statements
+DEFAULT_PAGEVIEW_ROLLUP_TABLE = 'publisher_pageview_daily'
+DEFAULT_REVENUE_ROLLUP_TABLE = 'ga_revenue_daily' # closed days of GA revenue, override with BIGQUERY_TABLE_REVENUE
+PAGEVIEW_SETTLE_DAYS = 1 # Recent days which may still receive late click logs, always scanned and never materialised
+GA_FRESHNESS_DAYS = 3 # GA may still revise the data of recent days, always query them and never cache
+
+### for watermarks
+WATERMARK_MAX_AGE = 21600 # seconds, a job skipped by its watermark still runs in full after this
+NOOP_RESULT = 'noop' # returned by the jobs skipped because their source is unchanged
+
+### for leases
+LEASE_POLICY = 'skip' # when another run holds the lease of a job: 'skip' returns at once, 'coalesce' waits for that run to end, 'off' takes no lease
+LEASE_TTL = 60 # seconds a lease outlives the last heartbeat of its holder
+LEASE_POLL_INTERVAL = 2 # seconds between checks while coalescing
+LEASE_MONGO_TIMEOUT = 5 # seconds each lease operation may wait for Mongo, so an unreachable Mongo does not hold up the jobs
+LEASE_BUSY_RESULT = 'busy'
+LEASE_COALESCED_RESULT = 'coalesced'
+
+### for checkpoints
+CHECKPOINT_BACKEND = None # 'local' keeps the checkpoints in the sqlite cache of the instance, 'mongo' shares them through MONGO_URL, None is mongo when MONGO_URL is set
+CHECKPOINT_WINDOW = 3600 # seconds after the first attempt of a run in which a retry resumes from its checkpoint
+CHECKPOINT_TTL = 172800 # seconds before a checkpoint left by a run which never completed is dropped
+
+### for rolling counters
+COUNTER_RETENTION_DAYS = 8 # Longest window the counters answer, older buckets are dropped
+COUNTER_BUCKET_SECONDS = 3600
+COUNTER_REFRESH_OVERLAP = 300 # seconds before the latest counted pick which are read again, for the picks committed late
+COUNTER_RECONCILE_SECONDS = 3600 # seconds between the scans of the active pick ids which take out the deactivated or deleted picks
+COUNTER_PAGE_SIZE = 5000
+
+### for profiling
+DEFAULT_PROFILE_DIR = 'profiles'
+DEFAULT_PROFILE_SAMPLE_RATE = 0.0 # ratio of the cronjob runs to profile without being asked
+DEFAULT_PROFILE_SAMPLE_MODE = 'cpu'
+PROFILE_TOP_NUM = 30
+
+### for local cache
+DEFAULT_CACHE_DIR = 'cache'
+CACHE_LOCK_TIMEOUT = 30
+
+### for postgres
+DB_POOL_MAX_CONNECTIONS = 4
+DB_REPLICA_POLICY = 'replica' # 'replica' sends read-only queries to DB_REPLICA_DSN when it is set, 'primary' never does
+DB_REPLICA_MAX_LAG = 30 # seconds, a replica further behind is skipped
+DB_REPLICA_CHECK_INTERVAL = 30 # seconds between lag checks
+DB_REPLICA_RETRY_AFTER = 60 # seconds reads stay on the primary after the replica failed or lagged
+
 ### for Meilisearch
 MEILISEARCH_PUBLISHER_INDEX = 'mesh_publisher'
+MEILISEARCH_BATCH_SIZE = 1000
+MEILISEARCH_TASK_TIMEOUT = 60 # seconds to wait for each indexing task
+MEILISEARCH_TASK_INTERVAL = 200 # ms between task status polls
 
 ### for mongo
 MOST_NOTIFY_RECORDS = 200
@@ -0,0 +1,92 @@
+'''
+    Context of a cronjob run. main.py starts one for every /cronjob/* request, the shared helpers reach it
+    through a context variable, so nothing has to be passed through the job signatures.
+    Threads started by the jobs see it as long as they run in a copy of the caller's context (tool.concurrent_map does).
+    It holds the stats of the run and its deadline, the downstream calls take their timeouts from the remaining budget.
+'''
+import os
+import time
+import threading
+import contextvars
+import app.config as config
+
+_current = contextvars.ContextVar('job_context', default=None)
+
+class DeadlineExceeded(Exception):
+    pass
+
+class JobContext:
+    def __init__(self, job: str, budget: float=None):
+        self.job = job
+        self.priority = config.JOB_PRIORITIES.get(job, 'default')
+        self.stats = {}
+        self.lease = None # lease of the job held by the run, set by the lease middleware
+        self.outcome = None # busy or coalesced when the lease kept the run from starting, set by the lease middleware
+        self.deadline = None if budget==None else time.monotonic()+budget
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        return None if self.deadline==None else self.deadline-time.monotonic()
+
+    def count(self, name: str, amount: int=1):
+        with self._lock:
+            self.stats[name] = self.stats.get(name, 0) + amount
+
+def current():
+    '''
+      Context of the running job, None outside of a cronjob run.
+    '''
+    return _current.get()
+
+def priority():
+    '''
+      Priority class of the running job, default outside of a cronjob run.
+    '''
+    job_context = _current.get()
+    return 'default' if job_context==None else job_context.priority
+
+def count(name: str, amount: int=1):
+    job_context = _current.get()
+    if job_context!=None:
+        job_context.count(name, amount)
+
+def remaining():
+    '''
+      Seconds left before the deadline of the running job, None without one.
+    '''
+    job_context = _current.get()
+    return None if job_context==None else job_context.remaining()
+
+def expired(reserve: float=0):
+    '''
+      Whether less than reserve seconds are left, jobs check it before starting the next unit of work.
+    '''
+    left = remaining()
+    return left!=None and left<=reserve
+
+def check():
+    timeout()
+
+def timeout(default: float=None):
+    '''
+      Timeout of a downstream call, default capped by the remaining budget. Raise DeadlineExceeded when nothing is left.
+    '''
+    left = remaining()
+    if left==None:
+        return default
+    if left<=0:
+        raise DeadlineExceeded(f'deadline of {_current.get().job} exceeded')
+    return left if default==None else min(default, left)
+
+def job_budget(job: str=None):
+    '''
+      Seconds a job may run, JOB_TIMEOUT (the request timeout of the service) minus the margin kept to respond.
+      Without JOB_TIMEOUT the job gets its own timeout of JOB_TIMEOUTS, or DEFAULT_JOB_TIMEOUT.
+    '''
+    job_timeout = float(os.environ.get('JOB_TIMEOUT') or config.JOB_TIMEOUTS.get(job, config.DEFAULT_JOB_TIMEOUT))
+    return max(job_timeout-config.JOB_DEADLINE_MARGIN, 0)
+
+def start(job: str, budget: float=None):
+    job_context = JobContext(job, budget)
+    _current.set(job_context)
+    return job_context
@@ -0,0 +1,213 @@
+'''
+    Rolling-window pick counters kept in the Mongo database of MONGO_URL, shared by every instance.
+    Without MONGO_URL they are disabled and the jobs count their windows with GraphQL instead.
+    Read picks are counted into hourly buckets per entity (counter_buckets), and every counted pick is recorded
+    with the buckets it was added to (counter_picks). A refresh only reads the active picks created since the last one,
+    a new pick is counted once and its record keeps a later or concurrent refresh from counting it again.
+    Every COUNTER_RECONCILE_SECONDS one refresh reads the ids of all the active picks of the retention window,
+    and the recorded picks which are not among them, deactivated or deleted since they were counted, are taken
+    back out of their buckets. The window sums are aggregated from the buckets.
+    Buckets and records expire by TTL once they fall out of COUNTER_RETENTION_DAYS.
+'''
+import os
+import time
+import threading
+from datetime import datetime, timezone
+from dateutil.parser import isoparse
+import app.config as config
+from app.gql import gql_execute, gql_read_picks, gql_read_pick_ids
+from app.mongo import connect_db, deadline
+
+def _story_bucket(pick):
+    story = pick.get('story') or {}
+    return story.get('id'), story.get('published_date')
+
+def _publisher_bucket(pick):
+    story = pick.get('story') or {}
+    if not story.get('category') or not story.get('source'):
+        return None, None
+    return story['source']['id'], story.get('published_date')
+
+def _member_bucket(pick):
+    member = pick.get('member') or {}
+    return member.get('id'), pick.get('createdAt')
+
+# metric => function returning (entity, bucket time) of a pick
+# story and publisher reads are bucketed by the story's published_date since the jobs window on it, member reads by the pick time
+METRICS = {
+    'story_read': _story_bucket,
+    'publisher_read': _publisher_bucket,
+    'member_read': _member_bucket,
+}
+_refresh_lock = threading.Lock()
+_index_lock = threading.Lock()
+_indexed = False
+
+def enabled():
+    return 'MONGO_URL' in os.environ
+
+def retention_days():
+    return int(os.environ.get('COUNTER_RETENTION_DAYS', config.COUNTER_RETENTION_DAYS))
+
+def _db():
+    global _indexed
+    db = connect_db(os.environ['MONGO_URL'], os.environ.get('ENV', 'dev'))
+    with _index_lock:
+        if not _indexed:
+            db.counter_buckets.create_index([('metric', 1), ('bucket', 1)])
+            db.counter_buckets.create_index('expiresAt', expireAfterSeconds=0)
+            db.counter_picks.create_index('expiresAt', expireAfterSeconds=0)
+            _indexed = True
+    return db
+
+def _expires_at(bucket_time: float):
+    return datetime.fromtimestamp(bucket_time + retention_days()*86400, timezone.utc)
+
+def _bucket_keys(pick, retention_start: float):
+    '''
+      [metric, entity, bucket] of each bucket the pick counts into, the buckets older than the retention are left out.
+    '''
+    keys = []
+    for metric, bucket_of in METRICS.items():
+        entity, bucket_time = bucket_of(pick)
+        if entity==None or bucket_time==None:
+            continue
+        bucket_time = isoparse(bucket_time).timestamp()
+        if bucket_time<retention_start:
+            continue
+        keys.append([metric, str(entity), int(bucket_time//config.COUNTER_BUCKET_SECONDS)])
+    return keys
+
+def _fetch_picks(gql_endpoint, where: dict, query: str=gql_read_picks):
+    '''
+      Read picks matching where, in pages ordered by id.
+    '''
+    last_id = 0
+    while True:
+        variables = {
+            "where": {**where, "id": {"gt": str(last_id)}},
+            "take": config.COUNTER_PAGE_SIZE,
+        }
+        picks = gql_execute(gql_endpoint, query, variables)['picks'] or []
+        yield from picks
+        if len(picks)<config.COUNTER_PAGE_SIZE:
+            break
+        last_id = int(picks[-1]['id'])
+
+def _record_picks(db, added: dict):
+    '''
+      Record the picks to count, return the ids of those which were not recorded by an earlier refresh.
+    '''
+    from pymongo import InsertOne
+    from pymongo.errors import BulkWriteError
+    pick_ids = list(added.keys())
+    if not pick_ids:
+        return set()
+    records = [
+        InsertOne({
+            "_id": pick_id,
+            "keys": added[pick_id]['keys'],
+            "createdAt": added[pick_id]['createdAt'],
+            "expiresAt": _expires_at((max(key[2] for key in added[pick_id]['keys'])+1)*config.COUNTER_BUCKET_SECONDS),
+        })
+        for pick_id in pick_ids
+    ]
+    recorded = set(pick_ids)
+    try:
+        db.counter_picks.bulk_write(records, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        if any(error['code']!=11000 for error in errors):
+            raise
+        recorded -= {pick_ids[error['index']] for error in errors}
+    return recorded
+
+def _stale_picks(db, gql_endpoint, now: float, retention_start: float):
+    '''
+      Ids of the recorded picks which are no longer active read picks, empty unless this refresh claims the reconcile
+      which is due every COUNTER_RECONCILE_SECONDS. The picks created in the last COUNTER_REFRESH_OVERLAP seconds
+      may still be committing, they are left to the next reconcile.
+    '''
+    claimed = db.counter_state.find_one_and_update(
+        {"_id": "pick", "reconciledAt": {"$not": {"$gt": now-config.COUNTER_RECONCILE_SECONDS}}},
+        {"$set": {"reconciledAt": now}}
+    )
+    if claimed==None:
+        return []
+    where = {"kind": {"equals": "read"}, "is_active": {"equals": True}, "createdAt": {"gt": datetime.fromtimestamp(retention_start, timezone.utc).isoformat()}}
+    active = {pick['id'] for pick in _fetch_picks(gql_endpoint, where, gql_read_pick_ids)}
+    recorded = db.counter_picks.find({"createdAt": {"$lt": now-config.COUNTER_REFRESH_OVERLAP}}, {"_id": 1})
+    return [record['_id'] for record in recorded if record['_id'] not in active]
+
+def refresh(gql_endpoint, now: float=None):
+    '''
+      Count the active picks created since the last refresh and take out the stale ones when the reconcile is due,
+      return how many picks were read. The first refresh reads the active picks of the whole retention window.
+    '''
+    from pymongo import UpdateOne
+    with _refresh_lock, deadline():
+        now = now or time.time()
+        retention_start = now - retention_days()*86400
+        db = _db()
+        state = db.counter_state.find_one({"_id": "pick"})
+        since = retention_start
+        if state!=None and state.get('createdAt')!=None:
+            # picks may be committed out of createdAt order, the overlap is read again and skipped by their records
+            since = max(since, state['createdAt'] - config.COUNTER_REFRESH_OVERLAP)
+        where = {"kind": {"equals": "read"}, "is_active": {"equals": True}, "createdAt": {"gt": datetime.fromtimestamp(since, timezone.utc).isoformat()}}
+
+        added, read = {}, 0
+        created_at = since
+        for pick in _fetch_picks(gql_endpoint, where):
+            read += 1
+            pick_created_at = isoparse(pick['createdAt']).timestamp()
+            created_at = max(created_at, pick_created_at)
+            keys = _bucket_keys(pick, retention_start)
+            if keys:
+                added[pick['id']] = {"keys": keys, "createdAt": pick_created_at}
+
+        # +1 for every newly recorded pick, -1 for every recorded pick which is no longer active
+        changes = {}
+        recorded = _record_picks(db, added)
+        for pick_id in recorded:
+            for key in added[pick_id]['keys']:
+                changes[tuple(key)] = changes.get(tuple(key), 0) + 1
+        taken_out = 0
+        stale = _stale_picks(db, gql_endpoint, now, retention_start) if state!=None else []
+        for pick_id in stale:
+            record = db.counter_picks.find_one_and_delete({"_id": pick_id})
+            if record==None:
+                continue
+            taken_out += 1
+            for key in record['keys']:
+                changes[tuple(key)] = changes.get(tuple(key), 0) - 1
+        updates = [
+            UpdateOne(
+                {"_id": f'{metric}:{entity}:{bucket}'},
+                {"$inc": {"count": count}, "$setOnInsert": {"metric": metric, "entity": entity, "bucket": bucket, "expiresAt": _expires_at((bucket+1)*config.COUNTER_BUCKET_SECONDS)}},
+                upsert=True
+            )
+            for (metric, entity, bucket), count in changes.items() if count!=0
+        ]
+        if updates:
+            db.counter_buckets.bulk_write(updates, ordered=False)
+        # the first refresh read the whole window, it counts as a reconcile
+        db.counter_state.update_one({"_id": "pick"}, {"$max": {"createdAt": created_at}, "$setOnInsert": {"reconciledAt": now}}, upsert=True)
+    print(f"counters: read {read} picks {'created since the last refresh' if state else 'of the retention window'}, {len(recorded)} counted, {taken_out} taken out")
+    return read
+
+def window_counts(metric: str, days: int, now: float=None):
+    '''
+      Sum of the metric over the last days for every entity, to the hour, as {entity: count}.
+    '''
+    if metric not in METRICS:
+        raise ValueError(f'unknown counter metric {metric}')
+    if days>retention_days():
+        raise ValueError(f'{days} days is longer than the {retention_days()} days kept by the counters, raise COUNTER_RETENTION_DAYS')
+    start = (now or time.time()) - days*86400
+    with deadline():
+        rows = _db().counter_buckets.aggregate([
+            {"$match": {"metric": metric, "bucket": {"$gte": int(start//config.COUNTER_BUCKET_SECONDS)}}},
+            {"$group": {"_id": "$entity", "count": {"$sum": "$count"}}},
+        ])
+        return {row['_id']: row['count'] for row in rows if row['count']>0}
@@ -1,4 +1,3 @@
-import psycopg2
 import os
 from datetime import datetime, timedelta, timezone
 import pytz
@@ -6,58 +5,68 @@ from app.tool import save_file, upload_blob, request_post
 from app.gql import *
 import app.config as config
 import copy
-from app.meilisearch import add_document
-from app.mongo import connect_db
-from app.tool import get_current_timestamp, gen_uuid
+from app.meilisearch import sync_documents
+from app.aggregate import rank_publishers_by_category
+import app.counters as counters
+import app.watermark as watermark
+from app.ranking import TopK, top_items
+from app.mongo import connect_db, deadline
+import app.postgres as postgres
+import app.context as context
+from app.checkpoint import Checkpoint
+from app.tool import get_current_timestamp, gen_uuid, concurrent_map
 import app.statement as statement
 from dateutil.relativedelta import relativedelta
 
 def most_follower_members(most_follower_num: int):
     MESH_GQL_ENDPOINT = os.environ['MESH_GQL_ENDPOINT']
     data = []
-    conn = psycopg2.connect(
-      database = os.environ['DB_NAME'], 
-      user = os.environ['DB_USER'], 
-      password = os.environ['DB_PASS'], 
-      host = os.environ['DB_HOST'], 
-      port = os.environ['DB_PORT'],
-    )
-    conn.autocommit = True
-    sql_member_follower = '''
-      SELECT "A", count(*) FROM "_Member_follower" group by "A" 
-      ORDER BY count DESC 
-      LIMIT {TAKE};
+    # walks the rank index of the counts and stops at the first most_follower_num active members
+    sql_most_followers = '''
+      SELECT m.id, f.follower_count, m.name, m.nickname, m."customId", m.avatar
+      FROM {FOLLOWER_COUNT} f JOIN "Member" m ON m.id = f.member
+      WHERE m.is_active AND f.follower_count > 0
+      ORDER BY f.follower_count DESC, f.member
+      LIMIT %s;
+    '''
+    # follow relations have no timestamp, the write statistics of the table tell whether they changed without scanning it.
+    # The updates and deletes of "Member" cover the renamed, re-avatared and deactivated members which are published too.
+    # They are counted by the server which runs the writes, so the probe reads the primary, a replica does not count them
+    sql_follower_watermark = '''
+      SELECT f.n_tup_ins, f.n_tup_del, f.n_tup_upd, m.n_tup_upd, m.n_tup_del, (SELECT max(id) FROM "Member")
+      FROM pg_stat_user_tables f, pg_stat_user_tables m
+      WHERE f.relid = '"_Member_follower"'::regclass AND m.relid = '"Member"'::regclass;
     '''
-    sql_member_follower_string = sql_member_follower.format(TAKE=most_follower_num)
+    probe = None
     try:
-        with conn.cursor() as cur:
-            cur.execute(sql_member_follower_string)
-            rows = cur.fetchall()
-            if len(rows)>0:
-              members = {row[0]: row[1] for row in rows}
-              sql_member = '''
-                SELECT id, name, "customId", nickname, avatar, is_active FROM "Member"
-                WHERE id IN %s;
-              '''
-              cur.execute(sql_member, (tuple(members.keys()),))
-              rows = cur.fetchall()
-              for row in rows:
-                id, name, customId, nickname, avatar, is_active = row
-                if is_active==False:
-                  continue
-                data.append({
-                    "id": id,
-                    "followerCount": members[id],
-                    "name": name,
-                    "nickname": nickname,
-                    "customId": customId,
-                    "avatar": avatar
-                })
-              data = sorted(data, key=lambda member: member['followerCount'], reverse=True)
+        with postgres.connection() as conn, conn.cursor() as cur:
+            cur.execute(sql_follower_watermark)
+            row = cur.fetchone()
+            probe = [str(value) for value in row] if row else None
+        if watermark.unchanged('most_follower_members', probe):
+          return config.NOOP_RESULT
+        try:
+            rows = postgres.read(sql_most_followers.format(FOLLOWER_COUNT='mesh_member_follower_count'), (most_follower_num,))
+        except Exception as error:
+            # 42P01 undefined_table, the counts are kept by the mesh_member_follower_count migration, aggregate them until it is applied
+            if getattr(error, 'pgcode', None)!='42P01':
+                raise
+            print("mesh_member_follower_count is missing, aggregate the follower counts inline")
+            inline_count = '(SELECT "A" AS member, count(*) AS follower_count FROM "_Member_follower" GROUP BY "A")'
+            rows = postgres.read(sql_most_followers.format(FOLLOWER_COUNT=inline_count), (most_follower_num,))
+        for row in rows:
+          id, followerCount, name, nickname, customId, avatar = row
+          data.append({
+              "id": id,
+              "followerCount": followerCount,
+              "name": name,
+              "nickname": nickname,
+              "customId": customId,
+              "avatar": avatar
+          })
     except Exception as error: 
       print("Error while get_most_followers:", error)
-    finally:
-      conn.close()
+      probe = None
       
     # If the legnth of data is less than most_follower_num, add new member info
     if len(data)<most_follower_num:
@@ -78,21 +87,22 @@ def most_follower_members(most_follower_num: int):
     
     filename = os.path.join('data', 'most_followers.json')
     save_file(filename, data)
-    upload_blob(filename)
+    upload_blob(filename, 'most_followers')
+    watermark.save('most_follower_members', probe)
     return True
 
 def most_read_members(most_read_member_days: int, most_read_member_num: int):
-    # get members and their reads data
     MESH_GQL_ENDPOINT = os.environ['MESH_GQL_ENDPOINT']
-    current_time = datetime.now(pytz.timezone('Asia/Taipei'))
-    start_time = current_time - timedelta(days=most_read_member_days)
-    start_time = start_time.isoformat()
-    
-    members = gql_query(MESH_GQL_ENDPOINT, gql_member_read_statistic.format(START_TIME=start_time))
-    members = members['members']
-
-    # sorted by pickCount
-    sorted_members = sorted(members, key=lambda item: item['pickCount'], reverse=True)[:most_read_member_num]
+    if counters.enabled():
+      sorted_members = counted_read_members(MESH_GQL_ENDPOINT, most_read_member_days, most_read_member_num)
+    else:
+      # no Mongo for the rolling counters, count the reads of every member in the window
+      current_time = datetime.now(pytz.timezone('Asia/Taipei'))
+      start_time = current_time - timedelta(days=most_read_member_days)
+      start_time = start_time.isoformat()
+      members = gql_query(MESH_GQL_ENDPOINT, gql_member_read_statistic.format(START_TIME=start_time))
+      members = members['members']
+      sorted_members = top_items(members, most_read_member_num, key=lambda item: item['pickCount'])
     
     # format datatype and upload
     for idx, member in enumerate(sorted_members):
@@ -100,49 +110,78 @@ def most_read_members(most_read_member_days: int, most_read_member_num: int):
     if sorted_members:
       filename = os.path.join('data', 'most_read_members.json')
       save_file(filename, sorted_members)
-      upload_blob(filename)
+      upload_blob(filename, 'most_read_members')
     return True
   
+def counted_read_members(gql_endpoint, most_read_member_days: int, most_read_member_num: int):
+    '''
+      Most read members of the window from the rolling counters, members without reads fill the rest like before.
+    '''
+    counters.refresh(gql_endpoint)
+    reads = counters.window_counts('member_read', most_read_member_days)
+    ranked_ids = sorted(reads.keys(), key=lambda id: (reads[id], int(id)), reverse=True)
+
+    # get the active members in ranked order
+    sorted_members = []
+    for start in range(0, len(ranked_ids), most_read_member_num):
+      if len(sorted_members)>=most_read_member_num:
+        break
+      ids = ranked_ids[start:start+most_read_member_num]
+      members = gql_query(gql_endpoint, gql_members_info, {"where": {"id": {"in": ids}, "is_active": {"equals": True}}})
+      members = {member['id']: member for member in members['members']}
+      for id in ids:
+        if id in members:
+          sorted_members.append({**members[id], "pickCount": reads[id]})
+    if len(sorted_members)<most_read_member_num:
+      # every active member with reads is already ranked, so only those are excluded
+      where = {"id": {"notIn": [member['id'] for member in sorted_members]}, "is_active": {"equals": True}}
+      members = gql_query(gql_endpoint, gql_members_info, {"where": where, "take": most_read_member_num-len(sorted_members)})
+      sorted_members.extend({**member, "pickCount": 0} for member in members['members'])
+    return sorted_members[:most_read_member_num]
+
 def most_read_story(all_stories: list):
+    '''
+      all_stories are the Story records of gql_fetch_latest_stories.
+    '''
     ### categorize stories
     gql_endpoint = os.environ['MESH_GQL_ENDPOINT']
+    ### keep the top stories by pick count for each category
     categorized_stories = {}
     for story in all_stories:
       category_slug = story.get('category', {}).get('slug', None)
       if category_slug==None:
         continue
-      story_list = categorized_stories.setdefault(category_slug, [])
-      story_list.append(story)
-
-    ### sorted by pick count for each category
-    sorted_categorized_stories = {}
-    for category_slug, story_list in categorized_stories.items():
-      sorted_story_list = sorted(story_list, key=lambda story: story.get('picksCount', 0), reverse=True)
-      sorted_categorized_stories[category_slug] = sorted_story_list[:config.DEFAULT_MOST_READ_STORY_NUM]
+      if category_slug not in categorized_stories:
+        categorized_stories[category_slug] = TopK(config.DEFAULT_MOST_READ_STORY_NUM, key=lambda story: story.get('picksCount', 0))
+      categorized_stories[category_slug].push(story)
+    sorted_categorized_stories = {category_slug: top.result() for category_slug, top in categorized_stories.items()}
     
     ### get the comment with most likes for the first story of each category
     for category_slug, story_list in sorted_categorized_stories.items():
-      story_id = story_list[0]['id']
+      story_id = story_list[0].id
       most_like_comment = get_most_like_comment(gql_endpoint, story_id)
-      sorted_categorized_stories[category_slug][0]['comment'] = most_like_comment
+      sorted_categorized_stories[category_slug][0].comment = most_like_comment
     
     ### save and upload json
     for category_slug, story_list in sorted_categorized_stories.items():
       filename = os.path.join('data', f'most_read_stories_{category_slug}.json')
-      save_file(filename, story_list)
-      upload_blob(filename)
+      save_file(filename, [story.to_dict() for story in story_list])
+      upload_blob(filename, 'most_read_stories')
 
 def open_publishers():
   gql_endpoint = os.environ['MESH_GQL_ENDPOINT']
   all_publishers = gql_query(gql_endpoint, gql_mesh_publishers_open)
   all_publishers = all_publishers['publishers']
+  # the open information is small, so the whole list is the watermark
+  if watermark.unchanged('open_publishers', all_publishers):
+    return config.NOOP_RESULT
   publishers = {
     publisher['customId']: publisher for publisher in all_publishers
   }
   ### save and upload json
   filename = os.path.join('data', f'open_publishers.json')
   save_file(filename, publishers)
-  upload_blob(filename)
+  upload_blob(filename, 'open_publishers')
   
   ### save meilisearch
   try:
@@ -155,9 +194,12 @@ def open_publishers():
         "logo": publisher['logo'],
         "followerCount": publisher['followerCount'],
       })
-    add_document(config.MEILISEARCH_PUBLISHER_INDEX, search_publishers)
+    report = sync_documents(config.MEILISEARCH_PUBLISHER_INDEX, search_publishers)
+    # a failed task is only reported, the next run has to sync again
+    if all(task['status']=='succeeded' for task in report['tasks']):
+      watermark.save('open_publishers', all_publishers)
   except Exception as e:
-    print(f'Open publishers: add document failed, reason {e}')
+    print(f'Open publishers: sync documents failed, reason {e}')
   return True
 
 def most_sponsor_publisher(most_sponsors_num: int):
@@ -167,6 +209,13 @@ def most_sponsor_publisher(most_sponsors_num: int):
   all_publishers = gql_query(gql_endpoint, gql_mesh_sponsor_publishers)
   all_publishers = all_publishers['publishers']
   
+  ### skip when neither the publishers nor the latest story, picks and comments changed
+  probe = gql_probe(gql_endpoint, gql_sponsor_stories_watermark)
+  if probe!=None:
+    probe['publishers'] = all_publishers
+  if watermark.unchanged('most_sponsor_publisher', probe):
+    return config.NOOP_RESULT
+  
   ### Sort by SponsorCount(mock-data is sorted by followerCount)
   sorted_publishers = sorted(all_publishers, key=lambda publisher: publisher.get('sponsorCount', 0), reverse=True)
   sorted_publishers = sorted_publishers[:most_sponsors_num]
@@ -198,14 +247,15 @@ def most_sponsor_publisher(most_sponsors_num: int):
   ### Save and upload
   filename = os.path.join('data', f'most_recommend_sponsors.json')
   save_file(filename, most_recommend_sponsors)
-  upload_blob(filename)
+  upload_blob(filename, 'most_recommend_sponsors')
+  watermark.save('most_sponsor_publisher', probe)
   return True
 
-def media_statistics(all_stories: list):
+def media_statistics(days: int=config.DEFAULT_MEDIA_STATISTICS_DAYS):
   ### get all publishers and set default value
   statistics = {}
   gql_endpoint = os.environ['MESH_GQL_ENDPOINT']
-  publishers = gql_query(gql_endpoint, gql_mesh_publishers)
+  publishers = gql_fetch_publishers(gql_endpoint)
   publishers = publishers['publishers']
   for publisher in publishers:
     id = publisher['id']
@@ -215,22 +265,27 @@ def media_statistics(all_stories: list):
       "readsCount": 0
     }
   
-  ### categorize stories
-  media_keys = set(statistics.keys())
-  for story in all_stories:
-    source = story['source']
-    if source==None or isinstance(source, dict)==False:
-      continue
-    media_id = story['source']['id']
-    if media_id not in media_keys:
+  ### reads of the stories published in the window, from the rolling counters
+  if counters.enabled():
+    counters.refresh(gql_endpoint)
+    reads = counters.window_counts('publisher_read', days)
+  else:
+    # no Mongo for the rolling counters, sum the reads of every story of the window
+    reads = {}
+    for story in gql_fetch_media_statistics(gql_endpoint, days):
+      source = story['source']
+      if source==None or isinstance(source, dict)==False:
+        continue
+      reads[source['id']] = reads.get(source['id'], 0) + story['readsCount']
+  for media_id, readsCount in reads.items():
+    if media_id not in statistics:
       continue
-    readsCount = story['readsCount']
     statistics[media_id]['readsCount'] += readsCount
   
   ### save and upload json
   filename = os.path.join('data', f'media_statistics.json')
   save_file(filename, statistics)
-  upload_blob(filename)
+  upload_blob(filename, 'media_statistics')
   
 def recent_readr_stories(take: int):
   gql_endpoint = os.environ['MESH_GQL_ENDPOINT']
@@ -264,11 +319,11 @@ def recent_readr_stories(take: int):
   ### save and upload json
   filename = os.path.join('data', f'recent_readr_stories.json')
   save_file(filename, readr_info)
-  upload_blob(filename)
+  upload_blob(filename, 'recent_readr_stories')
 
 def hotpage_most_sponsor_publisher():
   gql_endpoint = os.environ['MESH_GQL_ENDPOINT']
-  all_publishers = gql_query(gql_endpoint, gql_mesh_publishers)
+  all_publishers = gql_fetch_publishers(gql_endpoint)
   all_publishers = all_publishers['publishers']
   
   ### filter readr
@@ -293,7 +348,7 @@ def hotpage_most_sponsor_publisher():
   ### save and upload json
   filename = os.path.join('data', f'hotpage_most_sponsored_publisher.json')
   save_file(filename, most_sponsored_publishers)
-  upload_blob(filename)
+  upload_blob(filename, 'hotpage_most_sponsored_publisher')
   
 def hotpage_most_popular_story(days: int=config.HOTPAGE_POPULAR_STORY_DAYS):
     ### get recent picks
@@ -302,41 +357,83 @@ def hotpage_most_popular_story(days: int=config.HOTPAGE_POPULAR_STORY_DAYS):
     start_time = current_time - timedelta(days=days)
     formatted_start_time = start_time.isoformat()
     
-    # search for most popular story id
-    mutation = {
-    "where": {
-            "published_date": {
-                "gt": formatted_start_time
+    # search for most popular story id, the rolling counters hold the reads of the stories published in the window
+    reads = {}
+    if counters.enabled():
+        counters.refresh(gql_endpoint)
+        reads = counters.window_counts('story_read', days)
+    if reads:
+        story_id = top_items(reads.keys(), 1, key=lambda id: (reads[id], int(id)))[0]
+    else:
+        # without the counters, or when nobody read in the window, the stories are ranked by their pick count like before
+        mutation = {
+        "where": {
+                "published_date": {
+                    "gt": formatted_start_time
+                }
             }
         }
-    }
-    data = gql_query(gql_endpoint, gql_most_popular_story, mutation)
-    stories = data['stories']
-    most_popular_story = sorted(stories, key=lambda story: story['pickCount'], reverse=True)[0]
+        data = gql_query(gql_endpoint, gql_most_popular_story, mutation)
+        stories = data['stories']
+        most_popular_story = top_items(stories, 1, key=lambda story: story['pickCount'])[0]
+        story_id = most_popular_story['id']
 
     # get full content
-    story_id = most_popular_story['id']
     story = gql_query(gql_endpoint, gql_single_story.format(ID=story_id))
     
     ### save and upload json
     filename = os.path.join('data', f'hotpage_most_popular_story.json')
     save_file(filename, story)
-    upload_blob(filename)
+    upload_blob(filename, 'hotpage_most_popular_story')
     
+def recent_most_like_comment_ids(gql_endpoint, start_time: str, num: int):
+    '''
+      Fallback ranking over graphql, only the latest HOTPAGE_RECENT_COMMENTS_NUM comments are considered.
+    '''
+    where = {
+        "like": {"some": {}},
+        "story": {"NOT": {}},
+        "is_active": {"equals": True},
+        "published_date": {"gt": start_time},
+    }
+    # rank the recent comments by likeCount page by page, paging by id so new comments don't shift the pages
+    sorted_comments = TopK(num, key=lambda item: item['likeCount'])
+    fetched, last_id = 0, None
+    while fetched<config.HOTPAGE_RECENT_COMMENTS_NUM:
+      page_where = where if last_id==None else {**where, "id": {"lt": last_id}}
+      take = min(config.HOTPAGE_COMMENTS_PAGE_SIZE, config.HOTPAGE_RECENT_COMMENTS_NUM-fetched)
+      comments = gql_query(gql_endpoint, gql_comment_statistic, {"where": page_where, "take": take})
+      comments = comments['comments']
+      sorted_comments.extend(comments)
+      fetched += len(comments)
+      if len(comments)<take:
+        break
+      last_id = comments[-1]['id']
+    return [comment['id'] for comment in sorted_comments.result()]
+
 def hotpage_most_like_comments(days=config.HOTPAGE_MOST_LIKE_DAYS):
-    ### get recent comments
+    ### rank the comments published in the window by their active likes, only the top ids leave postgres
     current_time = datetime.now(pytz.timezone('Asia/Taipei'))
     start_time = current_time - timedelta(days=days)
-    start_time = start_time.isoformat()
-    
     gql_endpoint = os.environ['MESH_GQL_ENDPOINT']
-    comments = gql_query(gql_endpoint, gql_comment_statistic.format(START_TIME=start_time ,TAKE=config.HOTPAGE_RECENT_COMMENTS_NUM))
-    comments = comments['comments']
-
-    ### sort comment by likeCount
-    sorted_comments = sorted(comments, key=lambda item: item['likeCount'], reverse=True)[:config.HOTPAGE_MOST_LIKE_COMMENTS_NUM]
-    search_ids = [comment['id'] for comment in sorted_comments]
-    search_ids
+    # "_Comment_like" is the join table of Comment.like, "A" is the comment and "B" the member who likes it
+    sql_most_like_comments = '''
+      SELECT c.id, count(*) AS "likeCount" FROM "Comment" c
+      JOIN "_Comment_like" l ON l."A" = c.id
+      JOIN "Member" m ON m.id = l."B" AND m.is_active
+      WHERE c.is_active AND c.story IS NOT NULL AND c.published_date > %s
+      GROUP BY c.id
+      ORDER BY "likeCount" DESC, c.id DESC
+      LIMIT %s;
+    '''
+    search_ids = None
+    try:
+        rows = postgres.read(sql_most_like_comments, (start_time, config.HOTPAGE_MOST_LIKE_COMMENTS_NUM))
+        search_ids = [str(row[0]) for row in rows]
+    except Exception as error:
+        print("Error while ranking comments in postgres, fall back to graphql:", error)
+    if search_ids==None:
+        search_ids = recent_most_like_comment_ids(gql_endpoint, start_time.isoformat(), config.HOTPAGE_MOST_LIKE_COMMENTS_NUM)
 
     ### get the detail of each comment
     variable = {
@@ -354,25 +451,49 @@ def hotpage_most_like_comments(days=config.HOTPAGE_MOST_LIKE_DAYS):
     filename = os.path.join('data', f'hotpage_most_like_comments.json')
     if sorted_most_like_comments:
       save_file(filename, sorted_most_like_comments)
-      upload_blob(filename)
+      upload_blob(filename, 'hotpage_most_like_comments')
     else:
       print("hotpage_most_like: empty data")
     
 def publisher_stories():
+    '''
+      Each publisher is uploaded as soon as its stories are fetched. When the deadline of the run gets close,
+      the publishers done so far stay published and the rest are skipped, a retry within the same checkpoint
+      window only processes the publishers which were not published.
+    '''
     gql_endpoint = os.environ['MESH_GQL_ENDPOINT']
-    publisher_stories = gql_fetch_publisher_stories(gql_endpoint, config.PUBLISHER_STORIES_NUM)
-    if publisher_stories and isinstance(publisher_stories, dict):
-      for filename, stories in publisher_stories.items():
+    publishers = gql_fetch_publishers(gql_endpoint)
+    publishers = [publisher for publisher in publishers['publishers'] if publisher['source_type']!='empty']
+    checkpoint = Checkpoint('publisher_stories')
+    publishers = checkpoint.remaining(publishers, key=lambda publisher: publisher['id'])
+    failed = False
+    for index, publisher in enumerate(publishers):
+        if context.expired(config.JOB_PUBLISH_RESERVE):
+            context.count('publishers_skipped', len(publishers)-index)
+            print(f"publisher_stories stops before the deadline, {len(publishers)-index} publishers are skipped")
+            return False
+        try:
+            filename, stories = gql_publisher_stories(gql_endpoint, publisher, config.PUBLISHER_STORIES_NUM)
+        except Exception as e:
+            context.count('publishers_failed')
+            print(f"fetch the publisher stories for {publisher['customId']} error:", e)
+            failed = True
+            continue
         filename = os.path.join('data', filename)
         save_file(filename, stories)
-        upload_blob(filename)
+        upload_blob(filename, 'publisher_stories')
+        checkpoint.mark(publisher['id'])
+    if failed:
+        return False
+    checkpoint.complete()
+    return True
   
 def category_recommend_sponsors():
     gql_endpoint = os.environ['MESH_GQL_ENDPOINT']
     proxy_endpoint = os.environ['MESH_PROXY_ENDPOINT']
     
     ### get publishers information
-    publishers = gql_query(gql_endpoint, gql_mesh_publishers)
+    publishers = gql_fetch_publishers(gql_endpoint)
     publishers = publishers['publishers']
     publisher_table = {}
     statistic_template = {}
@@ -393,7 +514,7 @@ def category_recommend_sponsors():
     all_publisher_ids = list(publisher_table.keys())
     
     ### get category information
-    categories = gql_query(gql_endpoint, gql_mesh_categories)
+    categories = gql_fetch_categories(gql_endpoint)
     categories = categories['categories']
     category_table = {}
     for category in categories:
@@ -403,62 +524,57 @@ def category_recommend_sponsors():
             category_table[id]= slug
             
     ### recommend sponsored publishers, we get the data from redis
-    recommend_sponsor_table = {}
-    for category_id, category_slug in category_table.items():
-        # get data for this category
-        body = {
-            "publishers": all_publisher_ids,
-            "category": category_id
-        }
-        stories, error_msg = request_post(proxy_endpoint, body)
-        stories = stories['stories']
-        if error_msg:
-            print(f"something wrong when processing category {category_id}, error: {error_msg}")
+    checkpoint = Checkpoint('category_recommend_sponsors')
+    category_ids = checkpoint.remaining(list(category_table.keys()))
+    responses = concurrent_map(
+        lambda category_id: request_post(proxy_endpoint, {"publishers": all_publisher_ids, "category": category_id}),
+        category_ids,
+        config.RECOMMEND_SPONSOR_CONCURRENCY
+    )
+    category_stories = {}
+    for category_id, (stories, error_msg) in zip(category_ids, responses):
+        if error_msg or not isinstance(stories, dict) or 'stories' not in stories:
+            print(f"something wrong when processing category {category_id}, error: {error_msg or stories}")
             continue
+        category_stories[category_id] = stories['stories'] or []
 
-        # calculate statistic
-        statistic_table = {} # count publisher_id and readsTotal mapping
-        publisher_stories = {} # keep publisher_id and stories mapping
-        for story in stories:
-            publisher_id = story['source']['id']
-            readsCount = story['picksCount']
-            statistic_table[publisher_id] = statistic_table.get(publisher_id, 0) + readsCount
-            story_list = publisher_stories.setdefault(publisher_id, [])
-            story_list.append({
-                "id": story['id'],
-                "url": story['url'],
-                "title": story['title'],
-                "published_date": story['published_date'],
-                "og_title": story["og_title"],
-                "og_image": story["og_image"],
-                "og_description": story["og_description"],
-                "full_screen_ad": story["full_screen_ad"],
-                "full_content": story["full_content"],
-                "commentCount": story['commentCount'],
-                "readsCount": readsCount
-            })
-
-        # sorting
-        recommend_publishers = sorted(statistic_table.items(), key=lambda item: item[1], reverse=True)[:config.RECOMMEND_SPONSOR_PUBLISHER_NUM]
-        recommend_publishers = [publisher[0] for publisher in recommend_publishers]
-        for publisher_id in recommend_publishers:
-            stories = publisher_stories.get(publisher_id, [])
-            sorted_stories = sorted(stories, key=lambda item: item['readsCount'], reverse=True)[:config.RECOMMEND_SPONSOR_STORY_NUM]
-            
-            sponsor_list = recommend_sponsor_table.setdefault(category_slug, [])
+    # sum the picks of every (category, publisher) and keep the top publishers and their top stories
+    ranking = rank_publishers_by_category(category_stories, config.RECOMMEND_SPONSOR_PUBLISHER_NUM, config.RECOMMEND_SPONSOR_STORY_NUM)
+    recommend_sponsor_table = {}
+    for category_id, recommend_publishers in ranking.items():
+        sponsor_list = recommend_sponsor_table.setdefault(category_id, [])
+        for publisher_id, stories in recommend_publishers:
             sponsor_list.append({
                 "publisher": publisher_table[publisher_id],
-                "stories": sorted_stories
+                "stories": [{
+                    "id": story['id'],
+                    "url": story['url'],
+                    "title": story['title'],
+                    "published_date": story['published_date'],
+                    "og_title": story["og_title"],
+                    "og_image": story["og_image"],
+                    "og_description": story["og_description"],
+                    "full_screen_ad": story["full_screen_ad"],
+                    "full_content": story["full_content"],
+                    "commentCount": story['commentCount'],
+                    "readsCount": story['picksCount']
+                } for story in stories]
             })
     
     ### save and upload json
-    for category_slug, publisher_stories in recommend_sponsor_table.items():
-        filename = os.path.join('data', f'{category_slug}_recommend_sponsors.json')
+    for category_id, publisher_stories in recommend_sponsor_table.items():
+        filename = os.path.join('data', f'{category_table[category_id]}_recommend_sponsors.json')
         save_file(filename, publisher_stories)
-        upload_blob(filename)
+        upload_blob(filename, 'category_recommend_sponsors')
+        checkpoint.mark(category_id)
+    if len(category_stories)==len(category_ids):
+        checkpoint.complete()
 
 def invalid_names():
     gql_endpoint = os.environ['MESH_GQL_ENDPOINT']
+    probe = gql_probe(gql_endpoint, gql_invalid_names_watermark)
+    if watermark.unchanged('invalid_names', probe):
+        return config.NOOP_RESULT
     names = gql_query(gql_endpoint, gql_invalid_names)
     names = names['invalidNames']
     
@@ -468,7 +584,9 @@ def invalid_names():
     # save and upload json
     filename = os.path.join('data', f'invalid_names.json')
     save_file(filename, names)
-    upload_blob(filename)
+    upload_blob(filename, 'invalid_names')
+    watermark.save('invalid_names', probe)
+    return True
     
 def check_transaction():
     mongo_url = os.environ['MONGO_URL']
@@ -547,38 +665,39 @@ def check_transaction():
 
     ### notify members
     col_notify = db.notifications
-    for memberId, new_notifies in categorized_expire_txs.items():
-        record = col_notify.find_one(memberId)
-        if record==None:
-            record = {
-                "_id": memberId,
-                "lrt": 0,
-                "notifies": new_notifies
-            }
-            col_notify.insert_one(record)
-        else:
-            all_notifies = record['notifies']
+    with deadline():
+        for memberId, new_notifies in categorized_expire_txs.items():
+            record = col_notify.find_one(memberId)
+            if record==None:
+                record = {
+                    "_id": memberId,
+                    "lrt": 0,
+                    "notifies": new_notifies
+                }
+                col_notify.insert_one(record)
+            else:
+                all_notifies = record['notifies']
 
-            # organize old approach expiration notifies
-            published_expiration_notifies = set()
-            for notify in all_notifies:
-                action = notify['action']
-                objective = notify['objective']
-                targetId = notify['targetId']
-                if action=='approach_expiration' and objective=='transaction':
-                    published_expiration_notifies.add(targetId)
+                # organize old approach expiration notifies
+                published_expiration_notifies = set()
+                for notify in all_notifies:
+                    action = notify['action']
+                    objective = notify['objective']
+                    targetId = notify['targetId']
+                    if action=='approach_expiration' and objective=='transaction':
+                        published_expiration_notifies.add(targetId)
             
-            # check if the notification already exist
-            for notify in new_notifies:
-                targetId = notify['targetId']
-                if targetId not in published_expiration_notifies:
-                    all_notifies.insert(0, notify)
-                    print("Insert new notify", notify)
-            all_notifies = all_notifies[:config.MOST_NOTIFY_RECORDS]
-            col_notify.update_one(
-                {"_id": memberId},
-                {"$set": {"notifies": all_notifies}}
-            )
+                # check if the notification already exist
+                for notify in new_notifies:
+                    targetId = notify['targetId']
+                    if targetId not in published_expiration_notifies:
+                        all_notifies.insert(0, notify)
+                        print("Insert new notify", notify)
+                all_notifies = all_notifies[:config.MOST_NOTIFY_RECORDS]
+                col_notify.update_one(
+                    {"_id": memberId},
+                    {"$set": {"notifies": all_notifies}}
+                )
     return True
   
 def month_statements(MONTHS: int=1):
@@ -587,9 +706,11 @@ def month_statements(MONTHS: int=1):
     GA_RESOURCE_ID = os.environ['GA_RESOURCE_ID']
     BIGQUERY_DB = os.environ['BIGQUERY_DB']
     BIGQUERY_TABLE_CLICK = os.environ['BIGQUERY_TABLE_CLICK']
+    BIGQUERY_TABLE_PAGEVIEW = os.environ.get('BIGQUERY_TABLE_PAGEVIEW', config.DEFAULT_PAGEVIEW_ROLLUP_TABLE)
+    BIGQUERY_TABLE_REVENUE = os.environ.get('BIGQUERY_TABLE_REVENUE', config.DEFAULT_REVENUE_ROLLUP_TABLE)
     
     # get revenue of each page
-    revenue_table = statement.getRevenues(GA_RESOURCE_ID, MONTHS)
+    revenue_table = statement.getRevenues(GA_RESOURCE_ID, MONTHS, BIGQUERY_DB, BIGQUERY_TABLE_REVENUE)
     homepage_revenue = revenue_table.get(statement.homepage_title, 0.0)
     socialpage_revenue = revenue_table.get(statement.socialpage_title, 0.0)
     newpage_revenue = revenue_table.get(statement.newpage_title, 0.0)
@@ -601,7 +722,7 @@ def month_statements(MONTHS: int=1):
     # pv_table
     current_time = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
     start_time = (current_time - relativedelta(months=MONTHS)).isoformat()
-    pv_table = statement.getPublisherPageview(BIGQUERY_DB, BIGQUERY_TABLE_CLICK, start_time)
+    pv_table = statement.getPublisherPageview(BIGQUERY_DB, BIGQUERY_TABLE_CLICK, start_time, BIGQUERY_TABLE_PAGEVIEW)
     
     # publisher share
     publisher_share_table = statement.publisherSponsorshipShare(MESH_GQL_ENDPOINT, mutual_fund)
@@ -624,7 +745,7 @@ def month_statements(MONTHS: int=1):
         pv_table = pv_table,
         gam_complementary = "此為測試資料"
     )
-    upload_blob(dest_filename=filename, bucket_name=PRIVATE_BUCKET)
+    upload_blob(dest_filename=filename, artifact='month_statement', bucket_name=PRIVATE_BUCKET)
     return True
   
 def media_statements(months: int=2):
@@ -640,12 +761,15 @@ def media_statements(months: int=2):
     if current_month%2!=1:
         return False
     
-    filenames = statement.createMediaStatements(
+    # statements are uploaded one by one, a retry of the same period resumes from the checkpoint
+    checkpoint = Checkpoint('media_statements', window=f'{start_date}/{end_date}')
+    statement.createMediaStatements(
         gql_endpoint = MESH_GQL_ENDPOINT,
         domain = DOMAIN,
         start_date = start_date,
-        end_date = end_date
+        end_date = end_date,
+        publish = lambda filename: upload_blob(dest_filename=filename, artifact='media_statement', bucket_name=PRIVATE_BUCKET),
+        checkpoint = checkpoint
     )
-    for filename in filenames:
-        upload_blob(dest_filename=filename, bucket_name=PRIVATE_BUCKET)
+    checkpoint.complete()
     return True
\ No newline at end of file
@@ -1,21 +1,256 @@
-from gql.transport.requests import RequestsHTTPTransport
-from gql.transport.exceptions import TransportError
-from gql import gql, Client
-
 from datetime import datetime, timedelta
 import pytz
+import copy
+import json
+import time
+import threading
 import app.config as config
+import app.metrics as metrics
+import app.resilience as resilience
+import app.context as context
+import app.limiter as limiter
+from app.profiling import phase
+from app.ranking import top_items
+from app.records import parse_stories
+
+# gql and graphql-core are imported on first use, so instances which never query keep a lean cold start
+_transport_class = None
+_schemas = {} # introspected schema of each endpoint, shared by all the sessions
+_schema_lock = threading.Lock()
+_local = threading.local() # connected sessions of each thread
+_reference_data = {} # (gql_endpoint, query) => (fetched time, data)
+_reference_lock = threading.Lock()
+
+def transport_class():
+  '''
+    Requests transport which counts the bytes of the responses, labelled by the operation being executed.
+  '''
+  global _transport_class
+  if _transport_class==None:
+    from gql.transport.requests import RequestsHTTPTransport
+
+    class InstrumentedTransport(RequestsHTTPTransport):
+      operation = 'unknown'
+
+      def connect(self):
+        super().connect()
+        self.session.hooks['response'].append(self._record_response)
+
+      def _record_response(self, response, *args, **kwargs):
+        metrics.gql_response_bytes.labels(self.operation).inc(len(response.content))
+
+    _transport_class = InstrumentedTransport
+  return _transport_class
+
+def gql_schema(gql_endpoint):
+  '''
+    Schema of the endpoint, introspected once per process instead of before every query.
+  '''
+  with _schema_lock:
+    if gql_endpoint not in _schemas:
+      from gql import Client
+      gql_transport = transport_class()(url=gql_endpoint)
+      gql_transport.operation = 'IntrospectionQuery'
+      gql_client = Client(transport=gql_transport, fetch_schema_from_transport=True)
+      with metrics.track_gql('IntrospectionQuery'), gql_client:
+        pass
+      _schemas[gql_endpoint] = gql_client.schema
+  return _schemas[gql_endpoint]
+
+def gql_session(gql_endpoint):
+  '''
+    Connected session of the current thread, it keeps the HTTP connection alive between queries.
+  '''
+  sessions = getattr(_local, 'sessions', None)
+  if sessions==None:
+    sessions = _local.sessions = {}
+  if gql_endpoint not in sessions:
+    from gql import Client
+    from gql.client import SyncClientSession
+    gql_transport = transport_class()(url=gql_endpoint)
+    gql_client = Client(schema=gql_schema(gql_endpoint), transport=gql_transport)
+    gql_transport.connect()
+    sessions[gql_endpoint] = SyncClientSession(client=gql_client)
+  return sessions[gql_endpoint]
+
+def operation_label(document, operation_name: str=None):
+  '''
+    Name of the operation in the document, or its first root field for anonymous operations.
+  '''
+  from graphql import OperationDefinitionNode
+  if operation_name:
+    return operation_name
+  for definition in document.definitions:
+    if isinstance(definition, OperationDefinitionNode):
+      if definition.name:
+        return definition.name.value
+      return definition.selection_set.selections[0].name.value
+  return 'unknown'
+
+def is_query(document, operation_name: str=None):
+  '''
+    Whether the executed operation is a query, only queries are safe to retry and hedge.
+  '''
+  from graphql import OperationDefinitionNode, OperationType
+  for definition in document.definitions:
+    if isinstance(definition, OperationDefinitionNode):
+      if operation_name and (definition.name==None or definition.name.value!=operation_name):
+        continue
+      return definition.operation==OperationType.QUERY
+  return False
+
+def gql_execute(gql_endpoint, gql_string: str, gql_variables: str=None, operation_name: str=None):
+  '''
+    Execute the query and raise on failure, gql_probe is the variant which returns None instead.
+  '''
+  from gql import gql
+  document = gql(gql_string)
+  operation = operation_label(document, operation_name)
+
+  def execute():
+    # sessions belong to a thread, a hedged duplicate runs on its own
+    session = gql_session(gql_endpoint)
+    session.transport.operation = operation
+    with limiter.outbound(gql_endpoint), metrics.track_gql(operation):
+      return session.execute(document, variable_values=gql_variables, operation_name=operation_name, timeout=context.timeout())
+  return resilience.call(execute, operation, gql_endpoint, idempotent=is_query(document, operation_name))
 
 def gql_query(gql_endpoint, gql_string: str, gql_variables: str=None, operation_name: str=None):
-  json_data = None
+  '''
+    Data of the query, the error is raised once the retries are spent so a job never goes on without its data.
+  '''
+  return gql_execute(gql_endpoint, gql_string, gql_variables, operation_name)
+
+def gql_probe(gql_endpoint, gql_string: str):
+  '''
+    Watermark probe of a job, None when it fails so the job runs instead of being skipped.
+  '''
   try:
-    gql_transport = RequestsHTTPTransport(url=gql_endpoint)
-    gql_client = Client(transport=gql_transport,
-                        fetch_schema_from_transport=True)
-    json_data = gql_client.execute(gql(gql_string), variable_values=gql_variables, operation_name=operation_name)
+    return gql_execute(gql_endpoint, gql_string)
   except Exception as e:
-    print("GQL query error:", e)
-  return json_data
+    print("GQL probe error:", e)
+    return None
+
+class StreamReader:
+  '''
+    File-like view of a streamed response body, counting its bytes and marking only the reads as the fetch phase.
+  '''
+  def __init__(self, raw):
+    self.raw = raw
+    self.size = 0
+
+  def read(self, size: int=None):
+    context.check()
+    with phase('fetch'):
+      chunk = self.raw.read(size)
+    self.size += len(chunk)
+    return chunk
+
+def _build_value(events, prefix: str, event: str, value):
+  '''
+    Build the value which starts at (prefix, event) out of the ijson events.
+  '''
+  if event not in ('start_map', 'start_array'):
+    return value
+  from ijson.common import ObjectBuilder
+  builder = ObjectBuilder()
+  end_event = event.replace('start', 'end')
+  current = prefix
+  while (current, event)!=(prefix, end_event):
+    builder.event(event, value)
+    current, event, value = next(events)
+  return builder.value
+
+def _stream_items(reader, root: str):
+  '''
+    Yield the items of data.<root> from the response body, raise the GraphQL errors at the end of it.
+  '''
+  from gql.transport.exceptions import TransportQueryError
+  try:
+    import ijson
+  except ImportError:
+    ijson = None
+  errors = None
+  if ijson==None:
+    result = json.load(reader)
+    errors = result.get('errors')
+    yield from (result.get('data') or {}).get(root) or []
+  else:
+    item_prefix = f'data.{root}.item'
+    events = iter(ijson.parse(reader, use_float=True))
+    for prefix, event, value in events:
+      if prefix==item_prefix:
+        yield _build_value(events, prefix, event, value)
+      elif prefix=='errors' and event=='start_array':
+        errors = _build_value(events, prefix, event, value)
+  if errors:
+    raise TransportQueryError(str(errors[0]), errors=errors)
+
+def gql_stream(gql_endpoint, gql_string: str, root: str, gql_variables: dict=None, operation_name: str=None):
+  '''
+    Execute a list query and yield the items of data.<root> while the response is still downloading,
+    so the caller aggregates as they arrive and the whole response is never held in memory.
+    The document is sent as is, without the schema validation gql_execute does.
+  '''
+  from gql import gql
+  from app.tool import http_session
+  operation = operation_label(gql(gql_string), operation_name)
+  body = {"query": gql_string, "variables": gql_variables, "operationName": operation_name}
+
+  def post(endpoint_limiter):
+    # the limit adapts to the time to the response headers, the download depends on the size of the list
+    post_start = time.perf_counter()
+    try:
+      with phase('fetch'):
+        response = http_session().post(gql_endpoint, json=body, stream=True, timeout=context.timeout(config.DEFAULT_REQUEST_TIMEOUT))
+      try:
+        response.raise_for_status()
+      except Exception:
+        response.close()
+        raise
+    except Exception as error:
+      endpoint_limiter.observe(time.perf_counter()-post_start, overloaded=limiter.is_overload(error))
+      raise
+    endpoint_limiter.observe(time.perf_counter()-post_start)
+    return response
+  start = time.perf_counter()
+  try:
+    # the slot is held until the response is consumed
+    with limiter.outbound(gql_endpoint, observe=False) as endpoint_limiter:
+      # only the request is retried, items already yielded can not be taken back
+      response = resilience.call(lambda: post(endpoint_limiter), operation, gql_endpoint, hedge=False)
+      with response:
+        response.raw.decode_content = True
+        reader = StreamReader(response.raw)
+        try:
+          yield from _stream_items(reader, root)
+        finally:
+          metrics.gql_response_bytes.labels(operation).inc(reader.size)
+  except Exception:
+    metrics.gql_errors.labels(operation).inc()
+    raise
+  finally:
+    metrics.gql_duration.labels(operation).observe(time.perf_counter()-start)
+
+def gql_reference_data(gql_endpoint, gql_string: str, ttl: int=config.REFERENCE_DATA_TTL):
+  '''
+    Slow-changing reference data (publishers, categories) shared by the jobs for ttl seconds.
+    Callers get their own copy, so they are free to modify it.
+  '''
+  key = (gql_endpoint, gql_string)
+  with _reference_lock:
+    fetched_time, data = _reference_data.get(key, (0, None))
+  if data==None or time.monotonic()-fetched_time>ttl:
+    data = gql_query(gql_endpoint, gql_string)
+    with _reference_lock:
+      _reference_data[key] = (time.monotonic(), data)
+  return copy.deepcopy(data)
+
+def gql_fetch_publishers(gql_endpoint):
+  return gql_reference_data(gql_endpoint, gql_mesh_publishers)
+
+def gql_fetch_categories(gql_endpoint):
+  return gql_reference_data(gql_endpoint, gql_mesh_categories)
 
 def gql_fetch_latest_stories(gql_endpoint, days: int):
     ### calculate start time
@@ -24,11 +259,13 @@ def gql_fetch_latest_stories(gql_endpoint, days: int):
     formatted_start_time = start_time.isoformat()
     
     ### fetch stories
-    all_stories = gql_query(gql_endpoint, gql_mesh_latest_stories.format(START_PUBLISHED_DATE=formatted_start_time))
-    all_stories = all_stories['stories']
-    return all_stories
+    all_stories = gql_stream(gql_endpoint, gql_mesh_latest_stories.format(START_PUBLISHED_DATE=formatted_start_time), 'stories')
+    return parse_stories(all_stories)
   
 def gql_fetch_media_statistics(gql_endpoint, days: int):
+    '''
+      Stories published in the last days with their read counts, for media_statistics when the counters are disabled.
+    '''
     ### calculate start time
     current_time = datetime.now(pytz.timezone('Asia/Taipei'))
     start_time = current_time - timedelta(days=days)
@@ -44,50 +281,37 @@ def get_most_like_comment(gql_endpoint, story_id):
     comments = story['story'].get('comment', [])
     if len(comments)==0:
       return {}
-    most_like_comment = sorted(comments, key=lambda comment: comment.get('likeCount', 0), reverse=True)[0]
+    most_like_comment = top_items(comments, 1, key=lambda comment: comment.get('likeCount', 0))[0]
     return most_like_comment
   
-def gql_fetch_publisher_stories(gql_endpoint, take_num: int=config.PUBLISHER_STORIES_NUM):
-    publisher_stories = {}
-    try:
-        gql_transport = RequestsHTTPTransport(url=gql_endpoint)
-        gql_client = Client(transport=gql_transport,
-                            fetch_schema_from_transport=True)
-        # get publishers information
-        publishers = gql_client.execute(gql(gql_mesh_publishers))
-        publishers = publishers['publishers']
-
-        # get stories for each publishers
-        for publisher in publishers:
-            if publisher['source_type']=='empty':
-                continue
-            id = publisher['id']
-            customId = publisher['customId'] # use this as file name
-            print(f"fetch the publisher stories for {customId}")
-            stories = gql_client.execute(gql(gql_publisher_latest_stories.format(SOURCE_ID=id, TAKE_NUM=take_num)))
-            stories = stories['stories']
-            # calculate total picks
-            total_picksCount = 0
-            for story in stories:
-                total_picksCount += story['picksCount']
-            # format json
-            publisher_stories[f'{customId}_stories.json'] = {
-                "source": {
-                    "id": id,
-                    "customId": customId,
-                    "title": publisher['title'],
-                    "official_site": publisher['official_site'],
-                    "logo": publisher['logo'],
-                    "description": publisher['description'],
-                    "followerCount": publisher['followerCount'],
-                    "sponsoredCount": publisher['sponsoredCount'],
-                    "picksCount": total_picksCount
-                },
-                "stories": stories
-            }
-    except Exception as e:
-        print("gql_fetch_publisher_stories error:", e)
-    return publisher_stories
+def gql_publisher_stories(gql_endpoint, publisher: dict, take_num: int=config.PUBLISHER_STORIES_NUM):
+    '''
+      File name and content of the latest stories of one publisher of gql_fetch_publishers.
+    '''
+    id = publisher['id']
+    customId = publisher['customId'] # use this as file name
+    print(f"fetch the publisher stories for {customId}")
+    # calculate total picks while the stories arrive
+    stories = []
+    total_picksCount = 0
+    for story in gql_stream(gql_endpoint, gql_publisher_latest_stories.format(SOURCE_ID=id, TAKE_NUM=take_num), 'stories'):
+        total_picksCount += story['picksCount']
+        stories.append(story)
+    # format json
+    return f'{customId}_stories.json', {
+        "source": {
+            "id": id,
+            "customId": customId,
+            "title": publisher['title'],
+            "official_site": publisher['official_site'],
+            "logo": publisher['logo'],
+            "description": publisher['description'],
+            "followerCount": publisher['followerCount'],
+            "sponsoredCount": publisher['sponsoredCount'],
+            "picksCount": total_picksCount
+        },
+        "stories": stories
+    }
 
 gql_mesh_publishers = '''
 query Publishers{
@@ -540,25 +764,20 @@ query Story{{
 
 ### This is only used to calcuate likeCount number of each comment
 gql_comment_statistic = '''
-query Comments{{
+query Comments($where: CommentWhereInput!, $take: Int){
   comments(
-    where: {{
-      like: {{some: {{}} }},
-      story: {{ NOT: {{}} }},
-      is_active: {{equals: true}},
-      published_date: {{ gt: "{START_TIME}" }}
-    }}, 
-    orderBy: {{id: desc}}, 
-    take: {TAKE}
-  ){{
+    where: $where,
+    orderBy: {id: desc},
+    take: $take
+  ){
     id
-    likeCount: likeCount(where: {{
-      is_active: {{
+    likeCount: likeCount(where: {
+      is_active: {
         equals: true
-      }}
-    }})
-  }}
-}}
+      }
+    })
+  }
+}
 '''
 
 gql_member_read_statistic = '''
@@ -581,6 +800,50 @@ query members{{
 }}
 '''
 
+### active read picks created after a watermark, ingested by the rolling counters, and only their ids for the reconcile
+gql_read_picks = '''
+query Picks($where: PickWhereInput!, $take: Int){
+  picks(where: $where, orderBy: {id: asc}, take: $take){
+    id
+    createdAt
+    member{
+      id
+    }
+    story{
+      id
+      published_date
+      source{
+        id
+      }
+      category{
+        id
+      }
+    }
+  }
+}
+'''
+
+gql_read_pick_ids = '''
+query Picks($where: PickWhereInput!, $take: Int){
+  picks(where: $where, orderBy: {id: asc}, take: $take){
+    id
+  }
+}
+'''
+
+gql_members_info = '''
+query members($where: MemberWhereInput!, $take: Int){
+  members(where: $where, orderBy: {id: desc}, take: $take){
+    id
+    name
+    nickname
+    email
+    avatar
+    customId
+  }
+}
+'''
+
 ### reveal the detail information about comment
 # Note: This operation use lots of relation data, don't pass in too many CommentWhereInput elements
 gql_comment_detail = '''
@@ -736,6 +999,30 @@ query InvalidNames{
 }
 '''
 
+### cheap probes compared with the watermarks of the last runs
+gql_invalid_names_watermark = '''
+query InvalidNamesWatermark{
+  invalidNamesCount
+  invalidNames(orderBy: {id: desc}, take: 1){
+    id
+  }
+}
+'''
+
+gql_sponsor_stories_watermark = '''
+query SponsorStoriesWatermark{
+  stories(orderBy: {id: desc}, take: 1){
+    id
+  }
+  picks(orderBy: {id: desc}, take: 1){
+    id
+  }
+  comments(orderBy: {id: desc}, take: 1){
+    id
+  }
+}
+'''
+
 gql_most_popular_story = '''
 query stories($where: StoryWhereInput!){
     stories(where: $where, orderBy: {id: desc}){
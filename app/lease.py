@@ -0,0 +1,122 @@
+'''
+    Distributed leases on the Mongo database of MONGO_URL, so a cronjob never runs on two instances at once.
+    A lease is a document of the leases collection keyed by the job name. It is taken with one atomic
+    find_one_and_update, which only matches a free or expired lease, and kept alive by a heartbeat thread
+    while the job runs. A TTL index removes the leases of the instances which died holding them, a while after they expired.
+    Every Mongo operation is bounded by LEASE_MONGO_TIMEOUT. A run whose lease was taken over checks it
+    before publishing (check), so it never overwrites the output of the run which holds the lease.
+'''
+import os
+import time
+import uuid
+import socket
+import threading
+from datetime import datetime, timedelta, timezone
+import app.config as config
+import app.context as context
+from app.mongo import connect_db
+
+_indexed = False
+_index_lock = threading.Lock()
+
+class LeaseLost(Exception):
+    pass
+
+def _timeout():
+    import pymongo
+    return pymongo.timeout(config.LEASE_MONGO_TIMEOUT)
+
+def _utc(value: datetime):
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+def enabled():
+    return os.environ.get('LEASE_POLICY', config.LEASE_POLICY)!='off' and 'MONGO_URL' in os.environ
+
+def _collection():
+    global _indexed
+    collection = connect_db(os.environ['MONGO_URL'], os.environ.get('ENV', 'dev')).leases
+    with _index_lock:
+        if not _indexed:
+            # kept a while past their expiry, so the runs waiting on a lease tell an expired one from a released one
+            collection.create_index('expiresAt', expireAfterSeconds=config.LEASE_TTL)
+            _indexed = True
+    return collection
+
+class Lease:
+    def __init__(self, name: str, ttl: float=config.LEASE_TTL):
+        self.name = name
+        self.ttl = ttl
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.lost = False
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def _expires_at(self):
+        return datetime.now(timezone.utc)+timedelta(seconds=self.ttl)
+
+    def acquire(self):
+        '''
+          Take the lease, False when another run holds it.
+        '''
+        from pymongo.errors import DuplicateKeyError
+        now = datetime.now(timezone.utc)
+        try:
+            # a lease held by someone else does not match, so the upsert collides with its _id
+            with _timeout():
+                _collection().find_one_and_update(
+                    {"_id": self.name, "$or": [{"expiresAt": {"$lte": now}}, {"owner": self.owner}]},
+                    {"$set": {"owner": self.owner, "acquiredAt": now, "expiresAt": self._expires_at()}},
+                    upsert=True
+                )
+        except DuplicateKeyError:
+            return False
+        self._heartbeat = threading.Thread(target=self._beat, name=f'lease-{self.name}', daemon=True)
+        self._heartbeat.start()
+        return True
+
+    def _beat(self):
+        while not self._stop.wait(self.ttl/3):
+            try:
+                with _timeout():
+                    result = _collection().update_one({"_id": self.name, "owner": self.owner}, {"$set": {"expiresAt": self._expires_at()}})
+            except Exception as e:
+                print(f"lease {self.name}: heartbeat failed, reason: {e}")
+                continue
+            if result.matched_count==0:
+                self.lost = True
+                print(f"lease {self.name}: lost to another run")
+                return
+
+    def release(self):
+        self._stop.set()
+        if self._heartbeat!=None:
+            self._heartbeat.join()
+        with _timeout():
+            _collection().delete_one({"_id": self.name, "owner": self.owner})
+
+def check():
+    '''
+      Raise LeaseLost when the running job lost its lease to another run, the jobs check it before publishing.
+    '''
+    job_context = context.current()
+    job_lease = getattr(job_context, 'lease', None)
+    if job_lease!=None and job_lease.lost:
+        raise LeaseLost(f'lease of {job_lease.name} was taken by another run, nothing more is published')
+
+def wait_released(name: str):
+    '''
+      Wait until the run holding the lease of name ends, until the deadline of the running job at most.
+      Return True when that run released the lease, False when the deadline came first or the lease expired
+      because the instance holding it died, then the job is not done yet.
+    '''
+    while True:
+        with _timeout():
+            record = _collection().find_one({"_id": name})
+        if record==None:
+            return True
+        if _utc(record['expiresAt'])<=datetime.now(timezone.utc):
+            return False
+        left = context.remaining()
+        if left!=None and left<=config.LEASE_POLL_INTERVAL:
+            return False
+        time.sleep(config.LEASE_POLL_INTERVAL)
@@ -0,0 +1,121 @@
+'''
+    Adaptive concurrency limit of the outbound GraphQL and proxy requests, one per host and shared by the whole process,
+    so the jobs fanning out in parallel can not overload the CMS which also serves the users.
+    The limit follows AIMD: it grows by about one request per limit of healthy responses, and is cut by
+    GQL_LIMIT_BACKOFF on 5xx, 429, timeouts or when the recent latency rises GQL_LIMIT_TOLERANCE times over its baseline.
+    Each priority class of the jobs may fill its share of the limit, and waits while a more urgent class is waiting.
+'''
+import time
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+import app.config as config
+import app.metrics as metrics
+import app.context as context
+
+_limiters = {}
+_registry_lock = threading.Lock()
+
+class AdaptiveLimiter:
+    SHORT_WEIGHT = 0.2 # of each latency in the recent latency
+    BASELINE_WEIGHTS = (0.05, 0.002) # of a lower and of a higher latency in the baseline, which stays near the unloaded latency
+    ALONE_WEIGHT = 0.2 # of the latency of a request which was alone in flight, it is the unloaded latency
+
+    def __init__(self, name: str):
+        self.name = name
+        self.limit = float(config.GQL_LIMIT_INITIAL)
+        self.in_flight = 0
+        self.waiting = {priority: 0 for priority in config.PRIORITY_CLASSES}
+        self.recent = None
+        self.baseline = None
+        self._last_decrease = 0
+        self._condition = threading.Condition()
+        metrics.gql_concurrency_limit.labels(name).set(self.limit)
+
+    def _allowed(self, priority: str):
+        for urgent in config.PRIORITY_CLASSES[:config.PRIORITY_CLASSES.index(priority)]:
+            if self.waiting[urgent]:
+                return False
+        return self.in_flight<max(1, int(self.limit*config.GQL_LIMIT_SHARES[priority]))
+
+    def acquire(self, priority: str):
+        '''
+          Wait for a slot of the priority class, until the deadline of the running job at most.
+        '''
+        with self._condition:
+            if self._allowed(priority):
+                self.in_flight += 1
+                return
+            context.count('gql_throttled')
+            self.waiting[priority] += 1
+            try:
+                acquired = self._condition.wait_for(lambda: self._allowed(priority), timeout=context.timeout())
+            finally:
+                self.waiting[priority] -= 1
+                self._condition.notify_all()
+            if not acquired:
+                raise context.DeadlineExceeded(f'no {priority} slot of {self.name} before the deadline')
+            self.in_flight += 1
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def observe(self, latency: float, overloaded: bool=False):
+        '''
+          Adjust the limit to the outcome of a request.
+        '''
+        with self._condition:
+            if self.recent==None:
+                self.recent = self.baseline = latency
+            elif not overloaded:
+                self.recent += self.SHORT_WEIGHT*(latency-self.recent)
+                weight = self.ALONE_WEIGHT if self.in_flight<=1 else self.BASELINE_WEIGHTS[latency>self.baseline]
+                self.baseline += weight*(latency-self.baseline)
+            if overloaded or self.recent>self.baseline*config.GQL_LIMIT_TOLERANCE:
+                # one cut per round trip, the responses of the requests already in flight would cut it again
+                now = time.monotonic()
+                if now-self._last_decrease>=self.recent:
+                    self.limit = max(config.GQL_LIMIT_MIN, self.limit*config.GQL_LIMIT_BACKOFF)
+                    self._last_decrease = now
+            elif self.in_flight>=self.limit/2 or any(self.waiting.values()):
+                # only grow a limit which is in use
+                self.limit = min(config.GQL_LIMIT_MAX, self.limit+1/self.limit)
+            metrics.gql_concurrency_limit.labels(self.name).set(self.limit)
+            self._condition.notify_all()
+
+def limiter(endpoint: str):
+    name = urlparse(endpoint).netloc or endpoint
+    with _registry_lock:
+        if name not in _limiters:
+            _limiters[name] = AdaptiveLimiter(name)
+        return _limiters[name]
+
+def is_overload(error: Exception):
+    '''
+      Errors which mean the endpoint is saturated, a query error is not one.
+    '''
+    from app.resilience import is_retryable
+    return is_retryable(error)
+
+@contextmanager
+def outbound(endpoint: str, observe: bool=True):
+    '''
+      Hold a slot of the endpoint for the priority class of the running job. With observe, the latency and
+      outcome of the block adjust the limit, otherwise the caller reports them through limiter(endpoint).observe.
+    '''
+    endpoint_limiter = limiter(endpoint)
+    endpoint_limiter.acquire(context.priority())
+    start = time.perf_counter()
+    try:
+        yield endpoint_limiter
+    except Exception as error:
+        if observe:
+            endpoint_limiter.observe(time.perf_counter()-start, overloaded=is_overload(error))
+        raise
+    else:
+        if observe:
+            endpoint_limiter.observe(time.perf_counter()-start)
+    finally:
+        endpoint_limiter.release()
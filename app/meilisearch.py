@@ -1,15 +1,143 @@
 import os
-import meilisearch
+import json
+import hashlib
+import app.config as config
+import app.lease as lease
+
+_client = None
+FINGERPRINT_FIELD = 'syncFingerprint' # fingerprint of the source document, stored in the indexed document but neither searchable nor displayed
+
+def get_client():
+    '''
+      Shared Meilisearch client, created on first use.
+    '''
+    global _client
+    if _client==None:
+        import meilisearch
+        meilisearch_host = os.environ['MEILISEARCH_HOST']
+        meilisearch_apikey = os.environ['MEILISEARCH_APIKEY']
+        _client = meilisearch.Client(meilisearch_host, meilisearch_apikey)
+    return _client
 
 def add_document(index, data):
     '''
       Store data into Meilisearch index. data should be a list with dict content.
     '''
-    meilisearch_host = os.environ['MEILISEARCH_HOST']
-    meilisearch_apikey = os.environ['MEILISEARCH_APIKEY']
-    client = meilisearch.Client( meilisearch_host, meilisearch_apikey)
+    client = get_client()
     try:
         response = client.index(index).add_documents(data, primary_key="id")
         print(response)
     except Exception as e:
-        print(f'add document failed, reason: {e}')
\ No newline at end of file
+        print(f'add document failed, reason: {e}')
+
+def fingerprint(document: dict):
+    content = json.dumps(document, ensure_ascii=False, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+def _task_uid(task):
+    if isinstance(task, dict):
+        return task.get('taskUid', task.get('uid'))
+    return task.task_uid
+
+def _wait_for_task(client, task):
+    uid = _task_uid(task)
+    try:
+        result = client.wait_for_task(uid, timeout_in_ms=config.MEILISEARCH_TASK_TIMEOUT*1000, interval_in_ms=config.MEILISEARCH_TASK_INTERVAL)
+    except Exception as e:
+        return {"taskUid": uid, "status": "unknown", "error": str(e)}
+    if isinstance(result, dict):
+        return {"taskUid": uid, "status": result.get('status'), "error": result.get('error')}
+    return {"taskUid": uid, "status": result.status, "error": result.error}
+
+def _indexed_fingerprints(client, index: str, primary_key: str):
+    '''
+      Fingerprint stored in each document of the index, None for the documents written without one.
+    '''
+    fingerprints = {}
+    offset = 0
+    while True:
+        try:
+            response = client.index(index).get_documents({"limit": config.MEILISEARCH_BATCH_SIZE, "offset": offset, "fields": [primary_key, FINGERPRINT_FIELD]})
+        except Exception as e:
+            if getattr(e, 'code', None)=='index_not_found':
+                break
+            raise
+        documents = getattr(response, 'results', response)
+        for document in documents:
+            document = dict(document)
+            fingerprints[str(document[primary_key])] = document.get(FINGERPRINT_FIELD)
+        if len(documents)<config.MEILISEARCH_BATCH_SIZE:
+            break
+        offset += len(documents)
+    return fingerprints
+
+def _hide_fingerprint(client, index: str, documents: list):
+    '''
+      Make the fields of the documents, and not FINGERPRINT_FIELD, the searchable and displayed attributes of the index.
+      The documents route which the sync reads back is not limited by them.
+    '''
+    fields = list(dict.fromkeys(field for document in documents for field in document if field!=FINGERPRINT_FIELD))
+    statuses = []
+    settings = client.index(index)
+    for get, update in (
+        (settings.get_searchable_attributes, settings.update_searchable_attributes),
+        (settings.get_displayed_attributes, settings.update_displayed_attributes),
+    ):
+        try:
+            current = get()
+        except Exception as e:
+            if getattr(e, 'code', None)!='index_not_found':
+                raise
+            current = ['*']
+        if list(current)!=fields:
+            statuses.append(_wait_for_task(client, update(fields)))
+    return statuses
+
+def sync_documents(index: str, documents: list, primary_key: str="id"):
+    '''
+      Make the index contain exactly the documents. The index is read back on every run and only the documents
+      whose fingerprint differs from the one stored in their FINGERPRINT_FIELD are sent by update_documents,
+      the ids which no longer exist are deleted, and every task is waited. An empty documents list is refused,
+      it would empty the whole index. The index only searches and displays the fields of the documents,
+      which keeps the fingerprints away from the clients.
+    '''
+    if len(documents)==0:
+        raise ValueError(f'refuse to sync {index} with no documents, it would delete all of them')
+    lease.check()
+    client = get_client()
+    current = {str(document[primary_key]): (document, fingerprint(document)) for document in documents}
+    indexed = _indexed_fingerprints(client, index, primary_key)
+
+    changed = [{**document, FINGERPRINT_FIELD: fp} for doc_id, (document, fp) in current.items() if indexed.get(doc_id)!=fp]
+    deleted = [doc_id for doc_id in indexed.keys() if doc_id not in current]
+    report = {
+        "index": index,
+        "unchanged": len(current)-len(changed),
+        "updated": 0,
+        "deleted": 0,
+        "tasks": [],
+    }
+
+    # before any fingerprint is written, settings are only changed when the fields of the documents change
+    report['tasks'].extend(_hide_fingerprint(client, index, documents))
+
+    # send the changed documents in batches
+    batch_size = config.MEILISEARCH_BATCH_SIZE
+    for start in range(0, len(changed), batch_size):
+        batch = changed[start:start+batch_size]
+        task = client.index(index).update_documents(batch, primary_key=primary_key)
+        status = _wait_for_task(client, task)
+        report['tasks'].append(status)
+        if status['status']=='succeeded':
+            report['updated'] += len(batch)
+
+    # remove the documents which are gone
+    for start in range(0, len(deleted), batch_size):
+        batch = deleted[start:start+batch_size]
+        task = client.index(index).delete_documents(batch)
+        status = _wait_for_task(client, task)
+        report['tasks'].append(status)
+        if status['status']=='succeeded':
+            report['deleted'] += len(batch)
+    print(f'sync {index}: {report}')
+    return report
@@ -0,0 +1,62 @@
+'''
+    Prometheus metrics of the cronjobs and their downstream calls, exposed by /metrics.
+    The hooks live in the shared helpers (gql_query, upload_blob, request_post, connect_db),
+    so every job is covered without per-job code. They also mark the profiling phases.
+'''
+import time
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from app.profiling import phase
+
+JOB_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+job_duration = Histogram('mesh_cronjob_duration_seconds', 'Duration of each cronjob run', ['job', 'status'], buckets=JOB_BUCKETS)
+job_queue_wait = Histogram('mesh_cronjob_queue_seconds', 'Time cronjob runs waited for a scheduler worker', ['priority'], buckets=JOB_BUCKETS)
+job_lease_busy = Counter('mesh_cronjob_lease_busy_total', 'Cronjob runs not started because another run held the lease of the job', ['job', 'policy'])
+job_noops = Counter('mesh_cronjob_noop_total', 'Cronjob runs skipped because their source was unchanged', ['job'])
+gql_duration = Histogram('mesh_gql_query_duration_seconds', 'Latency of GraphQL queries', ['operation'])
+gql_response_bytes = Counter('mesh_gql_response_bytes_total', 'Bytes of GraphQL responses', ['operation'])
+gql_errors = Counter('mesh_gql_query_errors_total', 'Failed GraphQL queries', ['operation'])
+gql_concurrency_limit = Gauge('mesh_gql_concurrency_limit', 'Adaptive limit of concurrent GraphQL and proxy requests', ['host'])
+gql_resilience_events = Counter('mesh_gql_resilience_events_total', 'GraphQL retries, hedged duplicates and calls rejected by an open circuit', ['operation', 'event'])
+upload_duration = Histogram('mesh_upload_duration_seconds', 'Latency of artifact uploads by kind of artifact', ['artifact'])
+upload_bytes = Counter('mesh_upload_bytes_total', 'Bytes of uploaded artifacts by kind of artifact', ['artifact'])
+dependency_duration = Histogram('mesh_dependency_call_duration_seconds', 'Latency of Mongo/Postgres/BigQuery/GA/HTTP calls', ['dependency', 'operation', 'status'])
+
+@contextmanager
+def track_dependency(dependency: str, operation: str):
+    start = time.perf_counter()
+    status = 'success'
+    try:
+        with phase('fetch'):
+            yield
+    except Exception:
+        status = 'error'
+        raise
+    finally:
+        dependency_duration.labels(dependency, operation, status).observe(time.perf_counter()-start)
+
+@contextmanager
+def track_gql(operation: str):
+    start = time.perf_counter()
+    try:
+        with phase('fetch'):
+            yield
+    except Exception:
+        gql_errors.labels(operation).inc()
+        raise
+    finally:
+        gql_duration.labels(operation).observe(time.perf_counter()-start)
+
+@contextmanager
+def track_upload(artifact: str, size: int):
+    start = time.perf_counter()
+    try:
+        with phase('upload'):
+            yield
+    finally:
+        upload_duration.labels(artifact).observe(time.perf_counter()-start)
+        upload_bytes.labels(artifact).inc(size)
+
+def render():
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -1,7 +1,44 @@
-import pymongo
+import threading
+import app.metrics as metrics
+import app.context as context
+
+_clients = {} # one MongoClient per url, it pools the connections itself
+_client_lock = threading.Lock()
+
+def command_listener():
+    '''
+      pymongo listener which records the latency of every Mongo command.
+    '''
+    from pymongo import monitoring
+
+    class CommandMetrics(monitoring.CommandListener):
+        def started(self, event):
+            pass
+
+        def succeeded(self, event):
+            metrics.dependency_duration.labels('mongo', event.command_name, 'success').observe(event.duration_micros/1e6)
+
+        def failed(self, event):
+            metrics.dependency_duration.labels('mongo', event.command_name, 'error').observe(event.duration_micros/1e6)
+
+    return CommandMetrics()
+
+def mongo_client(mongo_url: str):
+    with _client_lock:
+        if mongo_url not in _clients:
+            import pymongo
+            _clients[mongo_url] = pymongo.MongoClient(mongo_url, event_listeners=[command_listener()])
+    return _clients[mongo_url]
+
+def deadline():
+    '''
+      pymongo timeout block of the remaining budget of the running job, the operations inside it share that budget.
+    '''
+    import pymongo
+    return pymongo.timeout(context.timeout())
 
 def connect_db(mongo_url: str, env: str='dev'):
-    client = pymongo.MongoClient(mongo_url)
+    client = mongo_client(mongo_url)
     db = None
     if env=='staging':
         db = client.staging
@@ -9,4 +46,4 @@ def connect_db(mongo_url: str, env: str='dev'):
         db = client.prod
     else:
         db = client.dev
-    return db
\ No newline at end of file
+    return db
@@ -0,0 +1,182 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+import app.config as config
+import app.metrics as metrics
+
+# psycopg2 is imported on first use, most instances never connect to postgres
+_cursor_classes = {}
+_pool = None
+_replica_pool = None
+_pool_lock = threading.Lock()
+_replica_lock = threading.Lock()
+_replica_checked_at = 0 # monotonic time of the last lag check
+_replica_retry_at = 0 # reads stay on the primary until then, after the replica failed or lagged
+
+def cursor_class(dependency: str='postgres'):
+    '''
+      Cursor which records the latency of each statement, labelled by its leading keyword.
+    '''
+    if dependency not in _cursor_classes:
+        import psycopg2.extensions
+
+        class InstrumentedCursor(psycopg2.extensions.cursor):
+            def execute(self, query, vars=None):
+                operation = query.split(None, 1)[0].upper() if isinstance(query, str) and query.strip() else 'unknown'
+                with metrics.track_dependency(dependency, operation):
+                    return super().execute(query, vars)
+
+        _cursor_classes[dependency] = InstrumentedCursor
+    return _cursor_classes[dependency]
+
+def connect_db():
+    import psycopg2
+    conn = psycopg2.connect(
+      database = os.environ['DB_NAME'],
+      user = os.environ['DB_USER'],
+      password = os.environ['DB_PASS'],
+      host = os.environ['DB_HOST'],
+      port = os.environ['DB_PORT'],
+      cursor_factory = cursor_class(),
+    )
+    return conn
+
+def connection_pool():
+    '''
+      Shared pool of autocommit connections, created on first use.
+    '''
+    global _pool
+    with _pool_lock:
+        if _pool==None:
+            from psycopg2.pool import ThreadedConnectionPool
+            _pool = ThreadedConnectionPool(
+              0, config.DB_POOL_MAX_CONNECTIONS,
+              database = os.environ['DB_NAME'],
+              user = os.environ['DB_USER'],
+              password = os.environ['DB_PASS'],
+              host = os.environ['DB_HOST'],
+              port = os.environ['DB_PORT'],
+              cursor_factory = cursor_class(),
+              keepalives = 1,
+              keepalives_idle = 60,
+            )
+    return _pool
+
+def replica_pool():
+    '''
+      Shared pool of the read replica given by DB_REPLICA_DSN, None when no replica is configured.
+    '''
+    global _replica_pool
+    dsn = os.environ.get('DB_REPLICA_DSN')
+    if not dsn:
+        return None
+    with _pool_lock:
+        if _replica_pool==None:
+            from psycopg2.pool import ThreadedConnectionPool
+            _replica_pool = ThreadedConnectionPool(
+              0, config.DB_POOL_MAX_CONNECTIONS,
+              dsn = dsn,
+              cursor_factory = cursor_class('postgres-replica'),
+              keepalives = 1,
+              keepalives_idle = 60,
+            )
+    return _replica_pool
+
+def replica_lag(conn):
+    '''
+      Seconds the replica is behind, 0 when it replayed everything it received.
+    '''
+    with conn.cursor() as cur:
+        cur.execute('''
+          SELECT CASE
+            WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn()=pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM now()-pg_last_xact_replay_timestamp()), 0)
+          END;
+        ''')
+        return float(cur.fetchone()[0])
+
+def _borrow(pool):
+    conn = pool.getconn()
+    if conn.closed:
+        pool.putconn(conn, close=True)
+        conn = pool.getconn()
+    conn.autocommit = True
+    return conn
+
+def _skip_replica(reason: str):
+    global _replica_retry_at
+    print(f"postgres replica skipped for {config.DB_REPLICA_RETRY_AFTER}s, reason: {reason}")
+    with _replica_lock:
+        _replica_retry_at = time.monotonic() + config.DB_REPLICA_RETRY_AFTER
+
+def _borrow_replica():
+    '''
+      Borrow a replica connection when the policy routes reads to it and its lag is acceptable, otherwise None.
+    '''
+    global _replica_checked_at
+    if os.environ.get('DB_REPLICA_POLICY', config.DB_REPLICA_POLICY)!='replica':
+        return None
+    pool = replica_pool()
+    if pool==None:
+        return None
+    with _replica_lock:
+        if time.monotonic()<_replica_retry_at:
+            return None
+        check_lag = time.monotonic()-_replica_checked_at>config.DB_REPLICA_CHECK_INTERVAL
+    from psycopg2.pool import PoolError
+    try:
+        conn = _borrow(pool)
+    except PoolError:
+        # every replica connection is in use, this read goes to the primary but the replica is healthy
+        return None
+    except Exception as e:
+        _skip_replica(e)
+        return None
+    if check_lag:
+        try:
+            lag = replica_lag(conn)
+        except Exception as e:
+            pool.putconn(conn, close=True)
+            _skip_replica(e)
+            return None
+        if lag>config.DB_REPLICA_MAX_LAG:
+            pool.putconn(conn)
+            _skip_replica(f'lagging {lag:.0f}s behind')
+            return None
+        with _replica_lock:
+            _replica_checked_at = time.monotonic()
+    return pool, conn
+
+@contextmanager
+def connection():
+    '''
+      Borrow a connection of the primary from the pool, the broken ones are closed instead of being returned.
+    '''
+    pool = connection_pool()
+    conn = _borrow(pool)
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn, close=bool(conn.closed))
+
+def read(query: str, vars=None):
+    '''
+      Run a read-only query and return its rows. It runs on the replica when one is configured and healthy,
+      a connection failure there skips the replica and the query runs once more on the primary.
+    '''
+    import psycopg2
+    replica = _borrow_replica()
+    if replica!=None:
+        pool, conn = replica
+        try:
+            with conn.cursor() as cur:
+                cur.execute(query, vars)
+                return cur.fetchall()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            _skip_replica(e)
+        finally:
+            pool.putconn(conn, close=bool(conn.closed))
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute(query, vars)
+        return cur.fetchall()
@@ -0,0 +1,145 @@
+'''
+    On-demand profiling of a cronjob run. A run is profiled when it is requested by ?profile=cpu|mem
+    (or the X-Profile header), or sampled by PROFILE_SAMPLE_RATE. The stats are written under PROFILE_DIR
+    and the run time is broken down into the fetch/compute/serialise/upload phases, which are marked by
+    the shared helpers.
+    cProfile and tracemalloc hook the whole thread or process, so only one run is profiled at a time,
+    the others which ask for it meanwhile run unprofiled.
+'''
+import os
+import io
+import time
+import random
+import pstats
+import cProfile
+import tracemalloc
+import threading
+import contextvars
+from contextlib import contextmanager
+import app.config as config
+
+MODES = ('cpu', 'mem')
+PHASES = ('fetch', 'compute', 'serialise', 'upload')
+
+_session = contextvars.ContextVar('profile_session', default=None)
+_phase = contextvars.ContextVar('profile_phase', default=None)
+_active = threading.Lock() # held while a run is profiled
+
+class ProfileSession:
+    def __init__(self, job: str, mode: str):
+        self.job = job
+        self.mode = mode
+        self.phases = {name: 0.0 for name in PHASES}
+        self.profiler = None
+        self.thread_profilers = [] # profiles of the job threads, merged into the stats by finish
+        self.start_time = time.perf_counter()
+
+def choose_mode(requested: str=None):
+    '''
+      Profile mode of this run, the requested one or a sampled one, None means no profiling.
+    '''
+    if requested in MODES:
+        return requested
+    sample_rate = float(os.environ.get('PROFILE_SAMPLE_RATE', config.DEFAULT_PROFILE_SAMPLE_RATE))
+    if sample_rate>0 and random.random()<sample_rate:
+        return os.environ.get('PROFILE_SAMPLE_MODE', config.DEFAULT_PROFILE_SAMPLE_MODE)
+    return None
+
+@contextmanager
+def phase(name: str):
+    '''
+      Count the time spent inside into the phase of the current profile. Nested phases count into the outer one.
+    '''
+    session = _session.get()
+    if session==None or _phase.get()!=None:
+        yield
+        return
+    token = _phase.set(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        session.phases[name] += time.perf_counter()-start
+        _phase.reset(token)
+
+@contextmanager
+def thread_profile():
+    '''
+      Profile the current thread into the cpu profile of the context, for jobs which run off the request thread.
+    '''
+    session = _session.get()
+    if session==None or session.mode!='cpu':
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        session.thread_profilers.append(profiler)
+
+def start(job: str, mode: str):
+    '''
+      Start profiling the run, None when another run is being profiled.
+    '''
+    if not _active.acquire(blocking=False):
+        print(f"profile {job}: another run is being profiled, run without profiling")
+        return None
+    session = ProfileSession(job, mode)
+    if mode=='cpu':
+        session.profiler = cProfile.Profile()
+        session.profiler.enable()
+    else:
+        tracemalloc.start()
+    _session.set(session)
+    return session
+
+def finish(session: ProfileSession):
+    '''
+      Stop profiling, write the stats file and return a summary of the run.
+    '''
+    wall = time.perf_counter()-session.start_time
+    try:
+        profile_dir = os.environ.get('PROFILE_DIR', config.DEFAULT_PROFILE_DIR)
+        os.makedirs(profile_dir, exist_ok=True)
+        basename = os.path.join(profile_dir, f"{session.job}-{session.mode}-{int(time.time())}")
+        top_num = config.PROFILE_TOP_NUM
+        if session.mode=='cpu':
+            session.profiler.disable()
+            filename = f'{basename}.prof'
+            stream = io.StringIO()
+            stats = pstats.Stats(session.profiler, *session.thread_profilers, stream=stream)
+            stats.dump_stats(filename)
+            stats.sort_stats('cumulative').print_stats(top_num)
+            top = [line for line in stream.getvalue().splitlines() if line.strip()][-top_num:]
+        else:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            stats = snapshot.statistics('lineno')[:top_num]
+            top = [f'peak {peak/1024/1024:.1f} MiB'] + [str(stat) for stat in stats]
+            filename = f'{basename}.txt'
+            with open(filename, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(top))
+    finally:
+        if session.mode=='cpu':
+            session.profiler.disable()
+        elif tracemalloc.is_tracing():
+            tracemalloc.stop()
+        _session.set(None)
+        _active.release()
+
+    # the time outside every marked phase is computation
+    phases = dict(session.phases)
+    phases['compute'] = max(0.0, wall-sum(phases.values()))
+    summary = {
+        "job": session.job,
+        "mode": session.mode,
+        "wall": round(wall, 3),
+        "phases": {name: round(seconds, 3) for name, seconds in phases.items()},
+        "file": filename,
+        "top": top,
+    }
+    print(f"profile {session.job}: wall {summary['wall']}s, phases {summary['phases']}, stats in {filename}")
+    return summary
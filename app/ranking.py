@@ -0,0 +1,112 @@
+'''
+    Bounded-memory ranking of streamed items.
+    TopK keeps the exact top-k of a stream of pages in O(k) memory, SpaceSaving estimates the heavy hitters
+    of an unbounded event stream in a fixed number of counters, optionally decaying older events.
+'''
+import heapq
+import itertools
+
+class TopK:
+    '''
+      Exact top-k by key, O(log k) per item. Equal keys keep their arrival order, so the result
+      is the same as sorted(items, key=key, reverse=True)[:k].
+    '''
+    def __init__(self, k: int, key=None):
+        self.k = k
+        self.key = key or (lambda item: item)
+        self._heap = [] # (key, -arrival, item), the root is the item to drop first
+        self._arrival = itertools.count()
+
+    def push(self, item):
+        if self.k<=0:
+            return
+        entry = (self.key(item), -next(self._arrival), item)
+        if len(self._heap)<self.k:
+            heapq.heappush(self._heap, entry)
+        elif entry[:2]>self._heap[0][:2]:
+            heapq.heapreplace(self._heap, entry)
+
+    def extend(self, items):
+        for item in items:
+            self.push(item)
+        return self
+
+    def __len__(self):
+        return len(self._heap)
+
+    def result(self):
+        return [item for _, _, item in sorted(self._heap, key=lambda entry: entry[:2], reverse=True)]
+
+def top_items(items, k: int, key=None):
+    return TopK(k, key).extend(items).result()
+
+class SpaceSaving:
+    '''
+      Heavy hitters of an event stream in capacity counters (Space-Saving). A key's estimate exceeds its
+      true count by at most its error, which never exceeds total weight / capacity.
+      With half_life (seconds, same unit as the timestamps) older events weigh exponentially less. Weights are
+      scaled forward from a landmark time instead of decaying every counter, so adding stays O(log capacity).
+    '''
+    RESCALE_HALF_LIVES = 60
+
+    def __init__(self, capacity: int, half_life: float=None):
+        self.capacity = capacity
+        self.half_life = half_life
+        self.counters = {} # key => [count, error]
+        self._heap = [] # (count, arrival, key), entries whose count is outdated are skipped lazily
+        self._arrival = itertools.count()
+        self._landmark = None
+
+    def _forward(self, weight: float, timestamp: float):
+        if self.half_life==None or timestamp==None:
+            return weight
+        if self._landmark==None:
+            self._landmark = timestamp
+        exponent = (timestamp-self._landmark)/self.half_life
+        if exponent>self.RESCALE_HALF_LIVES:
+            self._rescale(timestamp)
+            exponent = 0
+        return weight*2**exponent
+
+    def _rescale(self, timestamp: float):
+        factor = 2**(-(timestamp-self._landmark)/self.half_life)
+        for counter in self.counters.values():
+            counter[0] *= factor
+            counter[1] *= factor
+        self._landmark = timestamp
+        self._rebuild_heap()
+
+    def _rebuild_heap(self):
+        self._heap = [(counter[0], next(self._arrival), key) for key, counter in self.counters.items()]
+        heapq.heapify(self._heap)
+
+    def _evict_min(self):
+        while True:
+            count, _, key = heapq.heappop(self._heap)
+            counter = self.counters.get(key)
+            if counter!=None and counter[0]==count:
+                del self.counters[key]
+                return count
+
+    def add(self, key, weight: float=1, timestamp: float=None):
+        if weight<=0:
+            raise ValueError('weight must be positive')
+        weight = self._forward(weight, timestamp)
+        counter = self.counters.get(key)
+        if counter==None:
+            floor = self._evict_min() if len(self.counters)>=self.capacity else 0
+            counter = self.counters[key] = [floor, floor]
+        counter[0] += weight
+        heapq.heappush(self._heap, (counter[0], next(self._arrival), key))
+        if len(self._heap)>4*self.capacity:
+            self._rebuild_heap()
+
+    def top(self, k: int, timestamp: float=None):
+        '''
+          [(key, estimate, error)] of the k heaviest keys, decayed to timestamp when a half_life is set.
+        '''
+        factor = 1
+        if self.half_life!=None and self._landmark!=None and timestamp!=None:
+            factor = 2**(-(timestamp-self._landmark)/self.half_life)
+        ranked = top_items(self.counters.items(), k, key=lambda item: item[1][0])
+        return [(key, count*factor, error*factor) for key, (count, error) in ranked]
@@ -0,0 +1,90 @@
+'''
+    Compact records for the large story lists kept in memory during a run.
+    Records use __slots__ instead of a dict per object, the publishers, categories and members a response
+    refers to are shared by id instead of being repeated in every story and pick, and the strings repeated
+    across records are interned. to_dict() gives back the same JSON shape as the GraphQL response.
+'''
+import sys
+
+_MISSING = object()
+
+class Record:
+    __slots__ = ()
+    NESTED = {} # field => record class of the nested object, or a one-item tuple for a list of them
+    INTERNED = () # string fields whose values repeat across records
+    SHARED = False # records with the same id are the same object within one parse
+
+    @classmethod
+    def parse(cls, data: dict, refs: dict):
+        if data==None:
+            return None
+        if cls.SHARED:
+            key = (cls, data.get('id'))
+            if key in refs:
+                return refs[key]
+        record = cls.__new__(cls)
+        for field in cls.__slots__:
+            value = data.get(field, _MISSING)
+            if value is not _MISSING and value!=None:
+                nested = cls.NESTED.get(field)
+                if isinstance(nested, tuple):
+                    value = [nested[0].parse(item, refs) for item in value]
+                elif nested!=None:
+                    value = nested.parse(value, refs)
+                elif field in cls.INTERNED and isinstance(value, str):
+                    value = sys.intern(value)
+            setattr(record, field, value)
+        if cls.SHARED:
+            refs[(cls, data.get('id'))] = record
+        return record
+
+    def get(self, field: str, default=None):
+        value = getattr(self, field, _MISSING)
+        return default if value is _MISSING else value
+
+    def to_dict(self):
+        data = {}
+        for field in self.__slots__:
+            value = getattr(self, field, _MISSING)
+            if value is _MISSING:
+                continue
+            if isinstance(value, Record):
+                value = value.to_dict()
+            elif isinstance(value, list):
+                value = [item.to_dict() if isinstance(item, Record) else item for item in value]
+            data[field] = value
+        return data
+
+class Category(Record):
+    __slots__ = ('id', 'slug')
+    INTERNED = ('slug',)
+    SHARED = True
+
+class Publisher(Record):
+    __slots__ = ('id', 'title', 'customId')
+    INTERNED = ('title', 'customId')
+    SHARED = True
+
+class Member(Record):
+    __slots__ = ('id', 'name', 'avatar')
+    SHARED = True
+
+class Pick(Record):
+    __slots__ = ('createdAt', 'member')
+    NESTED = {'member': Member}
+
+class Story(Record):
+    # same order as gql_mesh_latest_stories, comment is attached by most_read_story
+    __slots__ = (
+        'id', 'url', 'title', 'category', 'source', 'published_date', 'summary', 'og_title', 'og_image', 'og_description',
+        'full_content', 'origid', 'picksCount', 'picks', 'commentCount', 'paywall', 'full_screen_ad', 'comment',
+    )
+    NESTED = {'category': Category, 'source': Publisher, 'picks': (Pick,)}
+    INTERNED = ('full_screen_ad',)
+
+def parse_stories(stories):
+    '''
+      Turn the stories of gql_mesh_latest_stories into Story records, stories can be the items streamed by gql_stream.
+    '''
+    refs = {}
+    return [Story.parse(story, refs) for story in stories]
@@ -0,0 +1,183 @@
+'''
+    Resilience of the calls to the GraphQL endpoint: retries with exponential backoff and full jitter,
+    a hedged duplicate of an idempotent call which runs past a latency percentile, and a circuit breaker
+    per endpoint which fails fast while the endpoint is down.
+    Retries, hedges and rejected calls are counted in the metrics and in the stats of the running job.
+'''
+import os
+import time
+import random
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import app.config as config
+import app.metrics as metrics
+import app.context as context
+
+_breakers = {}
+_latencies = {}
+_registry_lock = threading.Lock()
+_hedge_pool = None
+
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    '''
+      Opens after GQL_BREAKER_FAILURES consecutive failures, then lets one trial call through every
+      GQL_BREAKER_RESET seconds, the first success closes it again.
+    '''
+    def __init__(self, name: str):
+        self.name = name
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at==None:
+                return True
+            if not self.trial and time.monotonic()-self.opened_at>=config.GQL_BREAKER_RESET:
+                self.trial = True
+                return True
+            return False
+
+    def release(self):
+        '''
+          End the trial of a call which did not tell whether the endpoint is up, the next call may try again.
+        '''
+        with self._lock:
+            self.trial = False
+
+    def record(self, success: bool):
+        with self._lock:
+            self.trial = False
+            if success:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.opened_at!=None or self.failures>=config.GQL_BREAKER_FAILURES:
+                self.opened_at = time.monotonic()
+
+class LatencyTracker:
+    '''
+      Latencies of the recent successful calls of one operation.
+    '''
+    def __init__(self):
+        self.samples = deque(maxlen=config.GQL_HEDGE_SAMPLES)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, percent: float):
+        with self._lock:
+            if len(self.samples)<config.GQL_HEDGE_MIN_SAMPLES:
+                return None
+            samples = sorted(self.samples)
+        return samples[min(len(samples)-1, int(len(samples)*percent/100))]
+
+def breaker(name: str):
+    with _registry_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+def latency(operation: str):
+    with _registry_lock:
+        if operation not in _latencies:
+            _latencies[operation] = LatencyTracker()
+        return _latencies[operation]
+
+def is_retryable(error: Exception):
+    '''
+      Connection failures, timeouts, 5xx and 429 are transient, everything else (query errors included) is not.
+    '''
+    import requests
+    from gql.transport.exceptions import TransportServerError
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(error, requests.exceptions.HTTPError):
+        code = error.response.status_code if error.response!=None else None
+        return code==None or code>=500 or code==429
+    if isinstance(error, TransportServerError):
+        return error.code==None or error.code>=500 or error.code==429
+    return False
+
+def backoff_delay(attempt: int):
+    return random.uniform(0, min(config.GQL_RETRY_MAX_DELAY, config.GQL_RETRY_BASE_DELAY*2**attempt))
+
+def _record(operation: str, event: str):
+    metrics.gql_resilience_events.labels(operation, event).inc()
+    context.count(f'gql_{event}')
+
+def _hedge_delay(operation: str):
+    percent = float(os.environ.get('GQL_HEDGE_PERCENTILE', config.GQL_HEDGE_PERCENTILE))
+    if percent<=0:
+        return None
+    delay = latency(operation).percentile(percent)
+    return None if delay==None else max(delay, config.GQL_HEDGE_MIN_DELAY)
+
+def _submit(func):
+    global _hedge_pool
+    with _registry_lock:
+        if _hedge_pool==None:
+            _hedge_pool = ThreadPoolExecutor(max_workers=config.GQL_HEDGE_WORKERS, thread_name_prefix='hedge')
+    return _hedge_pool.submit(contextvars.copy_context().run, func)
+
+def hedged(func, delay: float, operation: str):
+    '''
+      Run func, and once more in parallel when the first call is still running after delay.
+      The first successful result wins, the slower call is left to finish in the background.
+    '''
+    futures = [_submit(func)]
+    done, _ = wait(futures, timeout=delay)
+    if not done:
+        _record(operation, 'hedges')
+        futures.append(_submit(func))
+    while True:
+        done, pending = wait(futures, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception()==None:
+                return future.result()
+        if not pending:
+            raise futures[0].exception()
+        futures = list(pending)
+
+def call(func, operation: str, endpoint: str, idempotent: bool=True, hedge: bool=True):
+    '''
+      Call func, a request of operation to endpoint, under the circuit breaker of the endpoint.
+      Idempotent calls are retried on transient errors, and hedged when hedge is set and GQL_HEDGE_PERCENTILE is on.
+    '''
+    circuit = breaker(endpoint)
+    attempts = config.GQL_RETRY_ATTEMPTS if idempotent else 1
+    for attempt in range(attempts):
+        if not circuit.allow():
+            _record(operation, 'rejected')
+            raise CircuitOpenError(f'circuit of {endpoint} is open after repeated failures')
+        delay = _hedge_delay(operation) if idempotent and hedge else None
+        start = time.perf_counter()
+        try:
+            result = hedged(func, delay, operation) if delay!=None else func()
+        except Exception as error:
+            # only transport failures count, a query error says nothing about the endpoint
+            if not is_retryable(error):
+                circuit.release()
+                raise
+            circuit.record(success=False)
+            if attempt==attempts-1:
+                raise
+            delay = backoff_delay(attempt)
+            if context.expired(delay):
+                raise
+            _record(operation, 'retries')
+            print(f"{operation} failed with {error}, retry {attempt+1}/{attempts-1}")
+            time.sleep(delay)
+            continue
+        circuit.record(success=True)
+        latency(operation).record(time.perf_counter()-start)
+        return result
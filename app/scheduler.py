@@ -0,0 +1,120 @@
+'''
+    In-process scheduler of the cronjobs. Jobs wait in one queue per priority class and run on a pool of
+    threads, most urgent class first, with at most SCHEDULER_CLASS_LIMITS of a class running at once.
+    SCHEDULER_REALTIME_WORKERS more threads only ever run realtime jobs, so the hotpage jobs always find
+    a worker even while every other one is busy with statements.
+    CPU-heavy work inside the jobs (the statement workbooks) goes to a process pool through submit_cpu,
+    out of the GIL the I/O-bound jobs share.
+'''
+import os
+import time
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import Future
+import app.config as config
+import app.metrics as metrics
+import app.context as context
+import app.profiling as profiling
+
+class JobScheduler:
+    def __init__(self, workers: int=config.SCHEDULER_WORKERS, realtime_workers: int=config.SCHEDULER_REALTIME_WORKERS):
+        self.workers = workers
+        self.realtime_workers = realtime_workers
+        self.queues = {priority: deque() for priority in config.PRIORITY_CLASSES}
+        self.running = {priority: 0 for priority in config.PRIORITY_CLASSES}
+        self._threads = []
+        self._condition = threading.Condition()
+
+    def _start(self):
+        for index in range(self.workers+self.realtime_workers):
+            reserved = index>=self.workers
+            thread = threading.Thread(target=self._work, args=(reserved,), name=f"{'realtime' if reserved else 'job'}-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _runnable(self, reserved: bool):
+        priorities = config.PRIORITY_CLASSES[:1] if reserved else config.PRIORITY_CLASSES
+        for priority in priorities:
+            limit = config.SCHEDULER_CLASS_LIMITS.get(priority)
+            if self.queues[priority] and (limit==None or self.running[priority]<limit):
+                return priority
+        return None
+
+    def _work(self, reserved: bool):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._runnable(reserved)!=None)
+                priority = self._runnable(reserved)
+                future, job_context, func, args, kwargs, queued_at = self.queues[priority].popleft()
+                self.running[priority] += 1
+            try:
+                metrics.job_queue_wait.labels(priority).observe(time.perf_counter()-queued_at)
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(job_context.run(_run_job, func, args, kwargs))
+                    except BaseException as error:
+                        future.set_exception(error)
+            finally:
+                with self._condition:
+                    self.running[priority] -= 1
+                    self._condition.notify_all()
+
+    def submit(self, func, *args, **kwargs):
+        '''
+          Queue func in the priority class of the running job, it runs in a copy of the caller's context.
+        '''
+        future = Future()
+        with self._condition:
+            if not self._threads:
+                self._start()
+            self.queues[context.priority()].append((future, contextvars.copy_context(), func, args, kwargs, time.perf_counter()))
+            self._condition.notify_all()
+        return future
+
+    async def run(self, func, *args, **kwargs):
+        return await asyncio.wrap_future(self.submit(func, *args, **kwargs))
+
+def _run_job(func, args, kwargs):
+    with profiling.thread_profile():
+        return func(*args, **kwargs)
+
+_scheduler = None
+_process_pool = None
+_lock = threading.Lock()
+
+def scheduler():
+    global _scheduler
+    with _lock:
+        if _scheduler==None:
+            _scheduler = JobScheduler()
+    return _scheduler
+
+async def run(func, *args, **kwargs):
+    '''
+      Run the job on the shared scheduler and wait for its result without blocking the event loop.
+    '''
+    return await scheduler().run(func, *args, **kwargs)
+
+def submit_cpu(func, *args):
+    '''
+      Run func(*args) in the process pool, func and args must be picklable. With SCHEDULER_PROCESSES=0 it runs
+      in the calling thread instead, the returned future is already done.
+    '''
+    global _process_pool
+    processes = int(os.environ.get('SCHEDULER_PROCESSES', config.SCHEDULER_PROCESSES))
+    if processes<=0:
+        future = Future()
+        try:
+            future.set_result(func(*args))
+        except Exception as error:
+            future.set_exception(error)
+        return future
+    with _lock:
+        if _process_pool==None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            # spawn, forking a process which runs threads can copy a held lock into the child
+            _process_pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+    return _process_pool.submit(func, *args)
@@ -3,23 +3,34 @@
     Help you get the information to create the financial statements.
 '''
 import os
-from google.analytics.data_v1beta import BetaAnalyticsDataClient
-from google.analytics.data_v1beta.types import (
-    DateRange,
-    Dimension,
-    Metric,
-    RunReportRequest,
-    Filter, 
-    FilterExpression,
-    FilterExpressionList
-)
-from google.cloud import bigquery as bq
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 import math
-from openpyxl import Workbook
-from openpyxl.styles import PatternFill
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from dateutil.relativedelta import relativedelta
 from app.gql import gql_query
+import app.config as config
+import app.metrics as metrics
+import app.context as context
+import app.lease as lease
+from app.scheduler import submit_cpu
+
+_clients = {}
+_client_lock = threading.Lock()
+
+def bigquery_client():
+    with _client_lock:
+        if 'bigquery' not in _clients:
+            from google.cloud import bigquery as bq
+            _clients['bigquery'] = bq.Client()
+    return _clients['bigquery']
+
+def analytics_client():
+    with _client_lock:
+        if 'analytics' not in _clients:
+            from google.analytics.data_v1beta import BetaAnalyticsDataClient
+            _clients['analytics'] = BetaAnalyticsDataClient()
+    return _clients['analytics']
 
 homepage_title = "READr Mesh 讀選"
 newpage_title  = "最新 | READr Mesh 讀選"
@@ -89,11 +100,66 @@ query revenues{{
 }}
 '''
 
-def getRevenues(ga_resource_id, ga_months):
+def _revenue_rollup_schema():
+    from google.cloud import bigquery as bq
+    return [
+        bq.SchemaField("property", "STRING", mode="REQUIRED"),
+        bq.SchemaField("day", "DATE", mode="REQUIRED"),
+        bq.SchemaField("page_title", "STRING"),
+        bq.SchemaField("value", "FLOAT64", mode="REQUIRED"),
+    ]
+
+def getRevenues(ga_resource_id, ga_months, db_name: str=None, rollup_table: str=config.DEFAULT_REVENUE_ROLLUP_TABLE):
+    '''
+        Sum totalAdRevenue of each page title since ga_months ago.
+        GA is asked for per-day rows, the days older than GA_FRESHNESS_DAYS are closed and appended to the
+        daily rollup table `{db_name}.{rollup_table}`, so only the days missing there and the still fresh days
+        are requested again. Without db_name the whole window is requested from GA.
+    '''
     # setup ga days
     current_time = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
     start_datetime = current_time - relativedelta(months=ga_months)
     start_date = datetime.strftime(start_datetime, '%Y-%m-%d')
+    fresh_date = datetime.strftime(current_time - timedelta(days=config.GA_FRESHNESS_DAYS), '%Y-%m-%d')
+    window_days = [
+        datetime.strftime(start_datetime + timedelta(days=i), '%Y-%m-%d')
+        for i in range((current_time - start_datetime).days + 1)
+    ]
+
+    # closed days already in the rollup table, duplicated rows from concurrent runs are identical so MAX() dedupes them
+    stored_rows = []
+    if db_name:
+        from google.cloud import bigquery as bq
+        bq_client = bigquery_client()
+        rollup_id = f'{db_name}.{rollup_table}'
+        table = bq.Table(rollup_id, schema=_revenue_rollup_schema())
+        table.time_partitioning = bq.TimePartitioning(field="day")
+        bq_client.create_table(table, exists_ok=True, timeout=context.timeout())
+        QUERY = (
+            f'SELECT day, page_title, MAX(value) AS value FROM `{rollup_id}` '
+            f'WHERE property = "{ga_resource_id}" AND day >= DATE("{start_date}") AND day < DATE("{fresh_date}") '
+            'GROUP BY day, page_title;'
+        )
+        with metrics.track_dependency('bigquery', 'query'):
+            rows = bq_client.query(QUERY, timeout=context.timeout()).result(timeout=context.timeout())
+        stored_rows = [(row.day.isoformat(), row.page_title, row.value) for row in rows]
+    stored_days = set(day for day, _, _ in stored_rows)
+    query_days = [day for day in window_days if day not in stored_days or day>=fresh_date]
+    query_start_date = query_days[0]
+    revenue_table = {}
+    for day, page_title, value in stored_rows:
+        if page_title and day<query_start_date:
+            revenue_table[page_title] = revenue_table.get(page_title, 0.0) + value
+    print(f"getRevenues: {len(window_days)-len(query_days)} days from rollup, query GA since {query_start_date}")
+    from google.analytics.data_v1beta.types import (
+        DateRange,
+        Dimension,
+        Metric,
+        RunReportRequest,
+        Filter, 
+        FilterExpression,
+        FilterExpressionList
+    )
     
     # setup filter criteria
     filter_criteria = FilterExpression(
@@ -135,40 +201,158 @@ def getRevenues(ga_resource_id, ga_months):
         property=f"properties/{ga_resource_id}",
         dimensions=[
             Dimension(name="pageTitle"),
+            Dimension(name="date"),
         ],
         metrics=[
             Metric(name="totalAdRevenue"),  # 使用者
         ],
-        date_ranges=[DateRange(start_date=start_date, end_date="today")],
+        date_ranges=[DateRange(start_date=query_start_date, end_date="today")],
         dimension_filter=filter_criteria,
     )
-    client = BetaAnalyticsDataClient()
-    response = client.run_report(request)
+    client = analytics_client()
+    with metrics.track_dependency('ga', 'run_report'):
+        response = client.run_report(request)
 
-    # parse response
-    revenue_table = {}
-    total_revenue = 0
+    # parse response, the closed days missing from the rollup table are kept for the next run
+    rollup_rows = [
+        {"property": str(ga_resource_id), "day": day, "page_title": None, "value": 0.0} # marks the day as closed
+        for day in query_days if day<fresh_date and day not in stored_days
+    ]
+    closed_days = set(row['day'] for row in rollup_rows)
     for row in response.rows:
         dimension_value = str(row.dimension_values[0].value)
+        day = datetime.strptime(row.dimension_values[1].value, '%Y%m%d').strftime('%Y-%m-%d')
         metric_value = float(row.metric_values[0].value)
-        revenue_table[dimension_value] = metric_value
-        total_revenue += metric_value
-    revenue_table['total'] = total_revenue
+        revenue_table[dimension_value] = revenue_table.get(dimension_value, 0.0) + metric_value
+        if day in closed_days:
+            rollup_rows.append({"property": str(ga_resource_id), "day": day, "page_title": dimension_value, "value": metric_value})
+    if db_name and closed_days:
+        job_config = bq.LoadJobConfig(schema=_revenue_rollup_schema(), write_disposition=bq.WriteDisposition.WRITE_APPEND)
+        with metrics.track_dependency('bigquery', 'load'):
+            bq_client.load_table_from_json(rollup_rows, rollup_id, job_config=job_config, timeout=context.timeout()).result(timeout=context.timeout())
+        print(f"materialise {len(closed_days)} days of GA revenue into {rollup_id}")
+    revenue_table['total'] = sum(revenue_table.values())
     return revenue_table
 
-def getPublisherPageview(db_name: str, table_name: str, start_time: str):
+pageview_filter = (
+    '(resource.type="global") AND (jsonPayload.type="click-story" OR jsonPayload.type="click-related-story") '
+    'AND (jsonPayload.complementary.publishertarget="publisher")'
+)
+
+def _pageview_rollup_schema():
+    from google.cloud import bigquery as bq
+    return [
+        bq.SchemaField("day", "DATE", mode="REQUIRED"),
+        bq.SchemaField("targetid", "STRING"),
+        bq.SchemaField("view", "INT64", mode="REQUIRED"),
+    ]
+
+def _parse_utc(timestamp: str):
+    parsed = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+def _midnight(day):
+    return datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+
+def _merge_days(days: list):
+    '''
+        Merge sorted days into contiguous [start, end) datetime ranges.
+    '''
+    ranges = []
+    for day in days:
+        if ranges and ranges[-1][1]==_midnight(day):
+            ranges[-1][1] = _midnight(day+timedelta(days=1))
+        else:
+            ranges.append([_midnight(day), _midnight(day+timedelta(days=1))])
+    return ranges
+
+def getPublisherPageview(db_name: str, table_name: str, start_time: str, rollup_table: str=config.DEFAULT_PAGEVIEW_ROLLUP_TABLE, dry_run: bool=False):
+    '''
+        Count the publisher clicks since start_time, pv_table contains {publisher_id: pv_count} relationship.
+        Settled days are read from the daily rollup table `{db_name}.{rollup_table}`, only the days missing
+        there and the unsettled recent days are scanned from the click log, then the settled ones are appended
+        to the rollup table. If dry_run is True, return the estimated bytes of the click log scan instead.
+    '''
+    from google.cloud import bigquery as bq
+    client = bigquery_client()
+    rollup_id = f'{db_name}.{rollup_table}'
+    start_datetime = _parse_utc(start_time)
+    current_time = datetime.now(timezone.utc)
+    settled_end = (current_time - timedelta(days=config.PAGEVIEW_SETTLE_DAYS)).date()
+
+    # settled days which are fully covered by the window
+    first_day = start_datetime.date()
+    if start_datetime!=_midnight(first_day):
+        first_day += timedelta(days=1)
+    settled_days = [first_day+timedelta(days=i) for i in range((settled_end-first_day).days)]
+
+    # read the stored rollups, duplicated rows from concurrent runs are identical so MAX() dedupes them
+    pv_table = {}
+    stored_days = set()
+    if settled_days:
+        if not dry_run:
+            table = bq.Table(rollup_id, schema=_pageview_rollup_schema())
+            table.time_partitioning = bq.TimePartitioning(field="day")
+            client.create_table(table, exists_ok=True, timeout=context.timeout())
+        QUERY = (
+            f'SELECT day, targetid, MAX(view) AS view FROM `{rollup_id}` '
+            f'WHERE day >= DATE("{settled_days[0].isoformat()}") AND day <= DATE("{settled_days[-1].isoformat()}") '
+            'GROUP BY day, targetid;'
+        )
+        try:
+            with metrics.track_dependency('bigquery', 'query'):
+                rows = client.query(QUERY, timeout=context.timeout()).result(timeout=context.timeout())
+        except Exception as e:
+            if not dry_run:
+                raise
+            print(f"rollup table {rollup_id} is not readable, reason: {e}")
+            rows = []
+        for row in rows:
+            stored_days.add(row.day)
+            if row.targetid:
+                pv_table[row.targetid] = pv_table.get(row.targetid, 0) + row.view
+    missing_days = [day for day in settled_days if day not in stored_days]
+
+    # scan the click log only for the missing days and the unsettled part of the window
+    ranges = _merge_days(missing_days)
+    unsettled_start = max(start_datetime, _midnight(settled_end))
+    if start_datetime<_midnight(first_day) and _midnight(first_day)<=unsettled_start:
+        ranges.append([start_datetime, _midnight(first_day)])
+    ranges.append([unsettled_start, None])
+    conditions = []
+    for range_start, range_end in ranges:
+        condition = f'timestamp >= TIMESTAMP("{range_start.isoformat()}")'
+        if range_end:
+            condition += f' AND timestamp < TIMESTAMP("{range_end.isoformat()}")'
+        conditions.append(f'({condition})')
     QUERY = (
-        f'SELECT jsonPayload.complementary.targetid, COUNT(jsonPayload.complementary.targetid) AS view FROM `{db_name}.{table_name}` '
-        f'WHERE (resource.type="global") AND (jsonPayload.type="click-story" OR jsonPayload.type="click-related-story") AND (jsonPayload.complementary.publishertarget="publisher") AND timestamp >= TIMESTAMP("{start_time}")'
-        'GROUP BY jsonPayload.complementary.targetid;'
+        f'SELECT DATE(timestamp) AS day, jsonPayload.complementary.targetid AS targetid, COUNT(jsonPayload.complementary.targetid) AS view FROM `{db_name}.{table_name}` '
+        f'WHERE {pageview_filter} AND ({" OR ".join(conditions)}) '
+        'GROUP BY day, targetid;'
     )
-    client = bq.Client()
-    rows = client.query(QUERY).result()
-    
-    # parse response, pv_table contains {publisher_id: pv_count} relationship
-    pv_table = {}
+    if dry_run:
+        with metrics.track_dependency('bigquery', 'dry_run'):
+            job = client.query(QUERY, job_config=bq.QueryJobConfig(dry_run=True, use_query_cache=False), timeout=context.timeout())
+        print(f"getPublisherPageview dry run: {len(stored_days)} days from rollup, {len(missing_days)} days to materialise, {job.total_bytes_processed} bytes to scan")
+        return job.total_bytes_processed
+    with metrics.track_dependency('bigquery', 'query'):
+        rows = client.query(QUERY, timeout=context.timeout()).result(timeout=context.timeout())
+
+    # merge the scanned rows and keep the settled days for the next run
+    missing_days = set(missing_days)
+    rollup_rows = [{"day": day.isoformat(), "targetid": None, "view": 0} for day in missing_days] # marks the day as materialised
     for row in rows:
-        pv_table[row.targetid] = row.view
+        if row.targetid:
+            pv_table[row.targetid] = pv_table.get(row.targetid, 0) + row.view
+        if row.day in missing_days:
+            rollup_rows.append({"day": row.day.isoformat(), "targetid": row.targetid, "view": row.view})
+    if missing_days:
+        job_config = bq.LoadJobConfig(schema=_pageview_rollup_schema(), write_disposition=bq.WriteDisposition.WRITE_APPEND)
+        with metrics.track_dependency('bigquery', 'load'):
+            client.load_table_from_json(rollup_rows, rollup_id, job_config=job_config, timeout=context.timeout()).result(timeout=context.timeout())
+        print(f"materialise {len(missing_days)} days of pageview into {rollup_id}")
     return pv_table
 
 def calculateMutualFund(homepage_revenue: float, newpage_revenue: float):
@@ -235,6 +419,8 @@ def createRevenuesData(gql_endpoint, shares_table: dict, start_date: str, end_da
     return data
 
 def createMonthStatement(start_date: str, end_date: str, gql_endpoint: str, adsense_revenue: float, gam_revenue: float, mesh_income: float, mutual_fund: float, user_points: int, publisher_share_table: dict, pv_table, adsense_complementary: str="", gam_complementary: str="", point_complementary: str=""):
+    from openpyxl import Workbook
+    from openpyxl.styles import PatternFill
     wb = Workbook()
     ws = wb.active
     current_time = datetime.now()
@@ -322,7 +508,15 @@ def createMonthStatement(start_date: str, end_date: str, gql_endpoint: str, adse
     return filename
 
 
-def createMediaStatements(gql_endpoint: str, domain: str, start_date: str, end_date: str, charge_percent: float=0.1):
+def createMediaStatements(gql_endpoint: str, domain: str, start_date: str, end_date: str, charge_percent: float=0.1, publish=None, checkpoint=None):
+    '''
+        Create the quarter statement of every publisher and register them in the CMS, return the new files.
+        The workbooks are written in parallel by the process pool of the scheduler. publish(filename) is called
+        as soon as a statement is saved. With a checkpoint, the publishers it has marked are not created again,
+        they are only registered in the CMS along with the others.
+        When the deadline of the run gets close, the statements written so far are published, the others are cancelled
+        and DeadlineExceeded is raised before the CMS is updated, a retry of the period creates the rest.
+    '''
     current_time = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
     date = current_time.strftime("%Y-%m-%d")
     filenames = []
@@ -351,59 +545,16 @@ def createMediaStatements(gql_endpoint: str, domain: str, start_date: str, end_d
     var_statements = {
         "data": []
     }
+    workbooks = [] # (publisher id, filename, future of the workbook)
     for publisher in publishers:
         pid, customId, title = publisher['id'], publisher['customId'], publisher['title']
         folder = os.path.join("statements", "media", customId)
         if not os.path.exists(folder):
             os.makedirs(folder)
         filename = os.path.join(folder, f"quarter-statement-{date}.xlsx")
-        
-        # excel: global setting
-        wb = Workbook()
-        ws = wb.active
-        ws.column_dimensions["A"].width = 40
-        ws.column_dimensions["B"].width = 70
-        ws.column_dimensions["C"].width = 20
-        ws.column_dimensions["D"].width = 20
-        ws.column_dimensions["E"].width = 20
-        ws.column_dimensions["F"].width = 20
-        
-        # excel: title
-        start_row = 1
-        ws.merge_cells(f"A{start_row}:F{start_row}")
-        ws[f'A{start_row}'] = f"報表區間: {start_date}-{end_date}"
-        ws[f'A{start_row+1}'], ws[f'B{start_row+1}'], ws[f'C{start_row+1}'] = "建立日期", "金流編號", "項目"
-        ws[f'D{start_row+1}'], ws[f'E{start_row+1}'], ws[f'F{start_row+1}'] = "收取金額", "手續費", "實際收取金額"
-        
-        # excel: add exchanges information
-        item_row = start_row+2 
-        publisher_exchanges = exchange_table.get(pid, [])
-        for exchange in publisher_exchanges:
-            tid = exchange['tid']
-            exchangeVolume = exchange['exchangeVolume']
-            charge = math.ceil(exchangeVolume*charge_percent)
-            createdAt = exchange['createdAt']
-            ws[f'A{item_row}'], ws[f'B{item_row}'], ws[f'C{item_row}'] = createdAt, tid, "點數兌換"
-            ws[f'D{item_row}'], ws[f'E{item_row}'], ws[f'F{item_row}'] = exchangeVolume, charge, (exchangeVolume-charge)
-            item_row += 1
-        publisher_revenues = revenue_table.get(pid, [])
-        for revenue in publisher_revenues:
-            type_name = revenue['type']
-            if type_name != "story_ad_revenue":
-                continue
-            type_name = "廣告收益"
-            start_date = revenue['start_date']
-            month = datetime.strptime(start_date, '%Y-%m-%dT%H:%M:%S.%fZ').strftime('%m')
-            item_name = f"{month}月{type_name}"
-            value = revenue['value']
-            charge = math.ceil(value*charge_percent)
-            ws[f'A{item_row}'], ws[f'B{item_row}'], ws[f'C{item_row}'] = start_date, "", item_name
-            ws[f'D{item_row}'], ws[f'E{item_row}'], ws[f'F{item_row}'] = value, charge, (value-charge)
-            item_row += 1
-            
-        # file processing
-        wb.save(filename)
-        filenames.append(filename)
+        if checkpoint==None or not checkpoint.done(pid):
+            workbook = submit_cpu(createMediaStatement, filename, start_date, end_date, exchange_table.get(pid, []), revenue_table.get(pid, []), charge_percent)
+            workbooks.append((pid, filename, workbook))
         var_statements["data"].append({
             "title": f"{title}每期媒體報表",
             "type": "quarter",
@@ -416,7 +567,83 @@ def createMediaStatements(gql_endpoint: str, domain: str, start_date: str, end_d
             "start_date": start_date,
             "end_date": end_date,
         })
-        
+
+    def publish_statement(pid, filename):
+        filenames.append(filename)
+        if publish:
+            publish(filename)
+        if checkpoint:
+            checkpoint.mark(pid)
+
+    for index, (pid, filename, workbook) in enumerate(workbooks):
+        left = context.remaining()
+        try:
+            if left!=None and left<=config.JOB_PUBLISH_RESERVE:
+                raise FutureTimeoutError()
+            workbook.result(timeout=None if left==None else left-config.JOB_PUBLISH_RESERVE)
+        except FutureTimeoutError:
+            rest = workbooks[index:]
+            # the workbooks which are not written yet are left to a retry, only those not started can be cancelled
+            for _, _, future in rest:
+                future.cancel()
+            written = [(pid, filename) for pid, filename, future in rest if future.done() and not future.cancelled() and future.exception()==None]
+            for pid, filename in written:
+                publish_statement(pid, filename)
+            context.count('statements_skipped', len(rest)-len(written))
+            print(f"media statements stop before the deadline, {len(rest)-len(written)} statements are skipped")
+            raise context.DeadlineExceeded(f'deadline of the media statements exceeded, {len(rest)-len(written)} statements are left')
+        publish_statement(pid, filename)
+
     # update CMS
+    lease.check()
     gql_query(gql_endpoint, gql_create_statements, var_statements)
-    return filenames
\ No newline at end of file
+    return filenames
+
+def createMediaStatement(filename: str, start_date: str, end_date: str, publisher_exchanges: list, publisher_revenues: list, charge_percent: float=0.1):
+    '''
+        Write the quarter statement xlsx of one publisher.
+    '''
+    from openpyxl import Workbook
+    # excel: global setting
+    wb = Workbook()
+    ws = wb.active
+    ws.column_dimensions["A"].width = 40
+    ws.column_dimensions["B"].width = 70
+    ws.column_dimensions["C"].width = 20
+    ws.column_dimensions["D"].width = 20
+    ws.column_dimensions["E"].width = 20
+    ws.column_dimensions["F"].width = 20
+    
+    # excel: title
+    start_row = 1
+    ws.merge_cells(f"A{start_row}:F{start_row}")
+    ws[f'A{start_row}'] = f"報表區間: {start_date}-{end_date}"
+    ws[f'A{start_row+1}'], ws[f'B{start_row+1}'], ws[f'C{start_row+1}'] = "建立日期", "金流編號", "項目"
+    ws[f'D{start_row+1}'], ws[f'E{start_row+1}'], ws[f'F{start_row+1}'] = "收取金額", "手續費", "實際收取金額"
+    
+    # excel: add exchanges information
+    item_row = start_row+2 
+    for exchange in publisher_exchanges:
+        tid = exchange['tid']
+        exchangeVolume = exchange['exchangeVolume']
+        charge = math.ceil(exchangeVolume*charge_percent)
+        createdAt = exchange['createdAt']
+        ws[f'A{item_row}'], ws[f'B{item_row}'], ws[f'C{item_row}'] = createdAt, tid, "點數兌換"
+        ws[f'D{item_row}'], ws[f'E{item_row}'], ws[f'F{item_row}'] = exchangeVolume, charge, (exchangeVolume-charge)
+        item_row += 1
+    for revenue in publisher_revenues:
+        type_name = revenue['type']
+        if type_name != "story_ad_revenue":
+            continue
+        type_name = "廣告收益"
+        revenue_start = revenue['start_date']
+        month = datetime.strptime(revenue_start, '%Y-%m-%dT%H:%M:%S.%fZ').strftime('%m')
+        item_name = f"{month}月{type_name}"
+        value = revenue['value']
+        charge = math.ceil(value*charge_percent)
+        ws[f'A{item_row}'], ws[f'B{item_row}'], ws[f'C{item_row}'] = revenue_start, "", item_name
+        ws[f'D{item_row}'], ws[f'E{item_row}'], ws[f'F{item_row}'] = value, charge, (value-charge)
+        item_row += 1
+        
+    # file processing
+    wb.save(filename)
\ No newline at end of file
@@ -1,21 +1,62 @@
 import os
-import json
-from google.cloud import storage
+import shutil
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 import app.config as config
-import requests
+import app.metrics as metrics
+import app.codec as codec
+import app.context as context
+import app.limiter as limiter
+import app.lease as lease
+from app.profiling import phase
+from urllib.parse import urlparse
 import uuid
 import datetime
 
+_storage_client = None
+_http_session = None
+_http_lock = threading.Lock()
+
+def storage_client():
+    '''
+    Shared GCS client, created on first use.
+    '''
+    global _storage_client
+    with _http_lock:
+        if _storage_client==None:
+            from google.cloud import storage
+            _storage_client = storage.Client()
+    return _storage_client
+
 ### upload
-def upload_blob(dest_filename, bucket_name: str = os.environ['BUCKET'], cache_control: str = 'cache_control_short'):
-    ### with service account attached to the service
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(dest_filename)
-    blob.upload_from_filename(dest_filename)
-    blob.cache_control = config.upload_configs[cache_control]
-    blob.patch()
+def upload_blob(dest_filename, artifact: str, bucket_name: str = None, cache_control: str = 'cache_control_short'):
+    '''
+    Upload the file to the bucket, artifact names the kind of file in the upload metrics (never the path, which grows with dates and ids).
+    '''
+    bucket_name = bucket_name or os.environ['BUCKET']
+    lease.check()
+    with metrics.track_upload(artifact, os.path.getsize(dest_filename)):
+        if os.environ.get('STORAGE_BACKEND', 'gcs')=='local':
+            upload_local(dest_filename, bucket_name)
+            return
+        ### with service account attached to the service
+        bucket = storage_client().bucket(bucket_name)
+        blob = bucket.blob(dest_filename)
+        blob.upload_from_filename(dest_filename, timeout=context.timeout(config.UPLOAD_TIMEOUT))
+        blob.cache_control = config.upload_configs[cache_control]
+        blob.patch(timeout=context.timeout(config.UPLOAD_TIMEOUT))
     print(f'upload {dest_filename} to blob {bucket_name} successfully')
+
+def upload_local(dest_filename, bucket_name: str):
+    '''
+    Local storage backend, copy the file into LOCAL_STORAGE_DIR/<bucket_name>/ for development and benchmarks.
+    '''
+    storage_dir = os.environ.get('LOCAL_STORAGE_DIR', config.DEFAULT_LOCAL_STORAGE_DIR)
+    dest_path = os.path.join(storage_dir, bucket_name, dest_filename)
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    shutil.copyfile(dest_filename, dest_path)
+    print(f'upload {dest_filename} to local bucket {bucket_name} successfully')
     
 ### files operations
 def save_file(dest_filename, data):
@@ -23,24 +64,54 @@ def save_file(dest_filename, data):
         dirname = os.path.dirname(dest_filename)
         if len(dirname)>0 and not os.path.exists(dirname):
             os.makedirs(dirname)
-        with open(dest_filename, 'w', encoding='utf-8') as f:
-            f.write(json.dumps(data, ensure_ascii=False))
+        with phase('serialise'), open(dest_filename, 'wb') as f:
+            f.write(codec.dumps(data))
         print(f'save {dest_filename} successfully')
 
 def open_file(filename):
-    with open(filename, 'r', encoding='utf-8') as f:
-        file = json.load(f)
+    with open(filename, 'rb') as f:
+        file = codec.loads(f.read())
     return file
 
+def http_session():
+    '''
+    Shared requests session, its connection pool keeps the connections to each host alive between calls.
+    '''
+    global _http_session
+    with _http_lock:
+        if _http_session==None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            adapter = HTTPAdapter(pool_connections=config.HTTP_POOL_CONNECTIONS, pool_maxsize=config.HTTP_POOL_MAXSIZE)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _http_session = session
+    return _http_session
+
 def request_post(endpoint: str, body: dict):
     json_data, error_message = None, None
     try:
-        response = requests.post(endpoint, json=body, timeout=config.DEFAULT_REQUEST_TIMEOUT)
-        json_data = response.json()
+        with metrics.track_dependency('http', urlparse(endpoint).path or '/'), limiter.outbound(endpoint):
+            response = http_session().post(endpoint, json=body, timeout=context.timeout(config.DEFAULT_REQUEST_TIMEOUT))
+            response.raise_for_status()
+            json_data = response.json()
     except Exception as e:
         error_message = e
     return json_data, error_message
 
+def concurrent_map(func, items: list, max_workers: int):
+    '''
+    Call func on each item with at most max_workers threads, results keep the order of items.
+    Every call runs in a copy of the caller's context, so the profiling phases still count.
+    '''
+    if len(items)==0:
+        return []
+    context = contextvars.copy_context()
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        futures = [executor.submit(context.copy().run, func, item) for item in items]
+        return [future.result() for future in futures]
+
 def gen_uuid():
     return str(uuid.uuid4())[:8]
 
@@ -0,0 +1,77 @@
+'''
+    Warm-up of a fresh instance. All the shared clients are initialised in parallel and the reference
+    data is prefetched, so the first cronjob on the instance runs as fast as the following ones.
+    Only the dependencies configured by env are touched.
+'''
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+def _gql():
+    from app.gql import gql_schema, gql_fetch_publishers, gql_fetch_categories
+    gql_endpoint = os.environ['MESH_GQL_ENDPOINT']
+    gql_schema(gql_endpoint)
+    gql_fetch_publishers(gql_endpoint)
+    gql_fetch_categories(gql_endpoint)
+
+def _gcs():
+    from app.tool import storage_client
+    if os.environ.get('STORAGE_BACKEND', 'gcs')=='local':
+        return
+    storage_client().bucket(os.environ['BUCKET']).exists()
+
+def _bigquery():
+    from app.statement import bigquery_client
+    bigquery_client().query('SELECT 1').result()
+
+def _analytics():
+    from app.statement import analytics_client
+    analytics_client()
+
+def _mongo():
+    from app.mongo import mongo_client
+    mongo_client(os.environ['MONGO_URL']).admin.command('ping')
+
+def _postgres():
+    import app.postgres as postgres
+    with postgres.connection() as conn, conn.cursor() as cur:
+        cur.execute('SELECT 1')
+    postgres.read('SELECT 1')
+
+def _meilisearch():
+    from app.meilisearch import get_client
+    get_client().health()
+
+# dependency: (required env, initialiser)
+DEPENDENCIES = {
+    "gql": ('MESH_GQL_ENDPOINT', _gql),
+    "gcs": ('BUCKET', _gcs),
+    "bigquery": ('BIGQUERY_DB', _bigquery),
+    "analytics": ('GA_RESOURCE_ID', _analytics),
+    "mongo": ('MONGO_URL', _mongo),
+    "postgres": ('DB_HOST', _postgres),
+    "meilisearch": ('MEILISEARCH_HOST', _meilisearch),
+}
+
+def _timed(initialiser):
+    start = time.perf_counter()
+    status = 'ok'
+    try:
+        initialiser()
+    except Exception as e:
+        status = f'error: {e}'
+    return {"seconds": round(time.perf_counter()-start, 3), "status": status}
+
+def run():
+    '''
+      Initialise the configured dependencies in parallel and report how long each took.
+    '''
+    start = time.perf_counter()
+    dependencies = {name: initialiser for name, (env, initialiser) in DEPENDENCIES.items() if os.environ.get(env)}
+    report = {}
+    if dependencies:
+        with ThreadPoolExecutor(max_workers=len(dependencies)) as executor:
+            futures = {name: executor.submit(_timed, initialiser) for name, initialiser in dependencies.items()}
+            report = {name: future.result() for name, future in futures.items()}
+    print(f"warm up in {time.perf_counter()-start:.3f}s: {report}")
+    return {"seconds": round(time.perf_counter()-start, 3), "dependencies": report}
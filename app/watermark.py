@@ -0,0 +1,51 @@
+'''
+    Change detection for the jobs which republish the same data on every run.
+    A job probes its source with a cheap query first, and is skipped when the probe equals the watermark
+    saved by its last successful run. Watermarks older than WATERMARK_MAX_AGE are ignored, so every job
+    still runs in full periodically and picks up the changes its probe cannot see.
+'''
+import os
+import json
+import time
+import app.config as config
+import app.metrics as metrics
+from app.cache import connect_cache
+
+def _connect():
+    conn = connect_cache('watermark')
+    conn.execute('CREATE TABLE IF NOT EXISTS watermark(job TEXT PRIMARY KEY, value TEXT, saved_at REAL)')
+    return conn
+
+def _encode(value):
+    return json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+
+def unchanged(job: str, value):
+    '''
+      True when the probe value equals the fresh watermark of the job, a None value (failed probe) never matches.
+    '''
+    if value==None:
+        return False
+    max_age = int(os.environ.get('WATERMARK_MAX_AGE', config.WATERMARK_MAX_AGE))
+    conn = _connect()
+    try:
+        row = conn.execute('SELECT value, saved_at FROM watermark WHERE job=?', (job,)).fetchone()
+    finally:
+        conn.close()
+    if row==None or row[0]!=_encode(value) or time.time()-row[1]>max_age:
+        return False
+    print(f"{job}: source unchanged since the last run, skipped")
+    metrics.job_noops.labels(job).inc()
+    return True
+
+def save(job: str, value):
+    '''
+      Save the probe value taken before a successful run.
+    '''
+    if value==None:
+        return
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO watermark VALUES (?, ?, ?)', (job, _encode(value), time.time()))
+    finally:
+        conn.close()
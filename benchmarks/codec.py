@@ -0,0 +1,83 @@
+'''
+    Micro-benchmark of the artifact JSON codecs over payloads shaped like the uploaded files.
+
+    python -m benchmarks.codec --stories 240 --repeat 20
+
+    Compares every installed codec of app/codec.py with the previous stdlib call,
+    json.dumps(data, ensure_ascii=False), and reports the encode/decode time and output size.
+'''
+import argparse
+import json
+import sys
+import time
+from benchmarks.fixtures import build_fixtures
+from app.codec import CODECS, load_codec
+
+def _story(story: dict):
+    return {
+        "id": story['id'],
+        "url": story['url'],
+        "title": story['title'],
+        "summary": story['summary'],
+        "category": {"id": story['category']['id'], "slug": story['category']['slug']},
+        "source": {"id": story['source']['id'], "title": story['source']['title'], "customId": story['source']['customId']},
+        "published_date": story['published_date'],
+        "og_title": story['og_title'],
+        "og_image": story['og_image'],
+        "og_description": story['og_description'],
+        "full_content": story['full_content'],
+        "paywall": story['paywall'],
+        "full_screen_ad": story['full_screen_ad'],
+        "picksCount": len(story['pick']),
+        "picks": [{"createdAt": pick['createdAt'], "member": {"id": pick['member']['id'], "name": pick['member']['name'], "avatar": pick['member']['avatar']}} for pick in story['pick'][:5]],
+        "commentCount": len(story['comment']),
+    }
+
+def payloads(stories: int):
+    data = build_fixtures(publishers=25, stories=stories*25, members=2000, comments=2000)
+    publisher = data['publishers'][1]
+    publisher_stories = [_story(story) for story in data['stories'] if story['source'] is publisher][:stories]
+    return {
+        "publisher_stories": {"source": {key: publisher[key] for key in ('id', 'customId', 'title', 'official_site', 'logo', 'description', 'followerCount', 'sponsoredCount')}, "stories": publisher_stories},
+        "most_read_stories": publisher_stories[:10],
+        "media_statistics": {item['id']: {"title": item['title'], "readsCount": item['sponsoredCount']} for item in data['publishers']},
+        "invalid_names": [item['name'].lower() for item in data['invalidNames']],
+    }
+
+def _measure(func, arg, repeat: int):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(arg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best==None else min(best, elapsed)
+    return best, result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stories', type=int, default=240, help='stories in the publisher payload')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    codecs = {"json (before)": (lambda data: json.dumps(data, ensure_ascii=False).encode('utf-8'), json.loads)}
+    for name in CODECS.keys():
+        try:
+            codecs[name] = load_codec(name)[1:]
+        except ImportError:
+            print(f'{name} is not installed, skipped')
+
+    print(f"{'payload':<20}{'codec':<16}{'encode(ms)':>12}{'decode(ms)':>12}{'size(KB)':>10}{'speedup':>9}")
+    for payload_name, payload in payloads(args.stories).items():
+        baseline = None
+        for codec_name, (dumps, loads) in codecs.items():
+            encode_s, content = _measure(dumps, payload, args.repeat)
+            decode_s, decoded = _measure(loads, content, args.repeat)
+            if decoded!=json.loads(json.dumps(payload)):
+                print(f'{codec_name} does not round-trip {payload_name}')
+                return 1
+            baseline = baseline or encode_s
+            print(f"{payload_name:<20}{codec_name:<16}{encode_s*1000:>12.3f}{decode_s*1000:>12.3f}{len(content)/1024:>10.1f}{baseline/encode_s:>8.1f}x")
+    return 0
+
+if __name__=='__main__':
+    sys.exit(main())
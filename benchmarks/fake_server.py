@@ -0,0 +1,403 @@
+'''
+    Local stand-in for the Keystone GraphQL endpoint and the mesh proxy.
+    The schema below only declares what app/ queries, input types are loose scalars so any
+    where/orderBy literal validates, and the resolvers evaluate those filters over the fixtures.
+'''
+import json
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from graphql import build_schema, graphql_sync, GraphQLList, GraphQLNonNull
+
+schema_sdl = '''
+scalar PublisherWhereInput
+scalar CategoryWhereInput
+scalar StoryWhereInput
+scalar StoryWhereUniqueInput
+scalar CommentWhereInput
+scalar MemberWhereInput
+scalar PickWhereInput
+scalar InvalidNameWhereInput
+scalar TransactionWhereInput
+scalar SponsorshipWhereInput
+scalar ExchangeWhereInput
+scalar RevenueWhereInput
+scalar OrderByInput
+scalar StoryOrderByInput
+scalar StatementCreateInput
+scalar RevenueCreateInput
+scalar TransactionUpdateArgs
+
+type Category {
+  id: ID!
+  slug: String
+}
+
+type Publisher {
+  id: ID!
+  title: String
+  customId: String
+  logo: String
+  description: String
+  official_site: String
+  source_type: String
+  full_content: Boolean
+  full_screen_ad: String
+  paywall: Boolean
+  sponsoredCount: Int
+  followerCount: Int
+  is_active: Boolean
+  createdAt: String
+}
+
+type Member {
+  id: ID!
+  name: String
+  nickname: String
+  email: String
+  avatar: String
+  customId: String
+  is_active: Boolean
+  followerCount: Int
+  pick(where: PickWhereInput, orderBy: [OrderByInput!], take: Int, skip: Int): [Pick!]
+  pickCount(where: PickWhereInput): Int
+}
+
+type Pick {
+  id: ID!
+  kind: String
+  is_active: Boolean
+  createdAt: String
+  member: Member
+  story: Story
+}
+
+type Story {
+  id: ID!
+  url: String
+  title: String
+  summary: String
+  category: Category
+  source: Publisher
+  published_date: String
+  og_title: String
+  og_image: String
+  og_description: String
+  full_content: Boolean
+  origid: String
+  paywall: Boolean
+  isMember: Boolean
+  full_screen_ad: String
+  pick(where: PickWhereInput, orderBy: [OrderByInput!], take: Int, skip: Int): [Pick!]
+  pickCount(where: PickWhereInput): Int
+  comment(where: CommentWhereInput, orderBy: [OrderByInput!], take: Int, skip: Int): [Comment!]
+  commentCount(where: CommentWhereInput): Int
+}
+
+type Comment {
+  id: ID!
+  content: String
+  member: Member
+  story: Story
+  published_date: String
+  createdAt: String
+  is_active: Boolean
+  like(where: MemberWhereInput, take: Int, skip: Int): [Member!]
+  likeCount(where: MemberWhereInput): Int
+}
+
+type InvalidName {
+  id: ID!
+  name: String
+}
+
+type Policy {
+  id: ID!
+  name: String
+  type: String
+}
+
+type Transaction {
+  id: ID!
+  status: String
+  active: Boolean
+  expireDate: String
+  member: Member
+  policy: Policy
+  unlockStory: Story
+}
+
+type Sponsorship {
+  id: ID!
+  publisher: Publisher
+  fee: Int
+  status: String
+  createdAt: String
+}
+
+type Exchange {
+  id: ID!
+  publisher: Publisher
+  tid: String
+  exchangeVolume: Int
+  status: String
+  createdAt: String
+}
+
+type Revenue {
+  id: ID!
+  publisher: Publisher
+  type: String
+  value: Float
+  start_date: String
+  createdAt: String
+}
+
+type Statement {
+  id: ID!
+}
+
+type Query {
+  publishers(where: PublisherWhereInput, orderBy: [OrderByInput!], take: Int, skip: Int): [Publisher!]
+  publishersCount(where: PublisherWhereInput): Int
+  categories(where: CategoryWhereInput, orderBy: [OrderByInput!], take: Int, skip: Int): [Category!]
+  stories(where: StoryWhereInput, orderBy: [StoryOrderByInput!], take: Int, skip: Int): [Story!]
+  storiesCount(where: StoryWhereInput): Int
+  story(where: StoryWhereUniqueInput!): Story
+  comments(where: CommentWhereInput, orderBy: [OrderByInput!], take: Int, skip: Int): [Comment!]
+  commentsCount(where: CommentWhereInput): Int
+  members(where: MemberWhereInput, orderBy: [OrderByInput!], take: Int, skip: Int): [Member!]
+  membersCount(where: MemberWhereInput): Int
+  picks(where: PickWhereInput, orderBy: [OrderByInput!], take: Int, skip: Int): [Pick!]
+  picksCount(where: PickWhereInput): Int
+  invalidNames(where: InvalidNameWhereInput, orderBy: [OrderByInput!], take: Int, skip: Int): [InvalidName!]
+  invalidNamesCount(where: InvalidNameWhereInput): Int
+  transactions(where: TransactionWhereInput, orderBy: [OrderByInput!], take: Int, skip: Int): [Transaction!]
+  sponsorships(where: SponsorshipWhereInput, orderBy: [OrderByInput!], take: Int, skip: Int): [Sponsorship!]
+  exchanges(where: ExchangeWhereInput, orderBy: [OrderByInput!], take: Int, skip: Int): [Exchange!]
+  revenues(where: RevenueWhereInput, orderBy: [OrderByInput!], take: Int, skip: Int): [Revenue!]
+}
+
+type Mutation {
+  createStatements(data: [StatementCreateInput!]!): [Statement!]
+  createRevenues(data: [RevenueCreateInput!]!): [Revenue!]
+  updateTransactions(data: [TransactionUpdateArgs!]!): [Transaction!]
+}
+'''
+
+### Keystone-like filters over the fixtures
+def _comparable(value):
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            pass
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    if isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+def _compare(value, operator, operand):
+    value, operand = _comparable(value), operand if operator in ('in', 'notIn') else _comparable(operand)
+    try:
+        if operator=='equals':
+            return value==operand
+        if operator=='not':
+            return not _compare(value, 'equals', operand) if not isinstance(operand, dict) else not _match_scalar(value, operand)
+        if operator=='in':
+            return value in [_comparable(item) for item in operand]
+        if operator=='notIn':
+            return value not in [_comparable(item) for item in operand]
+        if operator=='gt':
+            return value is not None and value>operand
+        if operator=='gte':
+            return value is not None and value>=operand
+        if operator=='lt':
+            return value is not None and value<operand
+        if operator=='lte':
+            return value is not None and value<=operand
+        if operator=='contains':
+            return operand in value
+    except TypeError:
+        return False
+    return True
+
+def _match_scalar(value, condition):
+    return all(_compare(value, operator, operand) for operator, operand in condition.items())
+
+def match(obj, where):
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key=='AND':
+            if not all(match(obj, item) for item in _as_list(condition)):
+                return False
+        elif key=='OR':
+            if not any(match(obj, item) for item in _as_list(condition)):
+                return False
+        elif key=='NOT':
+            if condition and any(match(obj, item) for item in _as_list(condition)):
+                return False
+        else:
+            value = obj.get(key)
+            if isinstance(value, list):
+                if 'some' in condition and not any(match(item, condition['some']) for item in value):
+                    return False
+                if 'every' in condition and not all(match(item, condition['every']) for item in value):
+                    return False
+                if 'none' in condition and any(match(item, condition['none']) for item in value):
+                    return False
+            elif isinstance(value, dict) or (value is None and not set(condition.keys()) & {'equals', 'not', 'in', 'notIn', 'gt', 'gte', 'lt', 'lte', 'contains'}):
+                if value is None or not match(value, condition):
+                    return False
+            elif not _match_scalar(value, condition):
+                return False
+    return True
+
+def _as_list(value):
+    return value if isinstance(value, list) else [value]
+
+def select(items, where=None, orderBy=None, take=None, skip=None):
+    items = [item for item in items if match(item, where)]
+    for order in reversed(_as_list(orderBy or [])):
+        for field, direction in order.items():
+            items.sort(key=lambda item: (item.get(field) is not None, _comparable(item.get(field))), reverse=direction=='desc')
+    if skip:
+        items = items[skip:]
+    if take is not None:
+        items = items[:take]
+    return items
+
+### schema wiring
+def build_fake_schema(data: dict):
+    schema = build_schema(schema_sdl)
+    for type_name, graphql_type in schema.type_map.items():
+        if type_name.startswith('__') or not hasattr(graphql_type, 'fields'):
+            continue
+        for field_name, field in graphql_type.fields.items():
+            field_type = field.type.of_type if isinstance(field.type, GraphQLNonNull) else field.type
+            if type_name=='Query':
+                field.resolve = _root_resolver(data, field_name)
+            elif type_name=='Mutation':
+                field.resolve = _mutation_resolver(data, field_name)
+            elif field_name.endswith('Count') and 'where' in field.args:
+                field.resolve = _count_resolver(field_name[:-len('Count')])
+            elif isinstance(field_type, GraphQLList) and field.args:
+                field.resolve = _list_resolver(field_name)
+    return schema
+
+def _root_resolver(data, field_name):
+    if field_name.endswith('Count'):
+        key = field_name[:-len('Count')]
+        return lambda root, info, where=None: len(select(data[key], where))
+    if field_name=='story':
+        def resolve_story(root, info, where):
+            stories = select(data['stories'], {"id": {"equals": where['id']}})
+            return stories[0] if stories else None
+        return resolve_story
+    return lambda root, info, **kwargs: select(data[field_name], **kwargs)
+
+def _count_resolver(key):
+    return lambda obj, info, where=None: len(select(obj.get(key, []), where))
+
+def _list_resolver(key):
+    return lambda obj, info, **kwargs: select(obj.get(key, []), **kwargs)
+
+def _mutation_resolver(data, field_name):
+    def resolve(root, info, **kwargs):
+        records = kwargs.get('data', [])
+        if field_name=='updateTransactions':
+            updated = []
+            for record in records:
+                for transaction in select(data['transactions'], {"id": {"equals": record['where']['id']}}):
+                    transaction.update(record['data'])
+                    updated.append(transaction)
+            return updated
+        return [{"id": str(idx)} for idx, _ in enumerate(records, start=1)]
+    return resolve
+
+### proxy stand-in, returns the category stories like the mesh proxy does
+def proxy_stories(data: dict, body: dict):
+    publisher_ids = set(str(id) for id in body.get('publishers', []))
+    category = str(body.get('category'))
+    stories = []
+    for story in data['stories']:
+        if story['category']['id']!=category or story['source']['id'] not in publisher_ids:
+            continue
+        stories.append({
+            "id": story['id'],
+            "url": story['url'],
+            "title": story['title'],
+            "published_date": story['published_date'],
+            "og_title": story['og_title'],
+            "og_image": story['og_image'],
+            "og_description": story['og_description'],
+            "full_screen_ad": story['full_screen_ad'],
+            "full_content": story['full_content'],
+            "commentCount": len(story['comment']),
+            "picksCount": len(story['pick']),
+            "source": {"id": story['source']['id']},
+        })
+    return {"stories": stories}
+
+class FakeServer:
+    '''
+        Serve POST /graphql and POST /proxy on a local port, counting requests and bytes.
+    '''
+    def __init__(self, data: dict, host: str='127.0.0.1', port: int=0):
+        self.data = data
+        self.schema = build_fake_schema(data)
+        self.lock = threading.Lock()
+        self.reset_stats()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length) or b'{}')
+                if self.path.startswith('/graphql'):
+                    result = graphql_sync(server.schema, body.get('query', ''), variable_values=body.get('variables'), operation_name=body.get('operationName'))
+                    payload = result.formatted
+                elif self.path.startswith('/proxy'):
+                    payload = proxy_stories(server.data, body)
+                else:
+                    self.send_error(404)
+                    return
+                content = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+                server.record(self.path, length, len(content))
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f'http://{host}:{self.httpd.server_address[1]}'
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def record(self, path: str, bytes_in: int, bytes_out: int):
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['bytes_in'] += bytes_in
+            self.stats['bytes_out'] += bytes_out
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {"requests": 0, "bytes_in": 0, "bytes_out": 0}
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
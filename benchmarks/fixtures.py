@@ -0,0 +1,142 @@
+'''
+    Synthetic CMS data for the benchmark stand-ins.
+    Relations are kept as nested python objects (story['source'] is the publisher dict, story['pick'] the pick dicts),
+    the fake GraphQL server resolves the queries in app/gql.py directly over them.
+'''
+import random
+from datetime import datetime, timedelta, timezone
+
+def _isoformat(dt: datetime):
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.') + f'{dt.microsecond//1000:03d}Z'
+
+def build_fixtures(publishers: int=25, stories: int=5000, members: int=2000, comments: int=5000, categories: int=8, days: int=10, seed: int=0):
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    data = {
+        "categories": [],
+        "publishers": [],
+        "members": [],
+        "stories": [],
+        "picks": [],
+        "comments": [],
+        "invalidNames": [],
+        "transactions": [],
+        "sponsorships": [],
+        "exchanges": [],
+        "revenues": [],
+    }
+
+    for idx in range(1, categories+1):
+        data['categories'].append({"id": str(idx), "slug": f"category{idx}"})
+    data['categories'].append({"id": str(categories+1), "slug": "test"})
+
+    for idx in range(1, publishers+1):
+        title = 'READr' if idx==1 else f'publisher {idx}'
+        data['publishers'].append({
+            "id": str(idx),
+            "title": title,
+            "customId": title.lower().replace(' ', '_'),
+            "logo": f"https://example.com/logo/{idx}.png",
+            "description": f"description of {title} " * 5,
+            "official_site": f"https://publisher{idx}.example.com",
+            "source_type": 'empty' if idx%10==0 else 'script',
+            "full_content": bool(idx%2),
+            "full_screen_ad": 'none',
+            "paywall": False,
+            "sponsoredCount": rng.randint(0, 500),
+            "followerCount": rng.randint(0, 5000),
+            "is_active": True,
+            "createdAt": _isoformat(now - timedelta(days=365)),
+        })
+
+    for idx in range(1, members+1):
+        data['members'].append({
+            "id": str(idx),
+            "name": f"member{idx}",
+            "nickname": f"nick{idx}",
+            "email": f"member{idx}@example.com",
+            "avatar": f"https://example.com/avatar/{idx}.png",
+            "customId": f"member{idx}",
+            "is_active": idx%50!=0,
+            "followerCount": rng.randint(0, 1000),
+            "pick": [],
+        })
+
+    pick_id = 0
+    for idx in range(1, stories+1):
+        publisher = rng.choice(data['publishers'])
+        published_date = now - timedelta(seconds=rng.randint(0, days*86400))
+        story = {
+            "id": str(idx),
+            "url": f"https://publisher{publisher['id']}.example.com/story/{idx}",
+            "title": f"story title {idx}",
+            "summary": f"summary of story {idx} " * 10,
+            "category": rng.choice(data['categories'][:categories]),
+            "source": publisher,
+            "published_date": _isoformat(published_date),
+            "og_title": f"story title {idx}",
+            "og_image": f"https://example.com/og/{idx}.jpg",
+            "og_description": f"og description of story {idx} " * 5,
+            "full_content": False,
+            "origid": str(idx),
+            "paywall": False,
+            "isMember": False,
+            "full_screen_ad": 'none',
+            "pick": [],
+            "comment": [],
+        }
+        for _ in range(int(rng.paretovariate(1.5))-1):
+            pick_id += 1
+            member = rng.choice(data['members'])
+            created_at = _isoformat(published_date + timedelta(seconds=rng.randint(0, 3600)))
+            pick = {
+                "id": str(pick_id),
+                "kind": 'read',
+                "is_active": True,
+                "createdAt": created_at,
+                "member": member,
+                "story": story,
+            }
+            story['pick'].append(pick)
+            member['pick'].append(pick)
+            data['picks'].append(pick)
+        data['stories'].append(story)
+
+    for idx in range(1, comments+1):
+        story = rng.choice(data['stories'])
+        published_date = _isoformat(now - timedelta(seconds=rng.randint(0, days*86400)))
+        comment = {
+            "id": str(idx),
+            "content": f"comment content {idx} " * 5,
+            "member": rng.choice(data['members']),
+            "story": story,
+            "published_date": published_date,
+            "createdAt": published_date,
+            "is_active": True,
+            "like": rng.sample(data['members'], min(len(data['members']), int(rng.paretovariate(1.2))-1)),
+        }
+        story['comment'].append(comment)
+        data['comments'].append(comment)
+
+    for idx in range(1, 51):
+        data['invalidNames'].append({"id": str(idx), "name": f"Invalid{idx}"})
+
+    for idx in range(1, min(members, 200)+1):
+        data['transactions'].append({
+            "id": str(idx),
+            "status": 'Success',
+            "active": True,
+            "expireDate": _isoformat(now + timedelta(days=rng.randint(-2, 5))),
+            "member": data['members'][idx-1],
+            "policy": {"id": "1", "name": "policy", "type": "unlock_single"},
+            "unlockStory": {"id": str(idx), "title": f"story title {idx}"},
+        })
+
+    for idx in range(1, publishers*20+1):
+        publisher = rng.choice(data['publishers'])
+        created_at = _isoformat(now - timedelta(days=rng.randint(0, 60)))
+        data['sponsorships'].append({"id": str(idx), "publisher": publisher, "fee": rng.randint(10, 1000), "status": 'Success', "createdAt": created_at})
+        data['exchanges'].append({"id": str(idx), "publisher": publisher, "tid": f"tid{idx}", "exchangeVolume": rng.randint(100, 10000), "status": 'Success', "createdAt": created_at})
+    for idx, publisher in enumerate(data['publishers'], start=1):
+        data['revenues'].append({"id": str(idx), "publisher": publisher, "type": 'story_ad_revenue', "value": rng.random()*1000, "start_date": _isoformat(now - timedelta(days=30)), "createdAt": _isoformat(now - timedelta(days=20))})
+    return data
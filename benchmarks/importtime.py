@@ -0,0 +1,74 @@
+'''
+    Import-time budget of the service entrypoint.
+
+    python -m benchmarks.importtime --budget-ms 800
+
+    Runs `python -X importtime -c "import main"` in a clean interpreter without any service env,
+    prints the heaviest modules and fails when the cumulative import time of main is over budget,
+    or when one of the heavy SDKs is imported at startup instead of inside the jobs using it.
+'''
+import argparse
+import os
+import subprocess
+import sys
+
+LAZY_MODULES = (
+    'google.cloud.storage',
+    'google.cloud.bigquery',
+    'google.analytics.data_v1beta',
+    'openpyxl',
+    'pymongo',
+    'psycopg2',
+    'meilisearch',
+    'gql',
+    'graphql',
+    'requests',
+    'numpy',
+)
+
+def measure(module: str='main', root: str=None):
+    '''
+      Return [(module, self_us, cumulative_us)] in import order.
+    '''
+    root = root or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {key: value for key, value in os.environ.items() if key in ('PATH', 'HOME', 'LANG', 'VIRTUAL_ENV', 'PYTHONPATH')}
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=root, env=env, capture_output=True, text=True,
+    )
+    if process.returncode!=0:
+        raise RuntimeError(f'import {module} failed:\n{process.stderr[-2000:]}')
+    imports = []
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imports.append((name.strip(), int(self_us), int(cumulative_us)))
+    return imports
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='main')
+    parser.add_argument('--budget-ms', type=float, default=800)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args(argv)
+
+    imports = measure(args.module)
+    total_ms = dict((name, cumulative) for name, _, cumulative in imports)[args.module]/1000
+    print(f"{'module':<50}{'cumulative(ms)':>16}")
+    for name, _, cumulative in sorted(imports, key=lambda item: item[2], reverse=True)[:args.top]:
+        print(f"{name:<50}{cumulative/1000:>16.1f}")
+
+    failures = []
+    eager = sorted(set(name for name, _, _ in imports for lazy in LAZY_MODULES if name==lazy or name.startswith(f'{lazy}.')))
+    if eager:
+        failures.append(f"heavy modules imported at startup: {', '.join(eager)}")
+    if total_ms>args.budget_ms:
+        failures.append(f"import {args.module} took {total_ms:.1f}ms, over the {args.budget_ms:.0f}ms budget")
+    print(f"\nimport {args.module}: {total_ms:.1f}ms (budget {args.budget_ms:.0f}ms)")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+if __name__=='__main__':
+    sys.exit(main())
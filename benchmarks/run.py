@@ -0,0 +1,169 @@
+'''
+    Run the cronjobs against local stand-ins and report wall time, requests, bytes and peak RSS.
+
+    python -m benchmarks.run --publishers 25 --stories 5000 --members 2000 --comments 5000
+    python -m benchmarks.run --jobs most_read_story,publisher_stories --json result.json
+
+    GraphQL and the mesh proxy are served by benchmarks.fake_server, GCS uploads go to a temp
+    dir through STORAGE_BACKEND=local and Mongo is replaced by mongomock when it is installed.
+    Every job runs in a fresh process, so peak RSS is measured per job.
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+from benchmarks.fixtures import build_fixtures
+from benchmarks.fake_server import FakeServer
+
+def _most_read_story():
+    import app.cronjob as cronjob
+    import app.config as config
+    from app.gql import gql_fetch_latest_stories
+    all_stories = gql_fetch_latest_stories(os.environ['MESH_GQL_ENDPOINT'], config.DEFAULT_MOST_READ_STORY_DAYS)
+    cronjob.most_read_story(all_stories)
+
+def _cronjob(name: str, **kwargs):
+    def run():
+        import app.cronjob as cronjob
+        getattr(cronjob, name)(**kwargs)
+    return run
+
+# job name: (runner, required stand-ins)
+JOBS = {
+    "most_sponsor_publisher": (_cronjob('most_sponsor_publisher', most_sponsors_num=5), []),
+    "most_read_story": (_most_read_story, []),
+    "most_followers": (_cronjob('most_follower_members', most_follower_num=5), ['postgres']),
+    "most_read_members": (_cronjob('most_read_members', most_read_member_days=7, most_read_member_num=5), []),
+    "media_statistics": (_cronjob('media_statistics', days=7), []),
+    "weekly_readr_posts": (_cronjob('recent_readr_stories', take=3), []),
+    "hotpage_sponsored_publishers": (_cronjob('hotpage_most_sponsor_publisher'), []),
+    "hotpage_most_popular_story": (_cronjob('hotpage_most_popular_story'), []),
+    "hotpage_most_like_comments": (_cronjob('hotpage_most_like_comments'), []),
+    "open_publishers": (_cronjob('open_publishers'), []),
+    "publisher_stories": (_cronjob('publisher_stories'), []),
+    "category_recommend_sponsors": (_cronjob('category_recommend_sponsors'), []),
+    "invalid_names": (_cronjob('invalid_names'), []),
+    "check_transactions": (_cronjob('check_transaction'), ['mongo']),
+    "month_statements": (_cronjob('month_statements'), ['bigquery', 'ga']),
+    "media_statements": (_cronjob('media_statements'), []),
+}
+
+def _peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak//1024 if sys.platform=='darwin' else peak
+
+def _child(job: str, env: dict, workdir: str, queue):
+    os.environ.update(env)
+    os.chdir(workdir)
+    sys.path.insert(0, env['BENCHMARK_ROOT'])
+    result = {"job": job, "error": None}
+    try:
+        if env.get('BENCHMARK_MONGO')=='mongomock':
+            import mongomock
+            import pymongo
+            pymongo.MongoClient = mongomock.MongoClient
+        import app.cronjob
+        result['rss_before_kb'] = _peak_rss_kb()
+        runner, _ = JOBS[job]
+        start = time.perf_counter()
+        try:
+            runner()
+        finally:
+            result['wall_s'] = time.perf_counter() - start
+    except Exception:
+        result['error'] = traceback.format_exc(limit=3)
+    result['peak_rss_kb'] = _peak_rss_kb()
+    queue.put(result)
+
+def _available_standins(args):
+    available = set()
+    if args.mongo:
+        available.add('mongo')
+    else:
+        try:
+            import mongomock
+            available.add('mongo')
+        except ImportError:
+            pass
+    for name in ('postgres', 'bigquery', 'ga'):
+        if name in args.with_services:
+            available.add(name)
+    return available
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--publishers', type=int, default=25)
+    parser.add_argument('--stories', type=int, default=5000)
+    parser.add_argument('--members', type=int, default=2000)
+    parser.add_argument('--comments', type=int, default=5000)
+    parser.add_argument('--categories', type=int, default=8)
+    parser.add_argument('--jobs', default='', help='comma separated job names, default all')
+    parser.add_argument('--mongo', default='', help='mongo url to use instead of mongomock')
+    parser.add_argument('--with-services', default='', help='comma separated real services to allow: postgres,bigquery,ga')
+    parser.add_argument('--json', default='', help='write the results into this file')
+    args = parser.parse_args(argv)
+
+    print(f'build fixtures: {args.publishers} publishers, {args.stories} stories, {args.members} members, {args.comments} comments')
+    data = build_fixtures(args.publishers, args.stories, args.members, args.comments, args.categories)
+    server = FakeServer(data).start()
+    available = _available_standins(args)
+    jobs = [job for job in args.jobs.split(',') if job] or list(JOBS.keys())
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    workdir = tempfile.mkdtemp(prefix='mesh-benchmark-')
+    env = {
+        "BENCHMARK_ROOT": root,
+        "MESH_GQL_ENDPOINT": f'{server.url}/graphql',
+        "MESH_PROXY_ENDPOINT": f'{server.url}/proxy',
+        "BUCKET": 'benchmark-bucket',
+        "PRIVATE_BUCKET": 'benchmark-private-bucket',
+        "PRIVATE_BUCKET_DOMAIN": 'https://storage.example.com/',
+        "STORAGE_BACKEND": 'local',
+        "LOCAL_STORAGE_DIR": os.path.join(workdir, 'storage'),
+        "CACHE_DIR": os.path.join(workdir, 'cache'),
+        "MONGO_URL": args.mongo or 'mongodb://localhost:27017',
+        "BENCHMARK_MONGO": '' if args.mongo else 'mongomock',
+        "MEILISEARCH_HOST": f'{server.url}/meilisearch',
+        "MEILISEARCH_APIKEY": 'benchmark',
+    }
+    context = multiprocessing.get_context('spawn')
+    results = []
+    try:
+        for job in jobs:
+            missing = [standin for standin in JOBS[job][1] if standin not in available]
+            if missing:
+                results.append({"job": job, "skipped": f"needs {','.join(missing)}"})
+                continue
+            server.reset_stats()
+            queue = context.Queue()
+            process = context.Process(target=_child, args=(job, env, workdir, queue))
+            process.start()
+            result = queue.get()
+            process.join()
+            result.update(server.stats)
+            results.append(result)
+    finally:
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\n{'job':<30}{'wall(s)':>10}{'requests':>10}{'sent(KB)':>10}{'recv(KB)':>10}{'peak RSS(MB)':>14}  status")
+    for result in results:
+        if 'skipped' in result:
+            print(f"{result['job']:<30}{'':>54}  skipped, {result['skipped']}")
+            continue
+        status = 'ok' if result['error']==None else 'error'
+        print(f"{result['job']:<30}{result.get('wall_s', 0):>10.3f}{result['requests']:>10}{result['bytes_in']/1024:>10.1f}{result['bytes_out']/1024:>10.1f}{result['peak_rss_kb']/1024:>14.1f}  {status}")
+    for result in results:
+        if result.get('error'):
+            print(f"\n{result['job']} failed:\n{result['error']}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"scale": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+
+if __name__=='__main__':
+    main()
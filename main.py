@@ -1,9 +1,19 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 import os
-from app.gql import gql_fetch_latest_stories, gql_fetch_media_statistics
+import json
+import time
+import asyncio
+from app.gql import gql_fetch_latest_stories
 import app.cronjob as cronjob
 import app.config as config
+import app.context as context
+import app.metrics as metrics
+import app.profiling as profiling
+import app.scheduler as scheduler
+import app.lease as lease
+import app.warmup as warmup
 
 ### App related variables
 app = FastAPI()
@@ -18,6 +28,127 @@ app.add_middleware(
     allow_headers = headers
 )
 
+def cronjob_name(request: Request):
+  '''
+  Job of a /cronjob/* request, None for the other requests and 'unknown' for the paths no job is routed to,
+  so they add no metric labels or leases.
+  '''
+  if not request.url.path.startswith('/cronjob/'):
+    return None
+  if request.url.path not in {route.path for route in app.routes}:
+    return 'unknown'
+  return request.url.path[len('/cronjob/'):]
+
+### the middleware registered last runs first: context, metrics, lease, profiling, then the job
+@app.middleware('http')
+async def cronjob_profiling(request: Request, call_next):
+  '''
+  Profile a /cronjob/* run when asked by ?profile=cpu|mem or the X-Profile header, or when sampled by PROFILE_SAMPLE_RATE.
+  Requested profiles are returned along with the result, sampled ones are only written into PROFILE_DIR.
+  Only one run is profiled at a time, a requested profile is null when another run was being profiled.
+  '''
+  if not request.url.path.startswith('/cronjob/'):
+    return await call_next(request)
+  requested = request.query_params.get('profile') or request.headers.get('X-Profile')
+  mode = profiling.choose_mode(requested)
+  if mode==None:
+    return await call_next(request)
+  session = profiling.start(cronjob_name(request), mode)
+  try:
+    response = await call_next(request)
+  finally:
+    summary = profiling.finish(session) if session!=None else None
+  if requested not in profiling.MODES:
+    return response
+  body = b''.join([chunk async for chunk in response.body_iterator])
+  try:
+    result = json.loads(body)
+  except ValueError:
+    result = body.decode('utf-8', errors='replace')
+  return JSONResponse({"result": result, "profile": summary}, status_code=response.status_code)
+
+@app.middleware('http')
+async def cronjob_lease(request: Request, call_next):
+  '''
+  Run a /cronjob/* only while holding the lease of the job, so scaled-out instances never run it twice at once.
+  When another run holds it, LEASE_POLICY=skip returns at once and coalesce waits for that run to end instead,
+  the job still runs when that run's lease expires without being released because its instance died.
+  '''
+  job = cronjob_name(request)
+  if job in (None, 'unknown') or not lease.enabled():
+    return await call_next(request)
+  job_lease = lease.Lease(job)
+  job_context = context.current()
+  try:
+    acquired = await asyncio.to_thread(job_lease.acquire)
+  except Exception as e:
+    print(f"lease {job}: unavailable, run without it, reason: {e}")
+    return await call_next(request)
+  if not acquired:
+    policy = os.environ.get('LEASE_POLICY', config.LEASE_POLICY)
+    context.count('lease_busy')
+    metrics.job_lease_busy.labels(job, policy).inc()
+    if policy=='coalesce':
+      if await asyncio.to_thread(lease.wait_released, job):
+        if job_context!=None:
+          job_context.outcome = config.LEASE_COALESCED_RESULT
+        return JSONResponse(config.LEASE_COALESCED_RESULT)
+      try:
+        acquired = await asyncio.to_thread(job_lease.acquire)
+      except Exception as e:
+        print(f"lease {job}: unavailable, reason: {e}")
+    if not acquired:
+      print(f"{job}: another run holds the lease, skipped")
+      if job_context!=None:
+        job_context.outcome = config.LEASE_BUSY_RESULT
+      return JSONResponse(config.LEASE_BUSY_RESULT)
+  if job_context!=None:
+    job_context.lease = job_lease
+  try:
+    return await call_next(request)
+  finally:
+    try:
+      await asyncio.to_thread(job_lease.release)
+    except Exception as e:
+      print(f"lease {job}: release failed, it expires in {job_lease.ttl}s, reason: {e}")
+    if job_lease.lost:
+      context.count('lease_lost')
+
+@app.middleware('http')
+async def cronjob_metrics(request: Request, call_next):
+  '''
+  Record the duration and result of every /cronjob/* run, the runs the lease kept from starting are labelled busy or coalesced.
+  '''
+  job = cronjob_name(request)
+  if job==None:
+    return await call_next(request)
+  start = time.perf_counter()
+  status = 'failure'
+  try:
+    response = await call_next(request)
+    if response.status_code<400:
+      job_context = context.current()
+      status = job_context.outcome if job_context!=None and job_context.outcome!=None else 'success'
+    return response
+  finally:
+    metrics.job_duration.labels(job, status).observe(time.perf_counter()-start)
+
+@app.middleware('http')
+async def cronjob_context(request: Request, call_next):
+  '''
+  Start the job context of a /cronjob/* run with a deadline before the request timeout, its stats (GraphQL retries,
+  hedges, rejected calls, skipped work) are logged and returned in the X-Job-Stats header.
+  '''
+  if not request.url.path.startswith('/cronjob/'):
+    return await call_next(request)
+  job = cronjob_name(request)
+  job_context = context.start(job, context.job_budget(job))
+  response = await call_next(request)
+  if job_context.stats:
+    print(f"{job_context.job} stats: {job_context.stats}")
+    response.headers['X-Job-Stats'] = json.dumps(job_context.stats)
+  return response
+
 ### API Design
 @app.get('/')
 async def health_checking():
@@ -26,6 +157,29 @@ async def health_checking():
   '''
   return {"message": "Health check for mesh-feed-parser"}
 
+@app.on_event('startup')
+async def warmup_on_startup():
+  '''
+  Warm up before serving when WARMUP_ON_STARTUP is set, so the instance is only ready once the clients are initialised.
+  '''
+  if os.environ.get('WARMUP_ON_STARTUP', '').lower() in ('1', 'true', 'yes'):
+    await asyncio.get_running_loop().run_in_executor(None, warmup.run)
+
+@app.get('/_ah/warmup')
+async def warmup_instance():
+  '''
+  Initialise the shared clients in parallel and prefetch the reference data, report how long each dependency took.
+  '''
+  return await asyncio.get_running_loop().run_in_executor(None, warmup.run)
+
+@app.get('/metrics')
+async def prometheus_metrics():
+  '''
+  Prometheus metrics of the cronjobs and their downstream calls.
+  '''
+  content, content_type = metrics.render()
+  return Response(content=content, media_type=content_type)
+
 @app.post('/cronjob/most_sponsor_publisher')
 async def data_most_sponser_publisher():
   '''
@@ -33,9 +187,12 @@ async def data_most_sponser_publisher():
   For each publisher, we also select the top-5 most recent stories. 
   '''
   MOST_SPONSOR_PUBLISHER_NUM = int(os.environ.get('MOST_SPONSOR_PUBLISHER_NUM', config.DEFAULT_MOST_SPONSOR_PUBLISHER_NUM))
-  cronjob.most_sponsor_publisher(
+  result = await scheduler.run(
+    cronjob.most_sponsor_publisher,
     most_sponsors_num = MOST_SPONSOR_PUBLISHER_NUM
   )
+  if result==config.NOOP_RESULT:
+    return config.NOOP_RESULT
   return "ok"
 
 @app.post('/cronjob/most_read_story')
@@ -45,23 +202,26 @@ async def data_most_pick_story():
   '''
   gql_endpoint = os.environ['MESH_GQL_ENDPOINT']
   most_read_story_days = int(os.environ.get('MOST_READ_STORY_DAYS', config.DEFAULT_MOST_READ_STORY_DAYS))
-  all_stories = gql_fetch_latest_stories(gql_endpoint, most_read_story_days)
-  cronjob.most_read_story(all_stories)
+  await scheduler.run(lambda: cronjob.most_read_story(gql_fetch_latest_stories(gql_endpoint, most_read_story_days)))
   return "ok"
 
 @app.post('/cronjob/most_followers')
 async def data_most_followers():
   most_follower_num = int(os.environ.get('MOST_FOLLOWER_NUM', config.DEFAULT_MOST_FOLLOWER_NUM))
-  cronjob.most_follower_members(
+  result = await scheduler.run(
+    cronjob.most_follower_members,
     most_follower_num=most_follower_num
   )
+  if result==config.NOOP_RESULT:
+    return config.NOOP_RESULT
   return "ok"
 
 @app.post('/cronjob/most_read_members')
 async def data_most_read_members():
   most_read_member_num = int(os.environ.get('MOST_READ_MEMBER_NUM', config.DEFAULT_MOST_READ_MEMBER_NUM))
   most_read_member_days = int(os.environ.get('MOST_READ_MEMBER_DAYS', config.DEFAULT_MOST_READ_MEMBER_DAYS))
-  cronjob.most_read_members(
+  await scheduler.run(
+    cronjob.most_read_members,
     most_read_member_days=most_read_member_days, 
     most_read_member_num=most_read_member_num
   )
@@ -69,15 +229,13 @@ async def data_most_read_members():
 
 @app.post('/cronjob/media_statistics')
 async def data_media_statistics():
-  gql_endpoint = os.environ['MESH_GQL_ENDPOINT']
   media_statistics_days = int(os.environ.get('MEDIA_STATISTICS_DAYS', config.DEFAULT_MEDIA_STATISTICS_DAYS))
-  all_stories = gql_fetch_media_statistics(gql_endpoint, media_statistics_days)
-  cronjob.media_statistics(all_stories)
+  await scheduler.run(cronjob.media_statistics, days=media_statistics_days)
   return "ok"
 
 @app.post('/cronjob/weekly_readr_posts')
 async def data_weekly_readr_post():
-  cronjob.recent_readr_stories(take=3)
+  await scheduler.run(cronjob.recent_readr_stories, take=3)
   return "ok"
 
 @app.post('/cronjob/hotpage_sponsored_publishers')
@@ -85,50 +243,54 @@ async def data_hotpage_sponsored_publishers():
   '''
     For main hotpage, we need to generate 3 most-sponsor publishers plus readr and their articles.
   '''
-  cronjob.hotpage_most_sponsor_publisher()
+  await scheduler.run(cronjob.hotpage_most_sponsor_publisher)
   return "ok"
 
 @app.post('/cronjob/hotpage_most_popular_story')
 async def data_hotpage_most_popular_story():
-  cronjob.hotpage_most_popular_story()
+  await scheduler.run(cronjob.hotpage_most_popular_story)
   return "ok"
 
 @app.post('/cronjob/hotpage_most_like_comments')
 async def data_hotpage_most_like_comments():
-  cronjob.hotpage_most_like_comments()
+  await scheduler.run(cronjob.hotpage_most_like_comments)
   return "ok"
 
 @app.post('/cronjob/open_publishers')
 async def data_open_publishers():
-  cronjob.open_publishers()
+  result = await scheduler.run(cronjob.open_publishers)
+  if result==config.NOOP_RESULT:
+    return config.NOOP_RESULT
   return "ok"
 
 @app.post('/cronjob/publisher_stories')
 async def data_publisher_stories():
-  cronjob.publisher_stories()
+  await scheduler.run(cronjob.publisher_stories)
   return "ok"
 
 @app.post('/cronjob/category_recommend_sponsors')
 async def data_category_recommend_sponsors():
-  cronjob.category_recommend_sponsors()
+  await scheduler.run(cronjob.category_recommend_sponsors)
   return "ok"
 
 @app.post('/cronjob/invalid_names')
 async def data_invalid_names():
-  cronjob.invalid_names()
+  result = await scheduler.run(cronjob.invalid_names)
+  if result==config.NOOP_RESULT:
+    return config.NOOP_RESULT
   return "ok"
 
 @app.post('/cronjob/check_transactions')
 async def data_check_transactions():
-  cronjob.check_transaction()
+  await scheduler.run(cronjob.check_transaction)
   return "ok"
 
 @app.post('/cronjob/month_statements')
 async def data_month_statements():
-  cronjob.month_statements()
+  await scheduler.run(cronjob.month_statements)
   return "ok"
 
 @app.post('/cronjob/media_statements')
 async def data_media_statements():
-  cronjob.media_statements()
+  await scheduler.run(cronjob.media_statements)
   return "ok"
\ No newline at end of file
@@ -0,0 +1,53 @@
+-- Follower count of every member, read by the most_followers cronjob instead of aggregating "_Member_follower".
+-- "_Member_follower" is the join table of Member.follower, "A" is the followed member and "B" the follower.
+-- The counts are kept current by statement triggers on the join table, so the job only walks the rank index.
+-- Apply it with the CMS migrations (Prisma layout: prisma/migrations/<name>/migration.sql).
+
+BEGIN;
+
+-- no writes to the follows between the backfill and the triggers
+LOCK TABLE "_Member_follower" IN SHARE MODE;
+
+CREATE TABLE mesh_member_follower_count (
+  member integer PRIMARY KEY,
+  follower_count integer NOT NULL
+);
+
+CREATE INDEX mesh_member_follower_count_rank ON mesh_member_follower_count (follower_count DESC, member);
+
+INSERT INTO mesh_member_follower_count (member, follower_count)
+  SELECT "A", count(*) FROM "_Member_follower" GROUP BY "A";
+
+CREATE FUNCTION mesh_member_follower_count_apply() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP IN ('DELETE', 'UPDATE') THEN
+    UPDATE mesh_member_follower_count c SET follower_count = c.follower_count - d.removed
+      FROM (SELECT "A", count(*) AS removed FROM old_rows GROUP BY "A" ORDER BY "A") d
+      WHERE c.member = d."A";
+    -- a member without followers has no count row, as after the backfill
+    DELETE FROM mesh_member_follower_count c
+      WHERE c.member IN (SELECT "A" FROM old_rows) AND c.follower_count <= 0;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    -- ordered, so concurrent statements lock the count rows in the same order
+    INSERT INTO mesh_member_follower_count AS c (member, follower_count)
+      SELECT "A", count(*) FROM new_rows GROUP BY "A" ORDER BY "A"
+      ON CONFLICT (member) DO UPDATE SET follower_count = c.follower_count + excluded.follower_count;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER mesh_member_follower_count_insert AFTER INSERT ON "_Member_follower"
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION mesh_member_follower_count_apply();
+
+CREATE TRIGGER mesh_member_follower_count_delete AFTER DELETE ON "_Member_follower"
+  REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION mesh_member_follower_count_apply();
+
+CREATE TRIGGER mesh_member_follower_count_update AFTER UPDATE ON "_Member_follower"
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION mesh_member_follower_count_apply();
+
+COMMIT;
@@ -0,0 +1,10 @@
+import pytest
+
+@pytest.fixture(autouse=True)
+def isolated_env(tmp_path, monkeypatch):
+    '''
+      Every test gets its own sqlite caches and no Mongo, so the local stores are used.
+    '''
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path/'cache'))
+    for name in ('MONGO_URL', 'CHECKPOINT_BACKEND', 'CHECKPOINT_WINDOW', 'WATERMARK_MAX_AGE', 'GQL_HEDGE_PERCENTILE'):
+        monkeypatch.delenv(name, raising=False)
@@ -0,0 +1,44 @@
+import time
+import app.checkpoint as checkpoint
+from app.checkpoint import Checkpoint, LocalStore
+
+def _at(monkeypatch, now: float):
+    monkeypatch.setattr(time, 'time', lambda: now)
+
+def test_retry_resumes_from_the_checkpoint(monkeypatch):
+    _at(monkeypatch, 36000-100)
+    first = Checkpoint('job', store=LocalStore())
+    first.mark('a')
+    first.mark(2)
+    # the retry crosses the hour
+    _at(monkeypatch, 36000+600)
+    retry = Checkpoint('job', store=LocalStore())
+    assert retry.window==first.window
+    assert retry.remaining(['a', 2, 'c'], key=str)==['c']
+
+def test_complete_clears_the_checkpoint(monkeypatch):
+    _at(monkeypatch, 36000)
+    run = Checkpoint('job', store=LocalStore())
+    run.mark('a')
+    run.complete()
+    assert Checkpoint('job', store=LocalStore()).remaining(['a'])==['a']
+
+def test_stale_checkpoint_is_not_resumed(monkeypatch):
+    monkeypatch.setenv('CHECKPOINT_WINDOW', '3600')
+    _at(monkeypatch, 36000)
+    Checkpoint('job', store=LocalStore()).mark('a')
+    _at(monkeypatch, 36000+3600)
+    assert Checkpoint('job', store=LocalStore()).remaining(['a'])==['a']
+
+def test_period_window_is_kept_apart(monkeypatch):
+    _at(monkeypatch, 36000)
+    Checkpoint('job', window='2026-07-01/2026-09-01', store=LocalStore()).mark('a')
+    assert Checkpoint('job', store=LocalStore()).remaining(['a'])==['a']
+    assert Checkpoint('job', window='2026-07-01/2026-09-01', store=LocalStore()).done('a')
+
+def test_backend_defaults_to_mongo_when_configured(monkeypatch):
+    assert checkpoint.backend()=='local'
+    monkeypatch.setenv('MONGO_URL', 'mongodb://localhost')
+    assert checkpoint.backend()=='mongo'
+    monkeypatch.setenv('CHECKPOINT_BACKEND', 'local')
+    assert checkpoint.backend()=='local'
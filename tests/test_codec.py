@@ -0,0 +1,15 @@
+import datetime
+import decimal
+import pytest
+from app.codec import CODECS, load_codec
+
+@pytest.mark.parametrize('name', list(CODECS))
+def test_codecs_write_the_same_json(name):
+    try:
+        _, dumps, loads = load_codec(name)
+    except ImportError:
+        pytest.skip(f'{name} is not installed')
+    data = {"title": "新聞", "at": datetime.datetime(2026, 1, 2, 3, 4, 5), "amount": decimal.Decimal('1.5')}
+    encoded = dumps(data)
+    assert isinstance(encoded, bytes)
+    assert loads(encoded)=={"title": "新聞", "at": "2026-01-02T03:04:05", "amount": 1.5}
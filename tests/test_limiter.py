@@ -0,0 +1,46 @@
+import app.config as config
+from app.limiter import AdaptiveLimiter
+
+def _limiter(in_flight: int=0):
+    limiter = AdaptiveLimiter('test')
+    limiter.observe(0.1)
+    limiter.in_flight = in_flight
+    return limiter
+
+def test_limit_grows_additively_while_in_use():
+    limiter = _limiter(in_flight=config.GQL_LIMIT_INITIAL)
+    limiter.observe(0.1)
+    assert limiter.limit==config.GQL_LIMIT_INITIAL+1/config.GQL_LIMIT_INITIAL
+
+def test_idle_limit_does_not_grow():
+    limiter = _limiter()
+    limiter.observe(0.1)
+    assert limiter.limit==config.GQL_LIMIT_INITIAL
+
+def test_overload_cuts_the_limit_once_per_round_trip():
+    limiter = _limiter(in_flight=4)
+    limiter.observe(0.1, overloaded=True)
+    assert limiter.limit==config.GQL_LIMIT_INITIAL*config.GQL_LIMIT_BACKOFF
+    limiter.observe(0.1, overloaded=True)
+    assert limiter.limit==config.GQL_LIMIT_INITIAL*config.GQL_LIMIT_BACKOFF
+
+def test_limit_never_falls_below_the_minimum():
+    limiter = _limiter(in_flight=4)
+    for _ in range(50):
+        limiter._last_decrease = 0
+        limiter.observe(0.1, overloaded=True)
+    assert limiter.limit==config.GQL_LIMIT_MIN
+
+def test_latency_rise_counts_as_overload():
+    limiter = _limiter(in_flight=4)
+    for _ in range(20):
+        limiter.observe(1.0)
+    assert limiter.limit<config.GQL_LIMIT_INITIAL
+
+def test_priority_shares_and_urgent_waiters():
+    limiter = AdaptiveLimiter('test')
+    limiter.in_flight = int(config.GQL_LIMIT_INITIAL*config.GQL_LIMIT_SHARES['batch'])
+    assert not limiter._allowed('batch')
+    assert limiter._allowed('realtime')
+    limiter.waiting['realtime'] = 1
+    assert not limiter._allowed('default')
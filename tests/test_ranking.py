@@ -0,0 +1,68 @@
+import random
+import pytest
+from collections import Counter
+from app.ranking import SpaceSaving, TopK, top_items
+
+def test_ties_keep_arrival_order():
+    items = [{"id": id, "count": count} for id, count in enumerate([3, 1, 3, 2, 3, 1, 2])]
+    key = lambda item: item['count']
+    assert top_items(items, 4, key=key)==sorted(items, key=key, reverse=True)[:4]
+    assert [item['id'] for item in top_items(items, 4, key=key)]==[0, 2, 4, 3]
+
+def test_same_as_sorting_over_pages():
+    rng = random.Random(7)
+    items = [rng.randint(0, 20) for _ in range(500)]
+    ranking = TopK(25)
+    for start in range(0, len(items), 60):
+        ranking.extend(items[start:start+60])
+    assert len(ranking)==25
+    assert ranking.result()==sorted(items, reverse=True)[:25]
+
+def test_fewer_items_than_k():
+    assert top_items([1, 3, 2], 10)==[3, 2, 1]
+
+def test_zero_k_keeps_nothing():
+    assert top_items([1, 2], 0)==[]
+
+def test_space_saving_is_exact_within_capacity():
+    sketch = SpaceSaving(5)
+    for key in 'abacabad':
+        sketch.add(key)
+    assert sketch.top(5)==[('a', 4, 0), ('b', 2, 0), ('c', 1, 0), ('d', 1, 0)]
+
+def test_space_saving_error_is_bounded():
+    rng = random.Random(11)
+    events = [min(int(rng.paretovariate(1.2)), 200) for _ in range(5000)]
+    sketch = SpaceSaving(20)
+    for key in events:
+        sketch.add(key)
+    counts = Counter(events)
+    assert len(sketch.counters)==20
+    for key, estimate, error in sketch.top(20):
+        assert error<=len(events)/20
+        assert estimate-error<=counts[key]<=estimate
+    heavy = [key for key, count in counts.items() if count>len(events)/20]
+    assert set(heavy)<=set(sketch.counters)
+
+def test_space_saving_decays_older_events():
+    sketch = SpaceSaving(10, half_life=60)
+    for _ in range(8):
+        sketch.add('old', timestamp=0)
+    for _ in range(3):
+        sketch.add('new', timestamp=180)
+    assert sketch.top(2, timestamp=180)==[('new', 3, 0), ('old', 1, 0)]
+    assert sketch.top(1, timestamp=240)==[('new', 1.5, 0)]
+
+def test_space_saving_rescales_without_overflow():
+    sketch = SpaceSaving(10, half_life=1)
+    sketch.add('a', timestamp=0)
+    sketch.add('a', timestamp=0)
+    sketch.add('b', timestamp=0)
+    sketch.add('b', timestamp=1000)
+    assert sketch._landmark==1000
+    [(key, estimate, _)] = sketch.top(1, timestamp=1000)
+    assert key=='b' and estimate==pytest.approx(1)
+
+def test_space_saving_rejects_non_positive_weight():
+    with pytest.raises(ValueError):
+        SpaceSaving(3).add('a', weight=0)
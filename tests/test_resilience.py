@@ -0,0 +1,119 @@
+import threading
+import pytest
+import requests
+import app.config as config
+import app.resilience as resilience
+from app.resilience import CircuitBreaker, CircuitOpenError
+
+def _open(circuit):
+    for _ in range(config.GQL_BREAKER_FAILURES):
+        circuit.record(success=False)
+
+def _reset_elapsed(circuit):
+    circuit.opened_at -= config.GQL_BREAKER_RESET
+
+def test_breaker_opens_after_consecutive_failures():
+    circuit = CircuitBreaker('test')
+    for _ in range(config.GQL_BREAKER_FAILURES-1):
+        circuit.record(success=False)
+    assert circuit.allow()
+    circuit.record(success=False)
+    assert not circuit.allow()
+
+def test_breaker_success_resets_the_streak():
+    circuit = CircuitBreaker('test')
+    for _ in range(config.GQL_BREAKER_FAILURES-1):
+        circuit.record(success=False)
+    circuit.record(success=True)
+    circuit.record(success=False)
+    assert circuit.allow()
+
+def test_breaker_lets_one_trial_through_after_reset():
+    circuit = CircuitBreaker('test')
+    _open(circuit)
+    _reset_elapsed(circuit)
+    assert circuit.allow()
+    assert not circuit.allow()
+
+def test_breaker_trial_success_closes():
+    circuit = CircuitBreaker('test')
+    _open(circuit)
+    _reset_elapsed(circuit)
+    assert circuit.allow()
+    circuit.record(success=True)
+    assert circuit.allow() and circuit.allow()
+
+def test_breaker_trial_failure_reopens():
+    circuit = CircuitBreaker('test')
+    _open(circuit)
+    _reset_elapsed(circuit)
+    assert circuit.allow()
+    circuit.record(success=False)
+    assert not circuit.allow()
+
+def test_breaker_release_ends_the_trial():
+    circuit = CircuitBreaker('test')
+    _open(circuit)
+    _reset_elapsed(circuit)
+    assert circuit.allow()
+    circuit.release()
+    assert circuit.allow()
+    assert circuit.opened_at!=None
+
+@pytest.fixture
+def endpoint(monkeypatch, request):
+    monkeypatch.setattr(config, 'GQL_RETRY_BASE_DELAY', 0)
+    return f'http://{request.node.name}'
+
+def test_call_retries_transient_errors(endpoint):
+    attempts = []
+    def flaky():
+        attempts.append(1)
+        if len(attempts)<config.GQL_RETRY_ATTEMPTS:
+            raise requests.exceptions.ConnectionError('down')
+        return 'ok'
+    assert resilience.call(flaky, 'test', endpoint)=='ok'
+    assert len(attempts)==config.GQL_RETRY_ATTEMPTS
+    assert resilience.breaker(endpoint).failures==0
+
+def test_call_sends_mutations_once(endpoint):
+    attempts = []
+    def down():
+        attempts.append(1)
+        raise requests.exceptions.ConnectionError('down')
+    with pytest.raises(requests.exceptions.ConnectionError):
+        resilience.call(down, 'test', endpoint, idempotent=False)
+    assert len(attempts)==1
+
+def test_call_keeps_query_errors_out_of_the_breaker(endpoint):
+    circuit = resilience.breaker(endpoint)
+    def down():
+        raise requests.exceptions.ConnectionError('down')
+    def invalid():
+        raise ValueError('validation error')
+    for func in (down, invalid, down):
+        with pytest.raises(Exception):
+            resilience.call(func, 'test', endpoint, idempotent=False)
+    assert circuit.failures==2
+
+def test_call_fails_fast_while_open(endpoint):
+    _open(resilience.breaker(endpoint))
+    calls = []
+    with pytest.raises(CircuitOpenError):
+        resilience.call(lambda: calls.append(1), 'test', endpoint)
+    assert calls==[]
+
+def test_hedge_wins_over_a_slow_call():
+    release = threading.Event()
+    calls = []
+    def func():
+        calls.append(1)
+        if len(calls)==1:
+            release.wait(5)
+            return 'slow'
+        return 'hedge'
+    try:
+        assert resilience.hedged(func, 0.05, 'test')=='hedge'
+    finally:
+        release.set()
+    assert len(calls)==2
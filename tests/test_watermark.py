@@ -0,0 +1,15 @@
+import app.watermark as watermark
+
+def test_unchanged_after_save():
+    watermark.save('job', {"latest": 1})
+    assert watermark.unchanged('job', {"latest": 1})
+    assert not watermark.unchanged('job', {"latest": 2})
+
+def test_failed_probe_never_matches():
+    watermark.save('job', None)
+    assert not watermark.unchanged('job', None)
+
+def test_old_watermark_is_ignored(monkeypatch):
+    watermark.save('job', {"latest": 1})
+    monkeypatch.setenv('WATERMARK_MAX_AGE', '-1')
+    assert not watermark.unchanged('job', {"latest": 1})